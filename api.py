@@ -0,0 +1,180 @@
+"""
+Формат JSON API (версия 1) для автоматической обработки.
+
+Наблюдения отдаются страницами JSON или потоком NDJSON (по строке на
+наблюдение). Строки собираются шаблоном из уже вычисленных столбцов: моменты
+переводятся в ISO 8601 одним вызовом NumPy на блок, числа — через repr
+(кратчайшая точная запись, совместимая с JSON), поэтому объекты json на
+каждое наблюдение не создаются. Пакетная загрузка принимает столбцы массивов
+или список наблюдений; ошибочные строки отбрасываются и перечисляются в
+ответе, остальные записываются.
+"""
+import json
+
+import numpy as np
+
+import validation
+from observation_store import datetimes_to_jd, jd_to_iso
+
+API_VERSION = 'v1'
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Столько наблюдений сериализуется за один шаг генератора
+STREAM_CHUNK = 2000
+MAX_BATCH = 100000
+# Сколько отброшенных строк каждого вида перечисляется в ответе на пакет
+MAX_REPORTED_ERRORS = 20
+
+
+def observation_rows(arrays, start=0, chunk=STREAM_CHUNK):
+    """
+    Блоки строк JSON по наблюдениям (без разделителей). arrays — (jd,
+    ra_hours, dec_degrees, снимки) в порядке хранилища, start — номер первого.
+    """
+    jd, ra_values, dec_values, image_names = arrays
+    for low in range(0, len(jd), chunk):
+        high = min(low + chunk, len(jd))
+        times = jd_to_iso(jd[low:high]).tolist()
+        yield [f'{{"index":{index},"jd":{t!r},"observation_time":"{iso}Z",'
+               f'"ra_hours":{ra!r},"dec_degrees":{dec!r},"image":{_string(image)}}}'
+               for index, t, iso, ra, dec, image in zip(
+                   range(start + low, start + high), jd[low:high].tolist(), times,
+                   ra_values[low:high].tolist(), dec_values[low:high].tolist(), image_names[low:high])]
+
+
+def _string(value):
+    return 'null' if value is None else json.dumps(value)
+
+
+def ndjson_stream(arrays, start=0):
+    for rows in observation_rows(arrays, start):
+        yield ('\n'.join(rows) + '\n').encode()
+
+
+def json_page_stream(header, arrays, start=0):
+    """Объект страницы: поля header, затем массив observations, собираемый по блокам"""
+    yield (json.dumps(header)[:-1] + ',"observations":[').encode()
+    separator = ''
+    for rows in observation_rows(arrays, start):
+        yield (separator + ','.join(rows)).encode()
+        separator = ','
+    yield b']}'
+
+
+def parse_observation_batch(payload):
+    """
+    Массивы (jd, ra_hours, dec_degrees) из тела пакетной загрузки: либо столбцы
+    {"ra_hours": [...], "dec_degrees": [...], "jd" или "observation_time": [...]},
+    либо {"observations": [{...}, ...]} с теми же полями у каждого наблюдения.
+    Неверная структура пакета — ValueError; нечисловые значения и неразборчивые
+    моменты становятся NaN, и такие строки отбрасывает проверка наблюдений.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+    if 'observations' in payload:
+        rows = payload['observations']
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('"observations" must be a list of objects')
+        time_field = 'jd' if rows and 'jd' in rows[0] else 'observation_time'
+        try:
+            columns = {name: [row[name] for row in rows] for name in ('ra_hours', 'dec_degrees', time_field)}
+        except KeyError as e:
+            raise ValueError(f"Every observation needs {e.args[0]!r}")
+    else:
+        time_field = 'jd' if 'jd' in payload else 'observation_time'
+        columns = {name: payload.get(name) for name in ('ra_hours', 'dec_degrees', time_field)}
+        missing = [name for name, column in columns.items() if not isinstance(column, list)]
+        if missing:
+            raise ValueError(f"Missing array(s): {', '.join(missing)}")
+        if len({len(column) for column in columns.values()}) != 1:
+            raise ValueError("Arrays must have the same length")
+
+    count = len(columns['ra_hours'])
+    if not count:
+        raise ValueError("No observations in the request")
+    if count > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} observations per request")
+    ra_values = _numbers(columns['ra_hours'])
+    dec_values = _numbers(columns['dec_degrees'])
+    if time_field == 'jd':
+        jd = _numbers(columns['jd'])
+    else:
+        jd = _times(columns['observation_time'])
+    return jd, ra_values, dec_values
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _numbers(values):
+    """Столбец чисел; нечисловые значения — NaN, чтобы отметить строку, а не весь пакет"""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([_number(value) for value in values])
+
+
+def _time(value):
+    try:
+        return float(datetimes_to_jd(str(value)))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _times(values):
+    try:
+        return datetimes_to_jd(np.asarray(values, dtype=str))
+    except (TypeError, ValueError):
+        return np.array([_time(value) for value in values])
+
+
+def rejected_document(flags):
+    """Отброшенные строки пакета по нарушениям (validation.validate_observations)"""
+    document = []
+    for flag, message in validation.MESSAGES.items():
+        rows = validation.flagged_rows(flags, flag)
+        if len(rows):
+            document.append({'error': message, 'count': len(rows),
+                             'rows': rows[:MAX_REPORTED_ERRORS].tolist()})
+    return document
+
+
+def elements_document(elements):
+    document = {
+        'a_au': elements.a,
+        'e': elements.e,
+        'i_deg': elements.i,
+        'raan_deg': elements.raan,
+        'arg_peri_deg': elements.arg_peri,
+        'q_au': elements.q,
+        't_peri_jd': elements.t_peri,
+        'period_days': elements.a ** 1.5 * 365.25 if elements.e < 1 else None,
+    }
+    fit = elements.fit
+    if fit is not None:
+        document['fit'] = {
+            'epoch_jd': fit.epoch,
+            'observations': fit.nobs,
+            'rms_arcsec': fit.rms_arcsec,
+            'iterations': fit.iterations,
+            'rejected': fit.rejected_count,
+            # Гелиоцентрическое состояние (а.е., а.е./сут, экватор J2000) и его ковариация
+            'state': np.asarray(fit.state).tolist(),
+            'covariance': None if fit.covariance is None else np.asarray(fit.covariance).tolist(),
+        }
+    return {name: float(value) if isinstance(value, np.floating) else value
+            for name, value in document.items()}
+
+
+def approach_document(approach):
+    return {
+        'jd': approach.jd,
+        'time': approach.time.isoformat() + 'Z',
+        'distance_au': float(approach.distance_au),
+        'distance_km': float(approach.distance_au) * 149597870.7,
+        'propagation': approach.propagation or 'two-body',
+    }
@@ -1,16 +1,36 @@
-from flask import Flask, render_template, request, flash, redirect, url_for
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, abort, \
+    make_response, send_file, Response, g
 import numpy as np
-from datetime import datetime
-from astropy.time import Time
-import astropy.units as u
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
 import os
-from werkzeug.utils import secure_filename
-import matplotlib.pyplot as plt
-import matplotlib
-
-matplotlib.use('Agg')  # Для работы без GUI
-import io
-import base64
+import threading
+import time
+from werkzeug.exceptions import HTTPException
+from werkzeug.utils import safe_join, secure_filename
+
+import api
+import earth
+import metrics
+import progress
+
+from astrometry import PlateSolution, measure_image
+from ephemeris import load_ephemeris
+from image_store import ImageStore
+from ingest import detect_format, import_observations
+from jobs import JobQueue, QueueFull, array_key
+from linking import link_observations
+from monte_carlo import DEFAULT_CLONES, CloseApproachDistribution, monte_carlo_close_approach
+from nbody import PerturbedOrbit
+from plot_renderer import FORMATS as PLOT_FORMATS, render_orbit_plot
+from profiling import SamplingProfiler
+from observation_store import ObservationStore, datetimes_to_jd
+from result_cache import ResultCache, result_key
+from workspaces import DEFAULT_OBJECT, Workspaces, valid_object_id
+from validation import MESSAGES as VALIDATION_MESSAGES, validate_observations
+from orbit import CLIP_SIGMA, J2000, OrbitalElements, find_close_approach, fit_orbit, refine_orbit
 
 app = Flask(__name__)
 app.secret_key = 'dev-secret-key'
@@ -20,36 +40,120 @@ app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 
-# Create upload directory if it doesn't exist
+# Uploads are stored once per distinct content; thumbnails are built in the background
+app.config['THUMBNAIL_WORKERS'] = int(os.environ.get('THUMBNAIL_WORKERS', 2))
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Store observations in memory
-observations = []
+images = ImageStore(app.config['UPLOAD_FOLDER'], workers=app.config['THUMBNAIL_WORKERS'])
+
+# Retention for uploaded images, enforced by a background sweeper: images older than
+# UPLOAD_MAX_AGE_DAYS are removed, then the oldest ones while uploads exceed UPLOAD_MAX_BYTES
+app.config['UPLOAD_MAX_AGE_DAYS'] = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', 0)) or None
+app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 0)) or None
+app.config['UPLOAD_SWEEP_INTERVAL'] = float(os.environ.get('UPLOAD_SWEEP_INTERVAL', 600))
+images.start_sweeper(app.config['UPLOAD_SWEEP_INTERVAL'],
+                     max_age=app.config['UPLOAD_MAX_AGE_DAYS'] and app.config['UPLOAD_MAX_AGE_DAYS'] * 86400,
+                     max_bytes=app.config['UPLOAD_MAX_BYTES'])
+
+# How far ahead to search for the closest approach to Earth
+CLOSE_APPROACH_SEARCH_YEARS = 50
+ORBIT_FIT_MAX_ITER = 50
+# Observations whose residual exceeds this many RMS are dropped from the fit (None disables clipping)
+ORBIT_CLIP_SIGMA = CLIP_SIGMA
+# Close approaches are searched on a two-body orbit or integrated with planetary perturbations
+PROPAGATION_MODES = {'two-body': 'Two-body (Sun only)', 'n-body': 'Perturbed by the major planets'}
+# Сколько последних добавленных наблюдений может уточнить прежнюю орбиту без полной подгонки
+INCREMENTAL_MAX_NEW = 8
+
+# Orbit calculations run in a process pool; the request only submits a job
+app.config['ORBIT_WORKERS'] = int(os.environ.get('ORBIT_WORKERS', 2))
+app.config['ORBIT_JOB_TIMEOUT'] = float(os.environ.get('ORBIT_JOB_TIMEOUT', 120))
+orbit_jobs = JobQueue(max_workers=app.config['ORBIT_WORKERS'],
+                      timeout=app.config['ORBIT_JOB_TIMEOUT'])
+# Each progress stream holds a server thread until its job ends, so streams may take all of the
+# gunicorn worker's threads (GUNICORN_THREADS) except a reserve for ordinary requests;
+# beyond this the page polls instead
+EVENT_STREAM_RESERVED_THREADS = 2
+app.config['EVENT_STREAMS_MAX'] = int(os.environ.get(
+    'EVENT_STREAMS_MAX',
+    max(int(os.environ.get('GUNICORN_THREADS', 8)) - EVENT_STREAM_RESERVED_THREADS, 1)))
+event_streams = threading.BoundedSemaphore(app.config['EVENT_STREAMS_MAX'])
+
+# Monte Carlo uncertainty analysis splits large clone sets across this many processes
+app.config['MONTE_CARLO_WORKERS'] = int(os.environ.get('MONTE_CARLO_WORKERS', os.cpu_count() or 1))
+MAX_MONTE_CARLO_CLONES = 100000
+
+# Chebyshev table of planet positions for perturbed propagation, built with `python ephemeris.py`
+app.config['EPHEMERIS_TABLE'] = os.environ.get('EPHEMERIS_TABLE', 'data/planets.npy')
+# Earth position table (JD span); built from ERFA on first use and reused from the file afterwards.
+# Dates outside the span fall back to the low-precision analytic formulas
+app.config['EARTH_TABLE'] = os.environ.get('EARTH_TABLE', earth.DEFAULT_PATH)
+app.config['EARTH_TABLE_START'] = float(os.environ.get('EARTH_TABLE_START', earth.DEFAULT_START))
+app.config['EARTH_TABLE_END'] = float(os.environ.get('EARTH_TABLE_END', earth.DEFAULT_END))
+earth.configure(app.config['EARTH_TABLE'], app.config['EARTH_TABLE_START'], app.config['EARTH_TABLE_END'])
+
+# Finished results are cached by the content of the observations they were computed from
+app.config['RESULT_CACHE_BYTES'] = int(os.environ.get('RESULT_CACHE_BYTES', 64 * 1024 * 1024))
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR')
+orbit_results = ResultCache(max_bytes=app.config['RESULT_CACHE_BYTES'],
+                            directory=app.config['RESULT_CACHE_DIR'])
+
+# Every tracked object has its own observations, kept in memory unless a directory
+# for per-object SQLite databases is configured
+app.config['OBSERVATION_DATABASE_DIR'] = os.environ.get('OBSERVATION_DATABASE_DIR')
+workspaces = Workspaces(app.config['OBSERVATION_DATABASE_DIR'])
+
+# "Refit all" spreads the objects over this many processes
+app.config['REFIT_WORKERS'] = int(os.environ.get('REFIT_WORKERS', os.cpu_count() or 1))
+
+# Local reference star catalog for image astrometry (CSV: ra_deg,dec_deg,mag)
+app.config['STAR_CATALOG'] = os.environ.get('STAR_CATALOG', 'data/reference_stars.csv')
+
+# Opt-in sampling profiler: a request with the header "X-Profile: <PROFILING_TOKEN>" gets the
+# sampled call stacks of its view (collapsed format for flame graphs) instead of its response.
+# Profiling is off while no token is configured.
+app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN')
+app.config['PROFILING_INTERVAL'] = float(os.environ.get('PROFILING_INTERVAL', 0.005))
+
+# Prometheus metrics served on /metrics, in addition to the stage timings of metrics.span
+FIT_ITERATIONS = metrics.REGISTRY.histogram(
+    'comet_orbit_fit_iterations', 'Differential correction iterations per orbit fit.',
+    buckets=(1, 2, 3, 5, 8, 13, 20, 30, 50))
+PLOT_ERRORS = metrics.REGISTRY.counter('comet_plot_errors_total', 'Orbit plots that failed to render.')
+metrics.REGISTRY.gauge('comet_jobs_in_flight', 'Background jobs queued or running.',
+                       lambda: orbit_jobs.in_flight)
+metrics.REGISTRY.gauge('comet_result_cache_lookups_total', 'Result cache lookups by outcome.',
+                       lambda: {('hit',): orbit_results.hits, ('miss',): orbit_results.misses},
+                       labels=('result',), kind='counter')
+metrics.REGISTRY.gauge('comet_result_cache_bytes', 'Size of the in-memory result cache.',
+                       lambda: orbit_results.nbytes)
 
 
 class Observation:
-    def __init__(self, ra_hours, dec_degrees, observation_time, image_filename=None):
+    def __init__(self, ra_hours, dec_degrees, observation_time, image_filename=None, jd=None):
         self.ra_hours = ra_hours
         self.dec_degrees = dec_degrees
         self.observation_time = observation_time
         self.image_filename = image_filename
-        self.jd = Time(observation_time).jd
+        self.jd = float(datetimes_to_jd(observation_time)) if jd is None else jd
 
 
-class OrbitalElements:
-    def __init__(self, a, e, i, raan, arg_peri, t_peri):
-        self.a = a
-        self.e = e
-        self.i = i
-        self.raan = raan
-        self.arg_peri = arg_peri
-        self.t_peri = t_peri
+def create_observations(ra_hours, dec_degrees, observation_times, image_filenames=None):
+    """Пакетное создание наблюдений: JD для всех моментов считается одним вызовом"""
+    with metrics.span('observations.create'):
+        jds = datetimes_to_jd(observation_times)
+        if image_filenames is None:
+            image_filenames = [None] * len(jds)
+        return [Observation(ra, dec, time, image, jd=jd)
+                for ra, dec, time, image, jd in zip(ra_hours, dec_degrees, observation_times,
+                                                    image_filenames, jds.tolist())]
 
 
 class CloseApproach:
-    def __init__(self, time, distance_au):
+    def __init__(self, time, distance_au, jd=None, propagation='two-body'):
         self.time = time
         self.distance_au = distance_au
+        self.jd = jd
+        self.propagation = propagation
 
 
 def allowed_file(filename):
@@ -57,7 +161,8 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def validate_observation_data(ra_hours, dec_degrees, observation_time_str):
+def validate_observation_data(ra_hours, dec_degrees, observation_time_str, observations=None):
+    """Ошибки полей формы; с observations — еще повтор момента и движение относительно соседей"""
     errors = []
     try:
         ra = float(ra_hours)
@@ -78,173 +183,450 @@ def validate_observation_data(ra_hours, dec_degrees, observation_time_str):
     except:
         errors.append("Invalid observation time format")
 
+    if not errors and observations is not None and len(observations):
+        jd = datetimes_to_jd([datetime.fromisoformat(observation_time_str.replace('Z', '+00:00'))])
+        flags = validate_observations([float(ra_hours)], [float(dec_degrees)], jd,
+                                      observation_arrays(observations))
+        errors += [message for flag, message in VALIDATION_MESSAGES.items() if flags[0] & flag]
+
     return errors
 
 
-def calculate_orbital_elements(observations):
+def validate_plate_data(form):
+    """Центр кадра, масштаб и необязательное положение кометы на снимке из формы"""
+    errors = []
+    plate = {}
+    for name, label, low, high in (('plate_ra', 'Plate center RA', 0, 24),
+                                   ('plate_dec', 'Plate center Dec', -90, 90),
+                                   ('plate_scale', 'Plate scale', 0, 3600)):
+        try:
+            plate[name] = float(form.get(name))
+            if not (low <= plate[name] <= high) or (name == 'plate_scale' and plate[name] == 0):
+                errors.append(f"{label} must be between {low} and {high}")
+        except (TypeError, ValueError):
+            errors.append(f"{label} must be a number")
+    plate['comet_pixel'] = None
+    if form.get('comet_x') or form.get('comet_y'):
+        try:
+            plate['comet_pixel'] = (float(form.get('comet_x')), float(form.get('comet_y')))
+        except (TypeError, ValueError):
+            errors.append("Comet pixel position must be two numbers")
+    return plate, errors
+
+
+def observation_arrays(observations):
+    """Массивы (jd, ra_hours, dec_degrees), упорядоченные по времени"""
+    if hasattr(observations, 'sorted_arrays'):
+        return observations.sorted_arrays()
+
+    times = np.array([obs.jd for obs in observations], dtype=float)
+    ra_values = np.array([obs.ra_hours for obs in observations], dtype=float)
+    dec_values = np.array([obs.dec_degrees for obs in observations], dtype=float)
+    order = np.argsort(times, kind='stable')
+    return times[order], ra_values[order], dec_values[order]
+
+
+def calculate_orbital_elements(observations, max_iter=ORBIT_FIT_MAX_ITER, clip_sigma=ORBIT_CLIP_SIGMA):
     if len(observations) < 3:
         raise ValueError("At least 3 observations required")
 
-    sorted_obs = sorted(observations, key=lambda x: x.jd)
-    ra_values = [obs.ra_hours for obs in sorted_obs]
-    times = [obs.jd for obs in sorted_obs]
+    with metrics.span('orbit.fit'):
+        elements = fit_orbit(*observation_arrays(observations), max_iter=max_iter, clip_sigma=clip_sigma)
+    FIT_ITERATIONS.observe(elements.fit.iterations)
+    return elements
+
+
+def close_approach_search_start():
+    """Начало поиска сближения — полночь UTC текущих суток, чтобы результат не менялся в течение дня"""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return float(datetimes_to_jd(today))
+
+
+def calculate_close_approach(orbit_elements, start_jd=None, propagation='two-body'):
+    if start_jd is None:
+        start_jd = float(datetimes_to_jd(datetime.now(timezone.utc)))
+    search_days = CLOSE_APPROACH_SEARCH_YEARS * 365.25
+    trajectory = orbit_elements
+    if propagation == 'n-body':
+        if orbit_elements.fit is None:
+            raise ValueError("Perturbed propagation requires a fitted orbit")
+        # Интегрирование от эпохи подгонки через весь интервал поиска
+        fit = orbit_elements.fit
+        with metrics.span('orbit.integrate'):
+            trajectory = PerturbedOrbit(fit.state, fit.epoch, start_jd, start_jd + search_days,
+                                        load_ephemeris(app.config['EPHEMERIS_TABLE']))
+    with metrics.span('orbit.close_approach'):
+        closest_jd, min_distance_au = find_close_approach(trajectory, start_jd, search_days)
+    # Без astropy: для дат за пределами таблицы високосных секунд ERFA выдает предупреждения
+    closest_time = datetime(2000, 1, 1, 12) + timedelta(days=closest_jd - J2000)
 
-    time_span = times[-1] - times[0]
+    return CloseApproach(
+        time=closest_time,
+        distance_au=min_distance_au,
+        jd=closest_jd,
+        propagation=propagation
+    )
 
-    if time_span > 100:
-        a = 10.0 + np.random.random() * 20
-        e = 0.7 + np.random.random() * 0.25
-        i = 30 + np.random.random() * 60
-    else:
-        a = 2.0 + np.random.random() * 5
-        e = 0.1 + np.random.random() * 0.3
-        i = 10 + np.random.random() * 40
 
-    raan = np.mean(ra_values) * 15
-    arg_peri = 100 + np.random.random() * 160
-    t_peri = times[0] + (time_span / 2)
+def orbit_settings(propagation='two-body'):
+    """Параметры расчета, от которых зависит результат; входят в ключ кеша"""
+    return {
+        'fit_max_iter': ORBIT_FIT_MAX_ITER,
+        'fit_clip_sigma': ORBIT_CLIP_SIGMA,
+        'search_start_jd': close_approach_search_start(),
+        'search_years': CLOSE_APPROACH_SEARCH_YEARS,
+        'propagation': propagation,
+    }
 
-    return OrbitalElements(a, e, i, raan, arg_peri, t_peri)
 
+def ephemeris_available():
+    return os.path.exists(app.config['EPHEMERIS_TABLE'])
 
-def calculate_close_approach(orbit_elements):
-    min_distance_au = 0.5 + np.random.random() * 2.0
-    closest_time = Time.now() + np.random.random() * 200 * u.day
 
-    return CloseApproach(
-        time=closest_time.datetime,
-        distance_au=min_distance_au
-    )
+def fit_key(times, ra_values, dec_values):
+    """Ключ кеша подгонки: в отличие от результата не зависит от окна поиска сближения"""
+    return 'fit.' + result_key(times, ra_values, dec_values,
+                               {'fit_max_iter': ORBIT_FIT_MAX_ITER, 'fit_clip_sigma': ORBIT_CLIP_SIGMA})
 
 
-def create_orbit_plot(orbit_elements, close_approach, observations_list):
+def cached(key, kind):
     """
-    Создает график орбиты кометы и сближения с Землей
+    Значение кеша результатов, если оно типа kind, иначе None. В одном кеше
+    лежат результаты, подгонки, графики и сводки: ключ из адреса может указывать
+    на значение другого вида.
     """
-    try:
-        # Создаем фигуру с двумя subplots
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
+    value = orbit_results.get(key)
+    return value if isinstance(value, kind) else None
 
-        # Первый график: орбитальная диаграмма
-        plot_orbit_diagram(ax1, orbit_elements)
 
-        # Второй график: движение по небу
-        plot_sky_motion(ax2, observations_list)
+def is_orbit_result(value):
+    """Результат расчета орбиты: (элементы, сближение, массивы наблюдений)"""
+    return isinstance(value, tuple) and len(value) == 3 and isinstance(value[0], OrbitalElements)
 
-        # Настройка общего вида
-        plt.tight_layout()
 
-        # Сохраняем график в base64 для отображения в HTML
-        img = io.BytesIO()
-        plt.savefig(img, format='png', dpi=100, bbox_inches='tight')
-        img.seek(0)
-        plot_url = base64.b64encode(img.getvalue()).decode()
-        plt.close()
+def fitted_observations(observations, arrays):
+    """
+    Наблюдения подгонки из массивов, сохраненных с результатом, — таблица не
+    расходится с результатом после изменения хранилища. Снимки берутся из
+    хранилища по совпадающему моменту наблюдения.
+    """
+    times, ra_values, dec_values = arrays
+    images = None
+    stored = np.asarray(observations.jd)
+    if len(stored) and observations.image_filenames():
+        order = np.argsort(stored, kind='stable')
+        stored = stored[order]
+        position = np.minimum(np.searchsorted(stored, times), len(stored) - 1)
+        column = observations.image_column()[order][position]
+        images = np.where(stored[position] == times, column, None).tolist()
+    fitted = ObservationStore(capacity=max(len(times), 1))
+    fitted.extend(ra_values, dec_values, times, images)
+    return fitted
+
+
+def results_etag(key, fitted):
+    """Результат по ключу неизменен, а снимки наблюдений могут измениться: ETag учитывает и их"""
+    names = '\0'.join(name or '' for name in fitted.image_column())
+    return f"{key}-{hashlib.sha1(names.encode()).hexdigest()[:16]}"
+
+
+def find_previous_fit(observations):
+    """
+    Сохраненная подгонка для того же набора без нескольких последних добавленных
+    наблюдений. Возвращает (элементы, маска новых наблюдений в порядке времени)
+    или (None, None).
+    """
+    if not hasattr(observations, 'sorted_arrays'):
+        return None, None
+    jd, ra_values, dec_values = (np.asarray(a) for a in (
+        observations.jd, observations.ra_hours, observations.dec_degrees))
+    n = len(jd)
+    # Тот же устойчивый порядок, что и в sorted_arrays; подмножества берутся из него без пересортировки
+    order = np.argsort(jd, kind='stable')
+    for k in range(1, min(INCREMENTAL_MAX_NEW, n - 3) + 1):
+        rows = order[order < n - k]
+        elements = cached(fit_key(jd[rows], ra_values[rows], dec_values[rows]), OrbitalElements)
+        if elements is not None:
+            return elements, order >= n - k
+    return None, None
+
+
+def compute_orbit(times, ra_values, dec_values, settings, previous_fit=None, new=None):
+    """
+    Орбита и сближение по наблюдениям. Если есть подгонка по части
+    наблюдений, она только уточняется.
+    """
+    observations_list = ObservationStore(capacity=len(times))
+    observations_list.extend(ra_values, dec_values, times)
+    orbit_elements = None
+    if previous_fit is not None:
+        try:
+            with metrics.span('orbit.refine'):
+                orbit_elements = refine_orbit(previous_fit, times, ra_values, dec_values, new,
+                                              settings['fit_max_iter'], settings['fit_clip_sigma'])
+            FIT_ITERATIONS.observe(orbit_elements.fit.iterations)
+        except (ValueError, np.linalg.LinAlgError):
+            orbit_elements = None
+    if orbit_elements is None:
+        orbit_elements = calculate_orbital_elements(observations_list, settings['fit_max_iter'],
+                                                    settings['fit_clip_sigma'])
+    close_approach = calculate_close_approach(orbit_elements, settings['search_start_jd'],
+                                              settings['propagation'])
+    return orbit_elements, close_approach, observations_list
+
+
+def run_orbit_job(times, ra_values, dec_values, settings, previous_fit=None, new=None):
+    """
+    Полный расчет для фонового задания. Возвращает орбиту, сближение,
+    массивы наблюдений (по ним перерисовывается график) и PNG-график.
+    """
+    orbit_elements, close_approach, observations_list = compute_orbit(
+        times, ra_values, dec_values, settings, previous_fit, new)
+    progress.report('plot', force=True, observations=len(times))
+    orbit_plot = create_orbit_plot(orbit_elements, close_approach, observations_list)
+    return orbit_elements, close_approach, (times, ra_values, dec_values), orbit_plot
+
+
+def run_monte_carlo_job(orbit_elements, approach_jd, clones, workers, ephemeris_table=None):
+    """Фоновое задание: распределение сближения для клонов орбиты; с таблицей планет — с возмущениями"""
+    ephemeris = load_ephemeris(ephemeris_table) if ephemeris_table else None
+    return monte_carlo_close_approach(orbit_elements, approach_jd, clones=clones, workers=workers,
+                                      ephemeris=ephemeris)
+
+
+class RefitSummary:
+    def __init__(self, objects, elapsed):
+        # (объект, ключ результата, число наблюдений, состояние, ошибка)
+        self.objects = objects
+        self.elapsed = elapsed
+        computed = [row for row in objects if row[3] == 'computed']
+        self.computed = len(computed)
+        self.cached = sum(1 for row in objects if row[3] == 'cached')
+        self.failed = sum(1 for row in objects if row[3] == 'failed')
+        self.observations = sum(row[2] for row in computed)
+
+    @property
+    def objects_per_second(self):
+        return self.computed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def observations_per_second(self):
+        return self.observations / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def refit_object(args):
+    """Расчет одного объекта в процессе пула; ошибка возвращается, а не поднимается"""
+    times, ra_values, dec_values, settings = args
+    try:
+        orbit_elements, close_approach, _ = compute_orbit(times, ra_values, dec_values, settings)
+    except (ValueError, np.linalg.LinAlgError) as e:
+        return None, str(e)
+    return (orbit_elements, close_approach, (times, ra_values, dec_values)), None
+
+
+def run_refit_all_job(batch, settings, workers):
+    """
+    Фоновое задание «пересчитать все»: объекты без готового результата
+    распределяются по пулу процессов. batch — список (объект, ключ, массивы
+    или None, если результат уже в кеше). Возвращает сводку и новые результаты.
+    """
+    pending = [(object_id, key, arrays) for object_id, key, arrays in batch if arrays is not None]
+    started = time.perf_counter()
+    tasks = [(*arrays, settings) for _, _, arrays in pending]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            outcomes = list(pool.map(refit_object, tasks))
+    else:
+        outcomes = [refit_object(task) for task in tasks]
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    outcome_by_key = {}
+    for (_, key, arrays), (result, error) in zip(pending, outcomes):
+        outcome_by_key[key] = (len(arrays[0]), error)
+        if result is not None:
+            results[key] = result
+    rows = []
+    for object_id, key, arrays in batch:
+        if arrays is None:
+            rows.append((object_id, key, 0, 'cached', None))
+        else:
+            count, error = outcome_by_key[key]
+            rows.append((object_id, key, count, 'failed' if error else 'computed', error))
+    return RefitSummary(rows, elapsed), results
+
+
+class LinkSummary:
+    def __init__(self, object_id, detections, tracklets, objects, elapsed):
+        self.object_id = object_id
+        self.detections = detections
+        self.tracklets = tracklets
+        self.objects = objects  # (новый объект, число наблюдений)
+        self.unlinked = detections - sum(count for _, count in objects)
+        self.elapsed = elapsed
+
+
+def run_link_job(times, ra_values, dec_values):
+    """Фоновое задание: метки объектов для наблюдений (в порядке хранилища)"""
+    started = time.perf_counter()
+    linkage = link_observations(times, ra_values, dec_values)
+    tracklets = 0 if linkage.tracklets is None else len(linkage.tracklets)
+    return linkage.labels, tracklets, time.perf_counter() - started
+
+
+def store_linked_objects(object_id, arrays, labels):
+    """
+    Раскладывает наблюдения объекта по новым объектам <объект>.<номер> по меткам
+    связывания. Прежнее содержимое этих объектов заменяется, исходный объект не меняется.
+    """
+    source = workspaces.get(object_id)
+    times, ra_values, dec_values = arrays
+    # Снимки переносятся, только если наблюдения объекта не менялись с момента связывания
+    same = source is not None and len(source) == len(times)
+    objects = []
+    for label in range(labels.max() + 1):
+        rows = np.flatnonzero(labels == label)
+        name = f'{object_id}.{label + 1}'
+        store = workspaces.create(name)
+        store.clear()
+        images = [source.image_filename(i) for i in rows] if same else None
+        store.extend(ra_values[rows], dec_values[rows], times[rows],
+                     images if images and any(images) else None)
+        objects.append((name, len(rows)))
+    return objects
+
+
+measured_lock = threading.Lock()
+
+
+def record_measured_observation(job):
+    """
+    Записывает наблюдение, измеренное по снимку, ровно один раз: из обратного
+    вызова завершенного задания или при первом опросе, если тот успел раньше.
+    Наблюдение проверяется так же, как введенное в форму; возвращает ошибки проверки.
+    """
+    with measured_lock:
+        if 'errors' in job.context:
+            return job.context['errors']
+        if job.status != 'done':
+            return None
+        solution = job.result()
+        observation = job.context['observation']
+        store = workspaces.get(job.context['values']['object_id'])
+        if store is None:
+            errors = ['The object was removed before the image was measured']
+        else:
+            errors = validate_observation_data(solution.ra_hours, solution.dec_degrees,
+                                               observation['time'], store)
+            if not errors:
+                store.append_observation(Observation(
+                    ra_hours=solution.ra_hours,
+                    dec_degrees=solution.dec_degrees,
+                    observation_time=datetime.fromisoformat(observation['time']),
+                    image_filename=observation['image']
+                ))
+        job.context['errors'] = errors
+        return errors
+
+
+def store_job_result(job):
+    """Сохраняет результат завершенного задания в кеш под ключом задания"""
+    if job.key in orbit_results:
+        return
+    endpoint = job.context['endpoint']
+    if endpoint == 'orbit_results_page':
+        orbit_elements, close_approach, arrays, orbit_plot = job.result()
+        orbit_results.put(job.key, (orbit_elements, close_approach, arrays))
+        orbit_results.put(fit_key(*arrays), orbit_elements)
+        if orbit_plot is not None:
+            orbit_results.put(f'{job.key}.png', orbit_plot)
+    elif endpoint == 'refit_summary':
+        summary, results = job.result()
+        for key, (orbit_elements, close_approach, arrays) in results.items():
+            orbit_results.put(key, (orbit_elements, close_approach, arrays))
+            orbit_results.put(fit_key(*arrays), orbit_elements)
+        orbit_results.put(job.key, summary)
+    elif endpoint == 'linked_objects':
+        labels, tracklets, elapsed = job.result()
+        object_id = job.context['values']['object_id']
+        objects = store_linked_objects(object_id, job.context['arrays'], labels)
+        orbit_results.put(job.key, LinkSummary(object_id, len(labels), tracklets, objects, elapsed))
+    elif endpoint == 'astrometry_result':
+        orbit_results.put(job.key, (job.result(), record_measured_observation(job)))
+    else:
+        orbit_results.put(job.key, job.result())
 
-        return f"data:image/png;base64,{plot_url}"
 
-    except Exception as e:
-        print(f"Error creating plot: {e}")
+def create_orbit_plot(orbit_elements, close_approach, observations_list, file_format='png'):
+    """
+    Создает график орбиты кометы и сближения с Землей (байты PNG или SVG)
+    """
+    try:
+        return render_orbit_plot(orbit_elements, *observation_arrays(observations_list),
+                                 file_format=file_format)
+    except Exception:
+        PLOT_ERRORS.inc()
+        app.logger.exception("Error creating plot")
         return None
 
 
-def plot_orbit_diagram(ax, orbit_elements):
-    """График орбитальной диаграммы"""
-    # Параметры орбиты
-    a = orbit_elements.a
-    e = orbit_elements.e
-    i = orbit_elements.i
-
-    # Создаем точки для эллипса орбиты
-    theta = np.linspace(0, 2 * np.pi, 100)
-    r = a * (1 - e ** 2) / (1 + e * np.cos(theta))
-    x = r * np.cos(theta)
-    y = r * np.sin(theta)
-
-    # Рисуем орбиту
-    ax.plot(x, y, 'b-', linewidth=2, label=f'Orbit (e={e:.3f})')
-
-    # Солнце в центре
-    ax.plot(0, 0, 'yo', markersize=15, label='Sun')
-
-    # Положение кометы (произвольное)
-    comet_angle = np.pi / 4  # 45 градусов
-    comet_r = a * (1 - e ** 2) / (1 + e * np.cos(comet_angle))
-    comet_x = comet_r * np.cos(comet_angle)
-    comet_y = comet_r * np.sin(comet_angle)
-    ax.plot(comet_x, comet_y, 'ro', markersize=8, label='Comet')
-
-    # Орбита Земли (круг радиусом 1 а.е.)
-    earth_r = 1.0
-    earth_x = earth_r * np.cos(theta)
-    earth_y = earth_r * np.sin(theta)
-    ax.plot(earth_x, earth_y, 'g--', alpha=0.7, label='Earth orbit')
-
-    # Земля
-    earth_angle = np.pi / 3  # 60 градусов
-    earth_pos_x = earth_r * np.cos(earth_angle)
-    earth_pos_y = earth_r * np.sin(earth_angle)
-    ax.plot(earth_pos_x, earth_pos_y, 'go', markersize=8, label='Earth')
-
-    # Настройки графика
-    ax.set_aspect('equal')
-    ax.grid(True, alpha=0.3)
-    ax.set_xlabel('X (AU)')
-    ax.set_ylabel('Y (AU)')
-    ax.set_title('Orbital Diagram\n(Viewed from above ecliptic)')
-    ax.legend()
-
-    # Добавляем информацию об орбите
-    info_text = f'Semi-major axis: {a:.2f} AU\nEccentricity: {e:.3f}\nInclination: {i:.1f}°'
-    ax.text(0.02, 0.98, info_text, transform=ax.transAxes, verticalalignment='top',
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
-
-
-def plot_sky_motion(ax, observations_list):
-    """График движения кометы по небу"""
-    if len(observations_list) < 2:
-        ax.text(0.5, 0.5, 'Not enough observations\nfor sky motion plot',
-                ha='center', va='center', transform=ax.transAxes)
-        ax.set_title('Sky Motion')
-        return
+def object_observations(object_id):
+    """Хранилище наблюдений объекта из адреса; 404 для неизвестного объекта"""
+    store = workspaces.get(object_id)
+    if store is None:
+        abort(404)
+    return store
+
+
+def remove_unused_images():
+    """
+    Снимки общие для всех объектов, поэтому остаются те, на которые ссылается
+    хоть одно наблюдение; каталог с остальными удаляется в фоне
+    """
+    def referenced():
+        # Собирается под блокировкой хранилища снимков: загрузка не перенесется в заменяемый каталог
+        names = set()
+        for _, store in workspaces.items():
+            names |= store.image_filenames()
+        return names
 
-    # Извлекаем координаты и времена
-    times = [obs.jd for obs in observations_list]
-    ra_values = [obs.ra_hours for obs in observations_list]
-    dec_values = [obs.dec_degrees for obs in observations_list]
+    return images.remove_unreferenced(referenced)
 
-    # Нормализуем времена для отображения
-    times_norm = [t - times[0] for t in times]
 
-    # Создаем scatter plot движения
-    scatter = ax.scatter(ra_values, dec_values, c=times_norm, cmap='viridis',
-                         s=100, alpha=0.7)
+@app.before_request
+def start_profiling():
+    token = app.config['PROFILING_TOKEN']
+    header = request.headers.get('X-Profile')
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        g.profiler = SamplingProfiler(interval=app.config['PROFILING_INTERVAL']).start()
 
-    # Добавляем линии соединения
-    ax.plot(ra_values, dec_values, 'k--', alpha=0.5)
 
-    # Добавляем номера наблюдений
-    for i, (ra, dec) in enumerate(zip(ra_values, dec_values)):
-        ax.annotate(f'{i + 1}', (ra, dec), xytext=(5, 5), textcoords='offset points',
-                    fontweight='bold')
+@app.after_request
+def profile_response(response):
+    """Ответ профилируемого запроса заменяется стеками; потоковое тело в профиль не входит"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.stop()
+    report = make_response(profiler.collapsed(), 200)
+    report.mimetype = 'text/plain'
+    report.headers['X-Profile-Samples'] = str(profiler.samples)
+    report.headers['X-Profile-Elapsed'] = f'{profiler.elapsed:.6f}'
+    report.headers['X-Profile-Status'] = str(response.status_code)
+    report.headers['Cache-Control'] = 'no-store'
+    return report
 
-    # Настройки графика
-    ax.set_xlabel('Right Ascension (hours)')
-    ax.set_ylabel('Declination (degrees)')
-    ax.set_title('Sky Motion of Comet')
-    ax.grid(True, alpha=0.3)
 
-    # Добавляем colorbar
-    plt.colorbar(scatter, ax=ax, label='Time (days from first observation)')
+@app.teardown_request
+def stop_profiling(error):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
 
-    # Добавляем информацию о движении
-    ra_motion = ra_values[-1] - ra_values[0]
-    dec_motion = dec_values[-1] - dec_values[0]
-    total_motion = np.sqrt(ra_motion ** 2 + dec_motion ** 2)
 
-    motion_text = f'Total motion: {total_motion:.3f}°\nRA change: {ra_motion:.3f}h\nDec change: {dec_motion:.3f}°'
-    ax.text(0.02, 0.98, motion_text, transform=ax.transAxes, verticalalignment='top',
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route('/')
@@ -252,19 +634,140 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/observations', methods=['GET', 'POST'])
-def manage_observations():
+@app.route('/objects', methods=['GET', 'POST'])
+def manage_objects():
+    if request.method == 'POST':
+        object_id = (request.form.get('object_id') or '').strip()
+        if not valid_object_id(object_id):
+            flash('Object id may contain only letters, digits, ".", "-" and "_"', 'error')
+            return redirect(url_for('manage_objects'))
+        workspaces.create(object_id)
+        flash(f'Object {object_id} created', 'success')
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    return render_template('objects.html', objects=list(workspaces.items()))
+
+
+@app.route('/objects/<object_id>/delete', methods=['POST'])
+def delete_object(object_id):
+    store = object_observations(object_id)
+    if object_id == DEFAULT_OBJECT:
+        flash('The default object cannot be deleted', 'error')
+        return redirect(url_for('manage_objects'))
+    store.clear()
+    workspaces.remove(object_id)
+    remove_unused_images()
+    flash(f'Object {object_id} deleted', 'success')
+    return redirect(url_for('manage_objects'))
+
+
+@app.route('/objects/refit', methods=['POST'])
+def refit_all():
+    settings = orbit_settings(request.form.get('propagation', 'two-body'))
+    if settings['propagation'] not in PROPAGATION_MODES:
+        abort(400)
+    if settings['propagation'] == 'n-body' and not ephemeris_available():
+        flash('Perturbed propagation needs the planetary ephemeris table '
+              f'({app.config["EPHEMERIS_TABLE"]}); build it with "python ephemeris.py"', 'error')
+        return redirect(url_for('manage_objects'))
+    batch = []
+    for object_id, store in workspaces.items():
+        if len(store) < 3:
+            continue
+        times, ra_values, dec_values = (np.array(a) for a in observation_arrays(store))
+        key = result_key(times, ra_values, dec_values, settings)
+        arrays = None if key in orbit_results else (times, ra_values, dec_values)
+        batch.append((object_id, key, arrays))
+    if not batch:
+        flash('No object has the 3 observations needed for an orbit', 'error')
+        return redirect(url_for('manage_objects'))
+
+    refit_key = 'refit.' + hashlib.sha1(' '.join(
+        f'{object_id}:{key}' for object_id, key, _ in batch).encode()).hexdigest()
+    if refit_key in orbit_results:
+        return redirect(url_for('refit_summary', key=refit_key))
+    try:
+        job = orbit_jobs.submit(refit_key, run_refit_all_job, batch, settings,
+                                app.config['REFIT_WORKERS'],
+                                context={'endpoint': 'refit_summary', 'values': {'key': refit_key}})
+    except QueueFull as e:
+        flash(str(e), 'error')
+        return redirect(url_for('manage_objects'))
+    return redirect(url_for('orbit_job', job_id=job.id))
+
+
+@app.route('/objects/refit/<key>')
+def refit_summary(key):
+    summary = orbit_results.get(key)
+    if summary is None:
+        flash('This refit summary is no longer cached', 'error')
+        return redirect(url_for('manage_objects'))
+    if not isinstance(summary, RefitSummary):
+        abort(404)
+    return render_template('refit.html', summary=summary)
+
+
+@app.route('/objects/<object_id>/link', methods=['POST'])
+def link_object_observations(object_id):
+    observations = object_observations(object_id)
+    if not len(observations):
+        flash('There are no observations to link', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    # Порядок хранилища, а не времени: по номерам строк переносятся снимки
+    arrays = tuple(np.array(a) for a in (observations.jd, observations.ra_hours,
+                                         observations.dec_degrees))
+    key = f'link.{object_id}.{array_key(*arrays)}'
+    if key in orbit_results:
+        return redirect(url_for('linked_objects', object_id=object_id, key=key))
+    try:
+        job = orbit_jobs.submit(key, run_link_job, *arrays,
+                                context={'endpoint': 'linked_objects', 'arrays': arrays,
+                                         'values': {'object_id': object_id, 'key': key}})
+    except QueueFull as e:
+        flash(str(e), 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+    return redirect(url_for('orbit_job', job_id=job.id))
+
+
+@app.route('/objects/<object_id>/link/<key>')
+def linked_objects(object_id, key):
+    summary = orbit_results.get(key)
+    if summary is None:
+        flash('This linking result is no longer cached', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+    if not isinstance(summary, LinkSummary):
+        abort(404)
+    return render_template('link.html', summary=summary)
+
+
+@app.route('/observations', methods=['GET', 'POST'], defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/observations', methods=['GET', 'POST'])
+def manage_observations(object_id):
+    observations = object_observations(object_id)
     if request.method == 'POST':
         ra_hours = request.form.get('ra_hours')
         dec_degrees = request.form.get('dec_degrees')
         observation_time = request.form.get('observation_time')
 
-        errors = validate_observation_data(ra_hours, dec_degrees, observation_time)
+        # Без координат положение измеряется по снимку в фоновом задании
+        measure = not ra_hours and not dec_degrees and bool(request.form.get('plate_ra'))
+        if measure:
+            plate, errors = validate_plate_data(request.form)
+            errors += validate_observation_data(0, 0, observation_time)
+            file = request.files.get('comet_image')
+            if not file or not file.filename or not allowed_file(file.filename):
+                errors.append("Upload an image to measure the comet position")
+            elif not os.path.exists(app.config['STAR_CATALOG']):
+                errors.append(f"Reference star catalog {app.config['STAR_CATALOG']} not found")
+        else:
+            errors = validate_observation_data(ra_hours, dec_degrees, observation_time, observations)
 
         if errors:
             for error in errors:
                 flash(error, 'error')
-            return render_template('observations.html', observations=observations)
+            return render_template('observations.html', observations=observations,
+                                   object_id=object_id)
 
         # Handle file upload
         image_filename = None
@@ -272,17 +775,33 @@ def manage_observations():
             file = request.files['comet_image']
             if file and file.filename != '':
                 if allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    # Add timestamp to make filename unique
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_")
-                    filename = timestamp + filename
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    image_filename = filename
+                    # Файл копируется блоками и получает имя по хешу содержимого
+                    extension = os.path.splitext(secure_filename(file.filename))[1]
+                    with metrics.span('upload.save'):
+                        image_filename = images.save(file.stream, extension)
                     flash('Comet image uploaded successfully!', 'success')
                 else:
                     flash('Invalid file type. Please upload an image file.', 'error')
 
+        if measure:
+            observed = datetime.fromisoformat(observation_time.replace('Z', '+00:00'))
+            key = 'astrometry.' + hashlib.sha1(repr((object_id, image_filename, observed.isoformat(),
+                                                     sorted(plate.items()))).encode()).hexdigest()
+            try:
+                job = orbit_jobs.submit(key, measure_image, images.path(image_filename),
+                                        plate['plate_ra'], plate['plate_dec'], plate['plate_scale'],
+                                        app.config['STAR_CATALOG'], plate['comet_pixel'],
+                                        context={'endpoint': 'astrometry_result',
+                                                 'observation': {'time': observed.isoformat(),
+                                                                 'image': image_filename},
+                                                 'values': {'object_id': object_id, 'key': key}})
+            except QueueFull as e:
+                flash(str(e), 'error')
+                return redirect(url_for('manage_observations', object_id=object_id))
+            # Наблюдение записывается по завершении задания, даже если его страницу никто не опрашивает
+            job.future.add_done_callback(lambda _, job=job: record_measured_observation(job))
+            return redirect(url_for('orbit_job', job_id=job.id))
+
         observation = Observation(
             ra_hours=float(ra_hours),
             dec_degrees=float(dec_degrees),
@@ -290,49 +809,442 @@ def manage_observations():
             image_filename=image_filename
         )
 
-        observations.append(observation)
+        observations.append_observation(observation)
         flash('Observation added successfully!', 'success')
-        return redirect(url_for('manage_observations'))
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    return render_template('observations.html', observations=observations, object_id=object_id)
+
+
+@app.route('/objects/<object_id>/astrometry/<key>')
+def astrometry_result(object_id, key):
+    object_observations(object_id)
+    result = orbit_results.get(key)
+    if result is None:
+        return redirect(url_for('manage_observations', object_id=object_id))
+    if not (isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], PlateSolution)):
+        abort(404)
+    solution, errors = result
+    measured = (f'Comet measured at RA {solution.ra_hours:.5f}h, Dec {solution.dec_degrees:+.5f}° '
+                f'from {solution.matched} reference stars (residual {solution.rms_arcsec:.2f}″)')
+    if errors:
+        flash(f'{measured}; observation not added: {"; ".join(errors)}', 'error')
+    else:
+        flash(f'{measured}; observation added', 'success')
+    return redirect(url_for('manage_observations', object_id=object_id))
 
-    return render_template('observations.html', observations=observations)
 
+@app.route('/observations/import', methods=['POST'], defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/observations/import', methods=['POST'])
+def import_observation_file(object_id):
+    observations = object_observations(object_id)
+    file = request.files.get('observations_file')
+    if not file or file.filename == '':
+        flash('Please choose an observation file to import.', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
 
-@app.route('/calculate_orbit')
-def calculate_orbit():
+    file_format = request.form.get('file_format') or detect_format(file.filename)
+    try:
+        with metrics.span('ingest.import'):
+            imported, rejected, errors = import_observations(file.stream, observations, file_format)
+    except (ValueError, UnicodeDecodeError) as e:
+        flash(f'Error importing observations: {str(e)}', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    for message, count in errors.items():
+        flash(f'{count} row(s) skipped: {message}', 'error')
+    flash(f'Imported {imported} observations from {secure_filename(file.filename)}'
+          + (f' ({rejected} rows skipped)' if rejected else ''), 'success')
+    return redirect(url_for('manage_observations', object_id=object_id))
+
+
+@app.route('/calculate_orbit', defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/calculate_orbit')
+def calculate_orbit(object_id):
+    observations = object_observations(object_id)
     if len(observations) < 3:
         flash('At least 3 observations are required', 'error')
-        return redirect(url_for('manage_observations'))
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    propagation = request.args.get('propagation', 'two-body')
+    if propagation not in PROPAGATION_MODES:
+        abort(400)
+    if propagation == 'n-body' and not ephemeris_available():
+        flash('Perturbed propagation needs the planetary ephemeris table '
+              f'({app.config["EPHEMERIS_TABLE"]}); build it with "python ephemeris.py"', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
 
     try:
-        orbit_elements = calculate_orbital_elements(observations)
-        close_approach = calculate_close_approach(orbit_elements)
+        key, job = submit_orbit_job(object_id, observations, propagation)
+    except QueueFull as e:
+        flash(str(e), 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+    if job is None:
+        return redirect(url_for('orbit_results_page', object_id=object_id, key=key))
+    return redirect(url_for('orbit_job', job_id=job.id))
+
+
+def submit_orbit_job(object_id, observations, propagation):
+    """Ключ результата и задание расчета; задание None, если результат уже в кеше"""
+    times, ra_values, dec_values = (np.array(a) for a in observation_arrays(observations))
+    settings = orbit_settings(propagation)
+    key = result_key(times, ra_values, dec_values, settings)
+    if key in orbit_results:
+        return key, None
+    previous_fit, new = find_previous_fit(observations)
+    job = orbit_jobs.submit(key, run_orbit_job, times, ra_values, dec_values, settings,
+                            previous_fit, new,
+                            context={'endpoint': 'orbit_results_page',
+                                     'values': {'object_id': object_id, 'key': key}})
+    return key, job
+
+
+def job_fallback_url(job):
+    """Куда вернуться, если задание отменено или завершилось ошибкой"""
+    if job.context['endpoint'] in ('refit_summary', 'linked_objects'):
+        return url_for('manage_objects')
+    return url_for('manage_observations',
+                   object_id=job.context['values'].get('object_id', DEFAULT_OBJECT))
+
+
+@app.route('/jobs/<job_id>')
+def orbit_job(job_id):
+    job = orbit_jobs.get(job_id) or abort(404)
+    if not job.done:
+        return render_template('job.html', job=job)
+    if job.status == 'cancelled':
+        flash('Orbit calculation was cancelled', 'error')
+        return redirect(job_fallback_url(job))
+    if job.error is not None:
+        flash(f'Error calculating orbit: {str(job.error)}', 'error')
+        return redirect(job_fallback_url(job))
+
+    store_job_result(job)
+    return redirect(url_for(job.context['endpoint'], **job.context['values']))
+
+
+@app.route('/results/<key>', defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/results/<key>')
+def orbit_results_page(object_id, key):
+    observations = object_observations(object_id)
+    result = orbit_results.get(key)
+    if result is None:
+        flash('These results are no longer cached, please calculate the orbit again', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+    if not is_orbit_result(result):
+        abort(404)
+
+    orbit_elements, close_approach, arrays = result
+    fitted = fitted_observations(observations, arrays)
+    etag = results_etag(key, fitted)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    response = make_response(render_template(
+        'results.html',
+        orbit_elements=orbit_elements,
+        close_approach=close_approach,
+        observations_count=orbit_elements.fit.nobs,
+        observations=fitted,
+        object_id=object_id,
+        orbit_plot=url_for('orbit_plot', key=key, file_format='png'),
+        orbit_plot_svg=url_for('orbit_plot', key=key, file_format='svg'),
+        result_key=key,
+        monte_carlo_clones=DEFAULT_CLONES,
+        propagation_modes=PROPAGATION_MODES,
+        ephemeris_available=ephemeris_available()))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/results/<key>/uncertainty', defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/results/<key>/uncertainty')
+def orbit_uncertainty(object_id, key):
+    object_observations(object_id)
+    clones = min(max(request.args.get('clones', DEFAULT_CLONES, type=int), 100), MAX_MONTE_CARLO_CLONES)
+    analysis_key = f'{key}.mc{clones}'
+    distribution = cached(analysis_key, CloseApproachDistribution)
+    if distribution is not None:
+        return render_template('uncertainty.html', distribution=distribution, result_key=key,
+                               object_id=object_id)
+
+    result = orbit_results.get(key)
+    if result is None:
+        flash('These results are no longer cached, please calculate the orbit again', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+    if not is_orbit_result(result):
+        abort(404)
+    orbit_elements, close_approach, _ = result
+    if close_approach.jd is None:
+        flash('Please calculate the orbit again to analyse its uncertainty', 'error')
+        return redirect(url_for('manage_observations', object_id=object_id))
+
+    # Клоны переносятся той же моделью, что и номинальное сближение
+    ephemeris_table = app.config['EPHEMERIS_TABLE'] if close_approach.propagation == 'n-body' else None
+    if ephemeris_table and not ephemeris_available():
+        flash('Perturbed propagation needs the planetary ephemeris table '
+              f'({app.config["EPHEMERIS_TABLE"]}); build it with "python ephemeris.py"', 'error')
+        return redirect(url_for('orbit_results_page', object_id=object_id, key=key))
+    try:
+        job = orbit_jobs.submit(analysis_key, run_monte_carlo_job, orbit_elements, close_approach.jd,
+                                clones, app.config['MONTE_CARLO_WORKERS'], ephemeris_table,
+                                context={'endpoint': 'orbit_uncertainty',
+                                         'values': {'object_id': object_id, 'key': key,
+                                                    'clones': clones}})
+    except QueueFull as e:
+        flash(str(e), 'error')
+        return redirect(url_for('orbit_results_page', object_id=object_id, key=key))
+    return redirect(url_for('orbit_job', job_id=job.id))
+
+
+@app.route('/plot/<key>.<file_format>')
+def orbit_plot(key, file_format):
+    if file_format not in PLOT_FORMATS:
+        abort(404)
+    plot_key = f'{key}.{file_format}'
+    if request.if_none_match.contains(plot_key):
+        response = make_response('', 304)
+        response.set_etag(plot_key)
+        return response
+
+    plot = cached(plot_key, bytes)
+    if plot is None:
+        result = orbit_results.get(key)
+        if not is_orbit_result(result):
+            abort(404)
+        orbit_elements, _, arrays = result
+        plot = render_orbit_plot(orbit_elements, *arrays, file_format=file_format)
+        orbit_results.put(plot_key, plot)
+
+    response = make_response(plot)
+    response.mimetype = PLOT_FORMATS[file_format]
+    response.set_etag(plot_key)
+    # Адрес определяется содержимым, поэтому график можно кешировать без проверки
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.route('/jobs/<job_id>/status')
+def orbit_job_status(job_id):
+    job = orbit_jobs.get(job_id) or abort(404)
+    return jsonify(id=job.id, status=job.status,
+                   error=None if job.error is None else str(job.error))
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_orbit_job(job_id):
+    job = orbit_jobs.get(job_id) or abort(404)
+    if orbit_jobs.cancel(job_id):
+        flash('Orbit calculation cancelled', 'success')
+    return redirect(job_fallback_url(job))
+
+
+def send_immutable(path, mimetype=None):
+    """Снимки адресуются по содержимому, поэтому кешируются без проверки"""
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.route('/images/<path:name>')
+def observation_image(name):
+    path = safe_join(images.directory, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_immutable(path)
+
+
+@app.route('/images/<path:name>/thumbnail')
+def observation_thumbnail(name):
+    path = safe_join(images.directory, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    thumbnail = images.thumbnail(name)
+    if thumbnail is None:
+        return redirect(url_for('observation_image', name=name))
+    return send_immutable(thumbnail, 'image/jpeg')
+
+
+@app.route('/clear_observations', methods=['POST'], defaults={'object_id': DEFAULT_OBJECT})
+@app.route('/objects/<object_id>/clear_observations', methods=['POST'])
+def clear_observations(object_id):
+    object_observations(object_id).clear()
+    # Also clear uploaded images
+    remove_unused_images()
+    flash('All observations and images cleared!', 'success')
+    return redirect(url_for('manage_observations', object_id=object_id))
 
-        # Создаем график орбиты
-        orbit_plot = create_orbit_plot(orbit_elements, close_approach, observations)
 
-        return render_template('results.html',
-                               orbit_elements=orbit_elements,
-                               close_approach=close_approach,
-                               observations_count=len(observations),
-                               observations=observations,
-                               orbit_plot=orbit_plot)
+# JSON API для автоматической обработки; ошибки тоже в JSON
+API_PREFIX = f'/api/{api.API_VERSION}'
 
-    except Exception as e:
-        flash(f'Error calculating orbit: {str(e)}', 'error')
-        return redirect(url_for('manage_observations'))
 
+@app.errorhandler(HTTPException)
+def http_error(error):
+    if not request.path.startswith(API_PREFIX + '/'):
+        return error
+    return jsonify(error=error.description, status=error.code), error.code
 
-@app.route('/clear_observations', methods=['POST'])
-def clear_observations():
-    global observations
-    observations.clear()
-    # Also clear uploaded images
-    upload_folder = app.config['UPLOAD_FOLDER']
-    for filename in os.listdir(upload_folder):
-        if filename != '.gitkeep':  # Keep gitkeep file
-            os.remove(os.path.join(upload_folder, filename))
-    flash('All observations and images cleared!', 'success')
-    return redirect(url_for('manage_observations'))
+
+def api_error(message, status=400):
+    return jsonify(error=message, status=status), status
+
+
+def api_result_url(object_id, key):
+    return url_for('api_orbit_result', object_id=object_id, key=key)
+
+
+@app.route(f'{API_PREFIX}/objects', methods=['GET', 'POST'])
+def api_objects():
+    if request.method == 'POST':
+        object_id = str((request.get_json(silent=True) or {}).get('id', ''))
+        if not valid_object_id(object_id):
+            return api_error('Object id may contain only letters, digits, ".", "-" and "_"')
+        created = object_id not in workspaces
+        workspaces.create(object_id)
+        return jsonify(id=object_id, observations=len(workspaces.get(object_id)),
+                       url=url_for('api_observations', object_id=object_id)), 201 if created else 200
+    return jsonify(objects=[{'id': object_id, 'observations': len(store),
+                             'url': url_for('api_observations', object_id=object_id)}
+                            for object_id, store in workspaces.items()])
+
+
+@app.route(f'{API_PREFIX}/objects/<object_id>/observations', methods=['GET', 'POST'])
+def api_observations(object_id):
+    """
+    GET: страница наблюдений (offset, limit) в JSON или, для format=ndjson либо
+    Accept: application/x-ndjson, поток NDJSON (без limit — до конца).
+    POST: пакетная загрузка массивов наблюдений.
+    """
+    observations = object_observations(object_id)
+    if request.method == 'POST':
+        try:
+            jd, ra_values, dec_values = api.parse_observation_batch(request.get_json(silent=True))
+        except ValueError as e:
+            return api_error(str(e))
+        # Ошибочные строки отбрасываются и перечисляются, остальные записываются
+        flags = validate_observations(ra_values, dec_values, jd, observation_arrays(observations))
+        valid = flags == 0
+        rejected = api.rejected_document(flags)
+        if not valid.any():
+            return jsonify(error='No valid observations in the request', status=400, rejected=rejected), 400
+        observations.extend(ra_values[valid], dec_values[valid], jd[valid])
+        return jsonify(id=object_id, added=int(np.count_nonzero(valid)), observations=len(observations),
+                       rejected=rejected), 201
+
+    ndjson = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = request.args.get('limit')
+        limit = None if limit is None and ndjson else min(int(limit or api.PAGE_SIZE), api.MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error('offset and limit must be integers')
+    if limit is not None and limit < 1:
+        return api_error('limit must be positive')
+
+    # Копия окна: поток не зависит от изменений хранилища во время отдачи
+    total = len(observations)
+    page = observations[offset:total if limit is None else offset + limit]
+    arrays = (np.array(page.jd), np.array(page.ra_hours), np.array(page.dec_degrees),
+              page.image_column().tolist())
+    following = offset + len(arrays[0])
+    next_url = (url_for('api_observations', object_id=object_id, offset=following, limit=limit,
+                        format='ndjson' if ndjson else None)
+                if limit is not None and following < total else None)
+
+    if ndjson:
+        response = Response(api.ndjson_stream(arrays, offset), mimetype='application/x-ndjson')
+    else:
+        header = {'id': object_id, 'total': total, 'offset': offset, 'limit': limit, 'next': next_url}
+        response = Response(api.json_page_stream(header, arrays, offset), mimetype='application/json')
+    response.headers['X-Total-Count'] = str(total)
+    if next_url:
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+@app.route(f'{API_PREFIX}/objects/<object_id>/orbit', methods=['POST'])
+def api_calculate_orbit(object_id):
+    """Запускает расчет орбиты: 200 с результатом из кеша или 202 с заданием"""
+    observations = object_observations(object_id)
+    if len(observations) < 3:
+        return api_error('At least 3 observations are required')
+    propagation = request.args.get('propagation', 'two-body')
+    if propagation not in PROPAGATION_MODES:
+        return api_error(f'propagation must be one of: {", ".join(PROPAGATION_MODES)}')
+    if propagation == 'n-body' and not ephemeris_available():
+        return api_error('Perturbed propagation needs the planetary ephemeris table', 409)
+    try:
+        key, job = submit_orbit_job(object_id, observations, propagation)
+    except QueueFull as e:
+        return api_error(str(e), 503)
+    if job is None:
+        return api_orbit_result(object_id, key)
+    response = jsonify(job=job.id, status=job.status, key=key,
+                       status_url=url_for('api_job', job_id=job.id),
+                       result_url=api_result_url(object_id, key))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_job', job_id=job.id)
+    return response
+
+
+@app.route(f'{API_PREFIX}/jobs/<job_id>')
+def api_job(job_id):
+    job = orbit_jobs.get(job_id) or abort(404)
+    document = {'job': job.id, 'status': job.status,
+                'error': None if job.error is None else str(job.error)}
+    if job.done and job.error is None and job.status != 'cancelled':
+        store_job_result(job)
+        if job.context['endpoint'] == 'orbit_results_page':
+            document['result_url'] = api_result_url(job.context['values']['object_id'], job.key)
+    return jsonify(document)
+
+
+@app.route('/jobs/<job_id>/events')
+@app.route(f'{API_PREFIX}/jobs/<job_id>/events')
+def orbit_job_events(job_id):
+    """
+    Ход задания потоком Server-Sent Events: итерации подгонки, охват поиска
+    сближения, промежуточная статистика Монте-Карло. Событие end означает,
+    что результат можно забрать по адресу из его данных.
+    """
+    job = orbit_jobs.get(job_id) or abort(404)
+    if not event_streams.acquire(blocking=False):
+        # Потоки заняли свои места: ответ не 200 закрывает EventSource, и страница опрашивает состояние
+        response = Response('retry: 5000\n\n', 503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = '5'
+        return response
+    endpoint = 'api_job' if request.path.startswith(API_PREFIX + '/') else 'orbit_job'
+    stream = progress.event_stream(job.progress, job.status,
+                                   end={'url': url_for(endpoint, job_id=job.id)})
+    response = Response(stream, mimetype='text/event-stream')
+    response.call_on_close(event_streams.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx иначе буферизует поток целиком
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route(f'{API_PREFIX}/objects/<object_id>/results/<key>')
+def api_orbit_result(object_id, key):
+    object_observations(object_id)
+    if request.if_none_match.contains(key):
+        response = make_response('', 304)
+        response.set_etag(key)
+        return response
+    result = orbit_results.get(key)
+    if not is_orbit_result(result):
+        return api_error('Result is not cached; calculate the orbit again', 404)
+    orbit_elements, close_approach, _ = result
+    response = jsonify(id=object_id, key=key,
+                       orbital_elements=api.elements_document(orbit_elements),
+                       close_approach=api.approach_document(close_approach))
+    response.set_etag(key)
+    return response
 
 
 if __name__ == '__main__':
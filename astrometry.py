@@ -0,0 +1,280 @@
+"""
+Астрометрия по снимку кометы.
+
+Снимок декодируется Pillow в массив, дальше все считается NumPy над его
+представлениями: фон — медианы по сетке блоков (по прореженным пикселям) с
+одним проходом отсечения и билинейной интерполяцией между узлами; источники —
+локальные максимумы сглаженного изображения выше порога, центроиды —
+взвешенное среднее в окне вокруг максимума с субпиксельной точностью.
+
+Звезды локального каталога проецируются в касательную плоскость вокруг
+заданного центра кадра. Поворот и сдвиг кадра находятся голосованием по
+смещениям между яркими источниками и звездами для набора углов (с учетом
+зеркального отражения), затем по отождествленным звездам подгоняется
+аффинное преобразование пиксели -> стандартные координаты, через которое
+пересчитывается положение кометы.
+"""
+import os
+import time
+
+import numpy as np
+
+BACKGROUND_BOX = 64
+# Фон оценивается по каждому BACKGROUND_STEP-му пикселю блока
+BACKGROUND_STEP = 4
+DETECTION_SIGMA = 5.0
+CENTROID_RADIUS = 4
+# Ширина гауссова веса центроида, пиксели
+CENTROID_SIGMA = 1.5
+MAX_SOURCES = 300
+MATCH_SOURCES = 30
+MATCH_ANGLE_STEP_DEG = 0.5
+MATCH_BIN_PIXELS = 16.0
+MATCH_TOLERANCE_PIXELS = 3.0
+MIN_MATCHED_STARS = 4
+_BIN_OFFSET = 1 << 20
+COMET_SEARCH_PIXELS = 20.0
+# Без явного положения кометой не считаются источники у края кадра (звезды,
+# обрезанные рамкой)
+COMET_EDGE_PIXELS = 64
+# ...и источники ближе этого к звезде каталога (части насыщенных звезд)
+COMET_ISOLATION_PIXELS = 8.0
+_ARCSEC = np.pi / (180 * 3600)
+
+
+def load_image(path):
+    """Яркость снимка как массив float32 (цветные снимки переводятся в оттенки серого)"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        if image.mode not in ('I;16', 'I', 'F', 'L'):
+            image = image.convert('L')
+        return np.asarray(image, dtype=np.float32)
+
+
+def estimate_background(image, box=BACKGROUND_BOX, step=BACKGROUND_STEP):
+    """Фон того же размера, что снимок, и шум одного пикселя"""
+    ny, nx = max(image.shape[0] // box, 1), max(image.shape[1] // box, 1)
+    by, bx = min(box, image.shape[0]), min(box, image.shape[1])
+    cells = image[:ny * by:step, :nx * bx:step]
+    cells = cells.reshape(ny, -(-by // step), nx, -(-bx // step)).swapaxes(1, 2).reshape(ny, nx, -1)
+
+    median = np.median(cells, axis=2)
+    sigma = 1.4826 * np.median(np.abs(cells - median[..., None]), axis=2)
+    # Звезды смещают медиану вверх: среднее по пикселям в пределах 3 сигм от нее
+    keep = np.abs(cells - median[..., None]) <= 3 * sigma[..., None] + 1e-6
+    mesh = (cells * keep).sum(axis=2) / np.maximum(keep.sum(axis=2), 1)
+
+    # Билинейная интерполяция: сначала по строкам сетки, затем на месте по столбцам
+    lower, upper, weight = _interpolation_weights(image.shape[0], by, ny)
+    mesh = (mesh[lower] * (1 - weight)[:, None] + mesh[upper] * weight[:, None]).astype(np.float32)
+    lower, upper, weight = _interpolation_weights(image.shape[1], bx, nx)
+    background = mesh[:, lower]
+    background *= 1 - weight
+    background += mesh[:, upper] * weight
+    return background, float(np.median(sigma))
+
+
+def _interpolation_weights(size, box, count):
+    position = np.clip((np.arange(size) + 0.5) / box - 0.5, 0, count - 1)
+    lower = np.floor(position).astype(int)
+    return lower, np.minimum(lower + 1, count - 1), (position - lower).astype(np.float32)
+
+
+def detect_sources(image, nsigma=DETECTION_SIGMA, radius=CENTROID_RADIUS, max_sources=MAX_SOURCES):
+    """
+    Центроиды источников (N, 2) в пикселях (x — столбец, y — строка) и их
+    потоки, по убыванию потока.
+    """
+    background, noise = estimate_background(image)
+    residual = np.subtract(image, background, out=background)
+    # Сглаживание окном 3x3: суммы сдвинутых представлений по строкам, затем по столбцам
+    smooth = residual[:, :-2] + residual[:, 1:-1]
+    smooth += residual[:, 2:]
+    smooth = smooth[:-2] + smooth[1:-1] + smooth[2:]
+    y, x = np.nonzero(smooth > 3 * nsigma * noise)
+    y, x = y + 1, x + 1
+
+    # Локальные максимумы; равенство с соседом разрешается в пользу первого по порядку
+    value = residual[y, x]
+    peak = np.ones(len(y), dtype=bool)
+    for dy, dx in ((-1, -1), (-1, 0), (-1, 1), (0, -1)):
+        peak &= value > residual[y + dy, x + dx]
+    for dy, dx in ((1, 1), (1, 0), (1, -1), (0, 1)):
+        peak &= value >= residual[y + dy, x + dx]
+    inside = (y >= radius) & (y < image.shape[0] - radius) & (x >= radius) & (x < image.shape[1] - radius)
+    y, x = y[peak & inside], x[peak & inside]
+
+    offsets = np.arange(-radius, radius + 1)
+    windows = residual[y[:, None, None] + offsets[None, :, None], x[:, None, None] + offsets[None, None, :]]
+    windows = np.clip(windows, 0, None)
+    flux = windows.sum(axis=(1, 2))
+    # Центроид с гауссовым весом вокруг текущей оценки: у простого среднего по
+    # окну, обрезанному вокруг целого пикселя, смещение к этому пикселю
+    dx, dy = np.zeros(len(x)), np.zeros(len(y))
+    for _ in range(4):
+        wx = np.exp(-(offsets[None, :] - dx[:, None]) ** 2 / (2 * CENTROID_SIGMA ** 2))
+        wy = np.exp(-(offsets[None, :] - dy[:, None]) ** 2 / (2 * CENTROID_SIGMA ** 2))
+        weights = windows * wy[:, :, None] * wx[:, None, :]
+        total = weights.sum(axis=(1, 2))
+        dx = np.einsum('nij,j->n', weights, offsets) / total
+        dy = np.einsum('nij,i->n', weights, offsets) / total
+    cx, cy = x + dx, y + dy
+
+    order = np.argsort(-flux)[:max_sources]
+    return np.column_stack([cx[order], cy[order]]), flux[order]
+
+
+def to_standard(ra_degrees, dec_degrees, ra0_degrees, dec0_degrees):
+    """Стандартные координаты (радианы) гномонической проекции с центром (ra0, dec0)"""
+    ra, dec = np.radians(ra_degrees), np.radians(dec_degrees)
+    ra0, dec0 = np.radians(ra0_degrees), np.radians(dec0_degrees)
+    cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+    xi = np.cos(dec) * np.sin(ra - ra0) / cos_c
+    eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cos_c
+    return np.stack([xi, eta], axis=-1), cos_c
+
+
+def from_standard(standard, ra0_degrees, dec0_degrees):
+    ra0, dec0 = np.radians(ra0_degrees), np.radians(dec0_degrees)
+    xi, eta = standard[..., 0], standard[..., 1]
+    denominator = np.cos(dec0) - eta * np.sin(dec0)
+    ra = ra0 + np.arctan2(xi, denominator)
+    dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0), np.hypot(xi, denominator))
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+
+class StarCatalog:
+    """Локальный каталог опорных звезд: CSV со столбцами ra_deg, dec_deg, mag"""
+
+    def __init__(self, path):
+        data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2).reshape(-1, 3)
+        self.ra, self.dec, self.mag = data[:, 0], data[:, 1], data[:, 2]
+
+    def around(self, ra_degrees, dec_degrees, radius_degrees, limit=None):
+        """Звезды в пределах radius от центра, от ярких к слабым"""
+        _, cos_c = to_standard(self.ra, self.dec, ra_degrees, dec_degrees)
+        rows = np.flatnonzero(cos_c >= np.cos(np.radians(radius_degrees)))
+        rows = rows[np.argsort(self.mag[rows], kind='stable')][:limit]
+        return self.ra[rows], self.dec[rows]
+
+
+_catalogs = {}
+
+
+def load_catalog(path):
+    """Каталог, прочитанный один раз на процесс"""
+    catalog = _catalogs.get(path)
+    if catalog is None:
+        catalog = _catalogs[path] = StarCatalog(path)
+    return catalog
+
+
+def _initial_alignment(sources, stars):
+    """
+    Поворот, отражение и сдвиг, совмещающие яркие источники со звездами
+    (обе выборки в пикселях): голосование по смещениям для всех углов сразу.
+    Возвращает матрицу 2x2 и сдвиг: star ~ M @ (source - shift).
+    """
+    angles = np.radians(np.arange(0, 360, MATCH_ANGLE_STEP_DEG))
+    cos, sin = np.cos(angles), np.sin(angles)
+    rotations = np.stack([np.stack([cos, -sin], -1), np.stack([sin, cos], -1)], -2)
+    best = (0, None, None)
+    for parity in (1.0, -1.0):
+        flipped = sources * [parity, 1.0]
+        rotated = np.einsum('aij,mj->ami', rotations, stars)
+        offsets = flipped[None, :, None, :] - rotated[:, None, :, :]
+        bins = np.floor(offsets / MATCH_BIN_PIXELS).astype(np.int64) + _BIN_OFFSET
+        # Ячейка (угол, сдвиг по x, сдвиг по y) одним целым ключом
+        keys = (np.arange(len(angles))[:, None, None] << 42) | (bins[..., 0] << 21) | bins[..., 1]
+        keys, counts = np.unique(keys, return_counts=True)
+        k = np.argmax(counts)
+        if counts[k] > best[0]:
+            a = keys[k] >> 42
+            in_bin = ((bins[a, ..., 0] << 21) | bins[a, ..., 1]) == (keys[k] & ((1 << 42) - 1))
+            shift = offsets[a][in_bin].mean(axis=0)
+            # source' = R star + shift, source' = P source  ->  star = R^T (P source - shift)
+            matrix = rotations[a].T @ np.diag([parity, 1.0])
+            best = (counts[k], matrix, rotations[a].T @ shift)
+    if best[1] is None:
+        raise ValueError("Could not match the image to reference stars")
+    return best[1], best[2]
+
+
+class PlateSolution:
+    def __init__(self, ra_hours, dec_degrees, comet_pixel, matched, rms_arcsec, sources, elapsed):
+        self.ra_hours = ra_hours
+        self.dec_degrees = dec_degrees
+        self.comet_pixel = comet_pixel
+        self.matched = matched  # число отождествленных звезд
+        self.rms_arcsec = rms_arcsec
+        self.sources = sources
+        self.elapsed = elapsed
+
+
+def solve_plate(image, ra_hours, dec_degrees, scale_arcsec, catalog, comet_pixel=None):
+    """
+    Положение кометы на снимке. Центр кадра (ra_hours, dec_degrees) и масштаб
+    (угловые секунды на пиксель) задает пользователь. Если comet_pixel не
+    указан, кометой считается самый яркий источник вдали от края кадра и от
+    звезд каталога.
+    """
+    started = time.perf_counter()
+    ra0 = ra_hours * 15
+    sources, _ = detect_sources(image)
+    if len(sources) < MIN_MATCHED_STARS:
+        raise ValueError("Too few sources detected in the image")
+
+    height, width = image.shape
+    center = np.array([width, height]) / 2
+    scale = scale_arcsec * _ARCSEC
+    radius = np.degrees(np.hypot(width, height) / 2 * scale) * 1.2
+    star_ra, star_dec = catalog.around(ra0, dec_degrees, radius)
+    if len(star_ra) < MIN_MATCHED_STARS:
+        raise ValueError("Too few reference stars in the catalog around the plate center")
+    stars, _ = to_standard(star_ra, star_dec, ra0, dec_degrees)
+    stars /= scale
+
+    matrix, shift = _initial_alignment(sources[:MATCH_SOURCES] - center, stars[:MATCH_SOURCES])
+    predicted = (sources - center) @ matrix.T - shift
+    # Уточнение: ближайшие звезды -> аффинное преобразование по всем отождествлениям
+    design = np.column_stack([sources - center, np.ones(len(sources))])
+    for _ in range(3):
+        distance = np.linalg.norm(predicted[:, None] - stars[None], axis=2)
+        nearest = np.argmin(distance, axis=1)
+        matched = distance[np.arange(len(sources)), nearest] <= MATCH_TOLERANCE_PIXELS
+        # Одна звезда — не больше одного источника
+        matched &= np.bincount(nearest[matched], minlength=len(stars))[nearest] == 1
+        if matched.sum() < MIN_MATCHED_STARS:
+            raise ValueError("Could not match the image to reference stars")
+        transform, *_ = np.linalg.lstsq(design[matched], stars[nearest[matched]], rcond=None)
+        predicted = design @ transform
+    residuals = predicted[matched] - stars[nearest[matched]]
+    rms = float(np.sqrt(np.mean(np.sum(residuals ** 2, axis=1)))) * scale_arcsec
+
+    if comet_pixel is not None:
+        distance = np.linalg.norm(sources - np.asarray(comet_pixel, dtype=float), axis=1)
+        k = int(np.argmin(distance))
+        if distance[k] > COMET_SEARCH_PIXELS:
+            raise ValueError("No source found near the given comet position")
+    else:
+        inside = np.all((sources >= COMET_EDGE_PIXELS) & (sources < [width - COMET_EDGE_PIXELS,
+                                                                     height - COMET_EDGE_PIXELS]), axis=1)
+        distance = np.min(np.linalg.norm(predicted[:, None] - stars[None], axis=2), axis=1)
+        isolated = distance > COMET_ISOLATION_PIXELS
+        unmatched = np.flatnonzero(isolated & inside)
+        if not len(unmatched):
+            raise ValueError("Every detected source is a catalog star")
+        k = int(unmatched[0])
+
+    ra, dec = from_standard(predicted[k] * scale, ra0, dec_degrees)
+    return PlateSolution(float(ra) / 15, float(dec), tuple(sources[k].tolist()), int(matched.sum()),
+                         rms, len(sources), time.perf_counter() - started)
+
+
+def measure_image(path, ra_hours, dec_degrees, scale_arcsec, catalog_path, comet_pixel=None):
+    """Фоновое задание: решение снимка из файла"""
+    if not os.path.exists(catalog_path):
+        raise ValueError(f"Reference star catalog {catalog_path} not found")
+    return solve_plate(load_image(path), ra_hours, dec_degrees, scale_arcsec,
+                       load_catalog(catalog_path), comet_pixel)
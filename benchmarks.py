@@ -0,0 +1,235 @@
+"""
+Замеры производительности горячих путей: создание наблюдений, подгонка
+орбиты, поиск сближения, график и полный запрос /calculate_orbit.
+
+Наблюдения генерируются по известной орбите (дуги от 10 до 10^5 точек).
+Каждый замер повторяется, пока не наберется min_time секунд или max_rounds
+повторов (не меньше min_rounds), после одного прогрева; в отчет идут min,
+median, mean и stddev. Результаты сохраняются в JSON, а режим сравнения
+показывает отношение медиан к сохраненной базе и завершается с кодом 1 при
+замедлении больше допуска.
+
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from observation_store import ObservationStore, jd_to_iso
+from orbit import ARCSEC, OrbitalElements, earth_position, elements_state
+
+SIZES = (10, 100, 1000, 10000, 100000)
+MIN_TIME = 0.5
+MIN_ROUNDS = 3
+MAX_ROUNDS = 1000
+DEFAULT_TOLERANCE = 0.2
+# Орбита, по которой строятся дуги наблюдений
+ARC_ELEMENTS = OrbitalElements(3.2, 0.6, 15.0, 80.0, 120.0, 2460800.5)
+ARC_START_JD = 2460600.5
+ARC_DAYS = 120.0
+
+
+def synthetic_arc(n, elements=ARC_ELEMENTS, start_jd=ARC_START_JD, days=ARC_DAYS,
+                  noise_arcsec=0.5, seed=0):
+    """Наблюдения (jd, ra_hours, dec_degrees) кометы с орбитой elements, равномерно за days суток"""
+    rng = np.random.default_rng(seed)
+    jd = start_jd + np.linspace(0, days, n)
+    direction = elements_state(elements, jd)[0] - earth_position(jd)
+    direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+    direction += rng.normal(0, noise_arcsec * ARCSEC, direction.shape)
+    ra = np.degrees(np.arctan2(direction[:, 1], direction[:, 0])) % 360 / 15
+    dec = np.degrees(np.arcsin(direction[:, 2] / np.linalg.norm(direction, axis=1)))
+    return jd, ra, dec
+
+
+def measure(function, min_time=MIN_TIME, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Статистика времени одного вызова function, секунды"""
+    function()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds and (len(timings) < min_rounds or time.perf_counter() - started < min_time):
+        t0 = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t0)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'rounds': len(timings),
+    }
+
+
+def _arc_store(n):
+    jd, ra, dec = synthetic_arc(n)
+    store = ObservationStore(capacity=n)
+    store.extend(ra, dec, jd)
+    return store
+
+
+def bench_observations(n, cleanup):
+    import app
+
+    jd, ra, dec = synthetic_arc(n)
+    times = [datetime.fromisoformat(t) for t in jd_to_iso(jd)]
+    return lambda: app.create_observations(ra, dec, times)
+
+
+def bench_fit(n, cleanup):
+    import app
+
+    store = _arc_store(n)
+    return lambda: app.calculate_orbital_elements(store)
+
+
+def bench_close_approach(n, cleanup):
+    import app
+
+    elements = app.calculate_orbital_elements(_arc_store(n))
+    return lambda: app.calculate_close_approach(elements, ARC_START_JD)
+
+
+def bench_plot(n, cleanup):
+    import app
+
+    store = _arc_store(n)
+    elements = app.calculate_orbital_elements(store)
+    approach = app.calculate_close_approach(elements, ARC_START_JD)
+    return lambda: app.create_orbit_plot(elements, approach, store)
+
+
+def bench_request(n, cleanup):
+    """Полный путь: /calculate_orbit, ожидание задания, страница результата; кеш сбрасывается"""
+    import app
+
+    object_id = f'benchmark-{n}'
+    store = app.workspaces.create(object_id)
+    cleanup.callback(app.workspaces.remove, object_id)
+    store.clear()
+    jd, ra, dec = synthetic_arc(n)
+    store.extend(ra, dec, jd)
+    client = app.app.test_client()
+
+    def request():
+        app.orbit_results.clear()
+        response = client.get(f'/objects/{object_id}/calculate_orbit')
+        if response.status_code == 302 and '/jobs/' in response.location:
+            job_url = response.location
+            response = client.get(job_url)
+            while response.status_code == 200:  # задание еще выполняется
+                time.sleep(0.002)
+                response = client.get(job_url)
+        if response.status_code != 302 or '/results/' not in response.location:
+            raise RuntimeError(f'Orbit request failed with status {response.status_code}')
+        if client.get(response.location).status_code != 200:
+            raise RuntimeError('Results page failed')
+
+    return request
+
+
+# имя -> (построитель замера по числу наблюдений и ExitStack для уборки, наибольшая дуга)
+BENCHMARKS = {
+    'observations': (bench_observations, 100000),
+    'fit_orbit': (bench_fit, 100000),
+    'close_approach': (bench_close_approach, 100000),
+    'orbit_plot': (bench_plot, 100000),
+    'calculate_orbit_request': (bench_request, 100000),
+}
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(names=None, sizes=SIZES, min_time=MIN_TIME, report=print):
+    """Прогон выбранных замеров; результат — документ для JSON"""
+    results = {}
+    for name, (build, max_size) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        for n in sizes:
+            if n > max_size:
+                continue
+            key = f'{name}[{n}]'
+            with contextlib.ExitStack() as cleanup:
+                results[key] = measure(build(n, cleanup), min_time=min_time)
+            report(f'{key:<34} {_format(results[key]["median"]):>10}  '
+                   f'(min {_format(results[key]["min"])}, {results[key]["rounds"]} rounds)')
+    return {'created': datetime.now(timezone.utc).isoformat(), 'machine': machine_info(),
+            'benchmarks': results}
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Сравнение медиан с базой: список (замер, база, сейчас, отношение,
+    замедление больше допуска) для замеров, которые есть в обоих прогонах.
+    """
+    rows = []
+    for key, result in current['benchmarks'].items():
+        reference = baseline['benchmarks'].get(key)
+        if reference is None:
+            continue
+        ratio = result['median'] / reference['median']
+        rows.append((key, reference['median'], result['median'], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def _format(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3f} {unit}'
+    return f'{seconds * 1e9:.0f} ns'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run ({", ".join(BENCHMARKS)})')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated numbers of observations')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds per benchmark')
+    parser.add_argument('--save', metavar='PATH', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare with a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown of the median before failing, e.g. 0.2 for 20%%')
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    current = run(args.names, [int(n) for n in args.sizes.split(',')], args.min_time)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(current, file, indent=2)
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    rows = compare(current, baseline, args.tolerance)
+    print(f'\n{"benchmark":<34} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for key, before, after, ratio, regressed in rows:
+        print(f'{key:<34} {_format(before):>10} {_format(after):>10} {ratio:>6.2f}x'
+              + ('  REGRESSION' if regressed else ''))
+    regressions = sum(row[4] for row in rows)
+    print(f'\n{regressions} regression(s) beyond {args.tolerance:.0%}' if regressions
+          else f'\nNo regressions beyond {args.tolerance:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
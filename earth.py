@@ -0,0 +1,154 @@
+"""
+Таблица положения и скорости Земли в коэффициентах Чебышева.
+
+Гелиоцентрическое состояние Земли нужно в каждой точке подгонки и сетки
+поиска сближения. Таблица строится один раз по модели ERFA epv00 (ее же
+использует get_body_barycentric из astropy для встроенных эфемерид) на
+интервал дат, по умолчанию 1900–2100 гг. — область применимости модели.
+Построенная таблица сохраняется в .npy и затем открывается через memory map:
+веб-процесс и процессы пула заданий читают одни и те же страницы памяти, а
+состояние на любой массив моментов вычисляется без вызовов ERFA: многочлены
+Чебышева для всех моментов сразу и по матричному произведению на сегмент.
+
+Формат: массив (1 + сегменты, коэффициенты, 6) для x, y, z (а.е.) и vx, vy, vz
+(а.е./сут) в экваторе J2000. Первая строка — заголовок: признак формата, начало
+таблицы и длина сегмента. Таблица и ее параметры лежат в одном файле и
+заменяются одной операцией, поэтому читатель не сочетает новые параметры со
+старыми коэффициентами.
+"""
+import os
+import threading
+import warnings
+
+import numpy as np
+
+DEFAULT_PATH = 'data/earth.npy'
+DEFAULT_START = 2415020.5  # 1900-01-01
+DEFAULT_END = 2488069.5  # 2100-01-01
+SEGMENT_DAYS = 32.0
+COEFFICIENTS = 14
+
+# Признак формата в заголовке: файлы прежнего формата без заголовка перестраиваются
+_FORMAT_MARK = -1.0e9
+
+_settings = {'path': DEFAULT_PATH, 'jd_start': DEFAULT_START, 'jd_end': DEFAULT_END}
+_table = None
+_lock = threading.Lock()
+
+
+def _chebyshev_nodes(count):
+    return np.cos(np.pi * (np.arange(count) + 0.5) / count)
+
+
+def build_coefficients(jd_start, jd_end, segment_days=SEGMENT_DAYS, coefficients=COEFFICIENTS):
+    """Коэффициенты (сегменты, коэффициенты, 6) по ERFA epv00 в узлах Чебышева"""
+    import erfa
+
+    segments = int(np.ceil((jd_end - jd_start) / segment_days))
+    nodes = _chebyshev_nodes(coefficients)
+    starts = jd_start + segment_days * np.arange(segments)
+    jd = (starts[:, None] + (nodes + 1) / 2 * segment_days).ravel()
+    with warnings.catch_warnings():
+        # Последний сегмент может немного выходить за 2100 год
+        warnings.simplefilter('ignore', erfa.ErfaWarning)
+        heliocentric, _ = erfa.epv00(jd, 0.0)
+    # (сегменты, узлы, 6) -> коэффициенты интерполяции в узлах
+    values = np.concatenate([heliocentric['p'], heliocentric['v']], axis=-1).reshape(segments, coefficients, 6)
+    basis = np.cos(np.outer(np.arange(coefficients), np.arccos(nodes)))
+    table = np.einsum('kn,snc->skc', basis, values) * (2 / coefficients)
+    table[:, 0] /= 2
+    return table
+
+
+class EarthTable:
+    def __init__(self, table, jd_start, segment_days):
+        self.table = table
+        self.jd_start = jd_start
+        self.segment_days = segment_days
+        self.jd_end = jd_start + segment_days * len(table)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, mmap_mode='r')
+        if data.ndim != 3 or data.shape[-1] != 6 or len(data) < 2 or data[0, 0, 0] != _FORMAT_MARK:
+            raise ValueError(f"{path} is not an Earth table")
+        _, jd_start, segment_days = data[0, 0, :3]
+        return cls(data[1:], float(jd_start), float(segment_days))
+
+    def save(self, path):
+        """Запись во временный файл и одна замена: другой процесс не откроет недописанную таблицу"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = np.zeros((1,) + self.table.shape[1:])
+        header[0, 0, :3] = _FORMAT_MARK, self.jd_start, self.segment_days
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            np.save(file, np.concatenate([header, self.table]))
+        os.replace(temporary, path)
+
+    def covers(self, jd):
+        return (jd >= self.jd_start) & (jd <= self.jd_end)
+
+    def state(self, jd):
+        """Положение (а.е.) и скорость (а.е./сут) формы (..., 3) для моментов jd внутри таблицы"""
+        jd = np.asarray(jd, dtype=float)
+        offset = (jd.ravel() - self.jd_start) / self.segment_days
+        segment = np.clip(offset.astype(int), 0, len(self.table) - 1)
+        x = 2 * (offset - segment) - 1
+        # Многочлены Чебышева T_k(x) для всех моментов
+        basis = np.empty((self.table.shape[1], len(x)))
+        basis[0] = 1.0
+        basis[1] = x
+        for k in range(2, len(basis)):
+            basis[k] = 2 * x * basis[k - 1] - basis[k - 2]
+
+        # Моменты одного сегмента — одно произведение на его коэффициенты (обычно моменты уже по порядку)
+        order = None
+        if np.any(segment[1:] < segment[:-1]):
+            order = np.argsort(segment, kind='stable')
+            segment, basis = segment[order], basis[:, order]
+        values = np.empty((len(x), 6))
+        bounds = np.flatnonzero(np.diff(segment)) + 1
+        for start, stop in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(x)]])):
+            if stop > start:
+                values[start:stop] = basis[:, start:stop].T @ self.table[segment[start]]
+        if order is not None:
+            values[order] = values.copy()
+        values = values.reshape(jd.shape + (6,))
+        return values[..., :3], values[..., 3:]
+
+
+def configure(path=DEFAULT_PATH, jd_start=DEFAULT_START, jd_end=DEFAULT_END):
+    """Файл и интервал таблицы процесса; таблица открывается или строится при первом обращении"""
+    global _table
+    with _lock:
+        _settings.update(path=path, jd_start=jd_start, jd_end=jd_end)
+        _table = None
+
+
+def _open():
+    path, jd_start, jd_end = _settings['path'], _settings['jd_start'], _settings['jd_end']
+    if path and os.path.exists(path):
+        try:
+            table = EarthTable.load(path)
+            if table.jd_start <= jd_start and table.jd_end >= jd_end:
+                return table
+        except (OSError, ValueError):
+            pass
+    table = EarthTable(build_coefficients(jd_start, jd_end), jd_start, SEGMENT_DAYS)
+    if path:
+        try:
+            table.save(path)
+        except OSError:
+            pass  # каталог только для чтения: таблица остается в памяти процесса
+    table.table.flags.writeable = False
+    return table
+
+
+def table():
+    """Таблица процесса (открывается один раз)"""
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = _open()
+    return _table
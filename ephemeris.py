@@ -0,0 +1,125 @@
+"""
+Компактная таблица эфемерид больших планет в коэффициентах Чебышева.
+
+Таблица строится один раз заранее по встроенным эфемеридам astropy
+(python ephemeris.py data/planets.npy) и хранится как .npy, который
+открывается через memory map: в горячем цикле интегратора нет вызовов
+astropy, а положения всех планет на любой набор моментов вычисляются
+одним векторным проходом схемы Кленшоу.
+
+Формат: массив (сегменты, тела, 3, коэффициенты) гелиоцентрических
+координат в экваторе J2000 (а.е.) и рядом JSON с началом таблицы, длиной
+сегмента и списком тел.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from orbit import GAUSS_K
+
+# Отношения массы Солнца к массе планеты (IAU 2009); для Земли — система Земля+Луна
+SUN_MASS_RATIOS = {
+    'mercury': 6023597.4,
+    'venus': 408523.72,
+    'earth-moon-barycenter': 328900.56,
+    'mars': 3098703.6,
+    'jupiter': 1047.3486,
+    'saturn': 3497.9018,
+    'uranus': 22902.98,
+    'neptune': 19412.26,
+}
+BODIES = tuple(SUN_MASS_RATIOS)
+DEFAULT_SEGMENT_DAYS = 32.0
+DEFAULT_COEFFICIENTS = 14
+
+
+def _metadata_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _chebyshev_nodes(count):
+    return np.cos(np.pi * (np.arange(count) + 0.5) / count)
+
+
+def build_ephemeris_table(path, jd_start, jd_end, segment_days=DEFAULT_SEGMENT_DAYS,
+                          coefficients=DEFAULT_COEFFICIENTS, bodies=BODIES):
+    """Строит таблицу по astropy (встроенные эфемериды) и сохраняет ее в path"""
+    from astropy.coordinates import get_body_barycentric, solar_system_ephemeris
+    from astropy.time import Time
+
+    segments = int(np.ceil((jd_end - jd_start) / segment_days))
+    nodes = _chebyshev_nodes(coefficients)
+    starts = jd_start + segment_days * np.arange(segments)
+    jd = (starts[:, None] + (nodes + 1) / 2 * segment_days).ravel()
+    times = Time(jd, format='jd', scale='tdb')
+
+    with solar_system_ephemeris.set('builtin'):
+        sun = get_body_barycentric('sun', times).xyz.to_value('AU')
+        positions = np.stack([get_body_barycentric(body, times).xyz.to_value('AU') - sun
+                              for body in bodies])
+    # (тела, 3, сегменты, узлы) -> коэффициенты интерполяции в узлах Чебышева
+    positions = positions.reshape(len(bodies), 3, segments, coefficients)
+    basis = np.cos(np.outer(np.arange(coefficients), np.arccos(nodes)))
+    table = positions @ basis.T * (2 / coefficients)
+    table[..., 0] /= 2
+    table = np.ascontiguousarray(table.transpose(2, 0, 1, 3))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.save(path, table)
+    with open(_metadata_path(path), 'w') as file:
+        json.dump({'jd_start': jd_start, 'segment_days': segment_days, 'bodies': list(bodies)}, file)
+
+
+class PlanetEphemeris:
+    def __init__(self, path):
+        with open(_metadata_path(path)) as file:
+            metadata = json.load(file)
+        self.table = np.load(path, mmap_mode='r')
+        self.jd_start = metadata['jd_start']
+        self.segment_days = metadata['segment_days']
+        self.bodies = tuple(metadata['bodies'])
+        self.jd_end = self.jd_start + self.segment_days * len(self.table)
+        self.gm = np.array([GAUSS_K ** 2 / SUN_MASS_RATIOS[body] for body in self.bodies])
+
+    def positions(self, jd):
+        """Гелиоцентрические положения всех тел: массив (..., тела, 3) для моментов jd"""
+        jd = np.asarray(jd, dtype=float)
+        if np.any(jd < self.jd_start) or np.any(jd > self.jd_end):
+            raise ValueError(f"Ephemeris table covers JD {self.jd_start:.1f}-{self.jd_end:.1f}")
+        offset = (jd - self.jd_start) / self.segment_days
+        segment = np.minimum(offset.astype(int), len(self.table) - 1)
+        x = (2 * (offset - segment) - 1)[..., None, None]
+        coefficients = self.table[segment]
+
+        # Схема Кленшоу по последней оси коэффициентов
+        b1 = b2 = 0.0
+        for k in range(coefficients.shape[-1] - 1, 0, -1):
+            b1, b2 = 2 * x * b1 - b2 + coefficients[..., k], b1
+        return x * b1 - b2 + coefficients[..., 0]
+
+    def position(self, body, jd):
+        return self.positions(jd)[..., self.bodies.index(body), :]
+
+
+_loaded = {}
+
+
+def load_ephemeris(path):
+    """Таблица, открытая один раз на процесс"""
+    ephemeris = _loaded.get(path)
+    if ephemeris is None:
+        ephemeris = _loaded[path] = PlanetEphemeris(path)
+    return ephemeris
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the planetary Chebyshev ephemeris table")
+    parser.add_argument('path', help="output .npy file, e.g. data/planets.npy")
+    parser.add_argument('--start', type=float, default=2451544.5, help="first JD (default 2000-01-01)")
+    parser.add_argument('--end', type=float, default=2488069.5, help="last JD (default 2100-01-01)")
+    parser.add_argument('--segment-days', type=float, default=DEFAULT_SEGMENT_DAYS)
+    parser.add_argument('--coefficients', type=int, default=DEFAULT_COEFFICIENTS)
+    args = parser.parse_args()
+    build_ephemeris_table(args.path, args.start, args.end, args.segment_days, args.coefficients)
@@ -0,0 +1,27 @@
+"""
+Настройки gunicorn: gunicorn -c gunicorn.conf.py app:app
+
+Приложение работает в одном процессе. Очередь заданий, кеш результатов и
+хранилища наблюдений (без OBSERVATION_DATABASE_DIR и RESULT_CACHE_DIR) живут
+в его памяти, а задание известно только процессу, который его поставил,
+поэтому рабочий процесс один. Одновременные запросы, в том числе длинные
+потоки хода заданий, обслуживают его потоки (gthread); потокам хода отдаются
+все потоки, кроме двух (EVENT_STREAMS_MAX в app.py).
+
+Таблица положений Земли и Matplotlib со шрифтами загружаются в рабочем
+процессе до первого запроса, а не при первом расчете или графике.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def post_worker_init(worker):
+    import earth
+    import plot_renderer
+
+    earth.table()
+    plot_renderer.warm_up()
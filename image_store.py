@@ -0,0 +1,351 @@
+"""
+Хранилище снимков наблюдений с адресацией по содержимому.
+
+Загрузка копируется на диск блоками с одновременным подсчетом SHA-256, файл
+получает имя <хеш><расширение>, поэтому одинаковые снимки хранятся один раз,
+а адрес снимка никогда не меняет содержимое. Уменьшенные копии для галереи
+строятся в фоновом пуле потоков (Pillow отпускает GIL при декодировании и
+масштабировании) и лежат в подкаталоге thumbnails.
+
+Снимки лежат в каталоге поколения, на который указывает символическая ссылка
+current. Очистка создает новое поколение с жесткими ссылками на сохраняемые
+снимки и одной операцией переключает ссылку; старое поколение удаляется в
+фоновом потоке. Загрузка докачивается в incoming и переносится в current под
+той же блокировкой (поток + flock для других процессов), поэтому не может
+попасть в поколение, которое уже заменено.
+"""
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками процесса
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+# Недокачанные загрузки старше этого удаляет уборщик
+INCOMING_MAX_AGE = 3600
+# Снимок моложе этого очистка оставляет, даже если на него еще нет ссылок:
+# наблюдение добавляется после сохранения файла, а при измерении по снимку — по завершении задания
+UNATTACHED_MAX_AGE = 3600
+_THUMBNAILS = 'thumbnails'
+_CURRENT = 'current'
+_INCOMING = 'incoming'
+_GENERATION = 'generation-'
+_LOCK = '.lock'
+
+logger = logging.getLogger(__name__)
+
+
+def make_thumbnail(source, target, size=THUMBNAIL_SIZE):
+    """Уменьшенная копия JPEG не больше size с сохранением пропорций"""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', size)
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            image.save(file, format='JPEG', quality=THUMBNAIL_QUALITY)
+    os.replace(temporary, target)
+
+
+def _reset_after_fork(reference):
+    store = reference()
+    if store is not None:
+        store._reset_threads()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class ImageStore:
+    def __init__(self, root, workers=2, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.directory = os.path.join(root, _CURRENT)
+        self.thumbnail_directory = os.path.join(self.directory, _THUMBNAILS)
+        self.incoming = os.path.join(root, _INCOMING)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        os.makedirs(self.incoming, exist_ok=True)
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._executor = None
+        self._cleaner = None
+        self._sweeper = None
+        self._stop = threading.Event()
+        # Потоки пулов не переживают fork (процессы пула заданий): дочерний процесс создает свои
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=functools.partial(_reset_after_fork, weakref.ref(self)))
+        with self._exclusive():
+            if not os.path.islink(self.directory):
+                self._adopt_flat_layout()
+            stale = [os.path.join(root, name) for name in os.listdir(root)
+                     if name.startswith(_GENERATION) and name != os.readlink(self.directory)]
+        if stale:
+            self._clean().submit(self._remove_generations, stale)
+
+    def _reset_threads(self):
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._executor = self._cleaner = None
+        # Поток уборщика остался в родителе
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Переключение поколения и перенос загрузки не пересекаются ни в потоках, ни в процессах"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, _LOCK), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _new_generation(self):
+        generation = _GENERATION + uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, generation, _THUMBNAILS))
+        return generation
+
+    def _switch_to(self, generation):
+        link = os.path.join(self.root, f'{_CURRENT}.{generation}.tmp')
+        os.symlink(generation, link)
+        os.replace(link, self.directory)
+
+    def _adopt_flat_layout(self):
+        """Снимки, лежавшие прямо в каталоге загрузок, переносятся в первое поколение"""
+        generation = self._new_generation()
+        for name in os.listdir(self.root):
+            if name in (_INCOMING, _LOCK, '.gitkeep', generation) or name.startswith(_GENERATION):
+                continue
+            if name == _THUMBNAILS:
+                for thumbnail in os.listdir(os.path.join(self.root, name)):
+                    os.replace(os.path.join(self.root, name, thumbnail),
+                               os.path.join(self.root, generation, name, thumbnail))
+                os.rmdir(os.path.join(self.root, name))
+            else:
+                os.replace(os.path.join(self.root, name), os.path.join(self.root, generation, name))
+        self._switch_to(generation)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def thumbnail_path(self, name):
+        return os.path.join(self.thumbnail_directory, name + '.jpg')
+
+    def save(self, stream, extension=''):
+        """
+        Копирует поток в хранилище и возвращает имя файла. Повторная загрузка
+        того же содержимого возвращает то же имя, второй копии не появляется.
+        """
+        digest = hashlib.sha256()
+        handle, temporary = tempfile.mkstemp(dir=self.incoming, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = digest.hexdigest() + extension.lower()
+            with self._exclusive():
+                if os.path.exists(self.path(name)):
+                    os.remove(temporary)
+                    # Повторная загрузка продлевает срок хранения снимка
+                    os.utime(self.path(name))
+                else:
+                    os.replace(temporary, self.path(name))
+        except BaseException:
+            _remove(temporary)
+            raise
+        self.schedule_thumbnail(name)
+        return name
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='thumbnail')
+        return self._executor
+
+    def _clean(self):
+        with self._lock:
+            if self._cleaner is None:
+                self._cleaner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-cleanup')
+            return self._cleaner
+
+    def schedule_thumbnail(self, name):
+        """Ставит уменьшенную копию в очередь фонового пула; возвращает future или None"""
+        if os.path.exists(self.thumbnail_path(name)):
+            return None
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                future = self._pending[name] = self._pool().submit(self._build_thumbnail, name)
+                future.add_done_callback(lambda _: self._forget(name))
+            return future
+
+    def _forget(self, name):
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def _build_thumbnail(self, name):
+        target = self.thumbnail_path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        make_thumbnail(self.path(name), target)
+
+    def thumbnail(self, name):
+        """
+        Путь к уменьшенной копии; если фоновая задача еще не успела, копия
+        строится сейчас. None, если снимок не удалось прочитать.
+        """
+        path = self.thumbnail_path(name)
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(self.path(name)):
+            return None
+        future = self.schedule_thumbnail(name)
+        try:
+            if future is not None:
+                future.result()
+        except (OSError, ValueError):
+            return None
+        return path if os.path.exists(path) else None
+
+    def _recent(self, max_age):
+        now = time.time()
+        with os.scandir(self.directory) as entries:
+            return {entry.name for entry in entries
+                    if entry.is_file() and now - entry.stat().st_mtime <= max_age}
+
+    def remove_unreferenced(self, referenced, keep_recent=UNATTACHED_MAX_AGE):
+        """
+        Оставляет только снимки (и их копии), на которые ссылаются наблюдения,
+        и загруженные за последние keep_recent секунд. referenced — множество
+        имен или функция, возвращающая его: она вызывается под той же
+        блокировкой, что и переключение поколения. Работа в запросе
+        пропорциональна числу оставляемых снимков; прежний каталог удаляется
+        в фоне, future возвращает число удаленных снимков.
+        """
+        with self._exclusive():
+            referenced = set(referenced() if callable(referenced) else referenced)
+            if keep_recent:
+                referenced |= self._recent(keep_recent)
+            previous = os.path.join(self.root, os.readlink(self.directory))
+            generation = self._new_generation()
+            for name in referenced:
+                for source, target in ((self.path(name), os.path.join(self.root, generation, name)),
+                                       (self.thumbnail_path(name),
+                                        os.path.join(self.root, generation, _THUMBNAILS, name + '.jpg'))):
+                    if not os.path.exists(source):
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    try:
+                        os.link(source, target)
+                    except OSError:  # файловая система без жестких ссылок
+                        shutil.copy2(source, target)
+            self._switch_to(generation)
+        return self._clean().submit(self._remove_generations, [previous], referenced)
+
+    @staticmethod
+    def _remove_generations(paths, kept=()):
+        removed = 0
+        for path in paths:
+            for root, directories, files in os.walk(path):
+                if root == path:
+                    directories[:] = [d for d in directories if d != _THUMBNAILS]
+                    removed += sum(1 for filename in files if filename not in kept)
+                else:
+                    removed += len(files)
+            shutil.rmtree(path, ignore_errors=True)
+        return removed
+
+    def sweep(self, max_age=None, max_bytes=None):
+        """
+        Удаляет снимки старше max_age секунд, затем самые старые, пока снимки с
+        копиями занимают больше max_bytes; возвращает число удаленных снимков.
+        """
+        with self._exclusive():
+            return self._sweep(max_age, max_bytes)
+
+    def _sweep(self, max_age, max_bytes):
+        now = time.time()
+        thumbnails = {}
+        with contextlib.suppress(FileNotFoundError), os.scandir(self.thumbnail_directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.jpg'):
+                    thumbnails[entry.name[:-4]] = entry.stat().st_size
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name != '.gitkeep':
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size + thumbnails.pop(entry.name, 0), entry.name))
+        for name in thumbnails:  # копии без снимка
+            _remove(self.thumbnail_path(name))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, name in files:
+            if not ((max_age is not None and now - mtime > max_age)
+                    or (max_bytes is not None and total > max_bytes)):
+                break
+            if _remove(self.path(name)):
+                removed += 1
+            _remove(self.thumbnail_path(name))
+            total -= size
+
+        with os.scandir(self.incoming) as entries:
+            for entry in entries:
+                if now - entry.stat().st_mtime > INCOMING_MAX_AGE:
+                    _remove(entry.path)
+        return removed
+
+    def start_sweeper(self, interval, max_age=None, max_bytes=None):
+        """Уборка по сроку и объему в фоновом потоке раз в interval секунд"""
+        if self._sweeper is not None or (max_age is None and max_bytes is None):
+            return
+        stop = self._stop
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.sweep(max_age, max_bytes)
+                except Exception:
+                    logger.exception("Error sweeping uploaded images")
+
+        self._sweeper = threading.Thread(target=run, name='image-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        for executor in (self._executor, self._cleaner):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._executor = self._cleaner = None
@@ -0,0 +1,177 @@
+"""
+Потоковый импорт наблюдений из файлов формата MPC (80 колонок) и CSV.
+
+Файл читается блоками строк; координаты и время каждого блока разбираются
+векторно, проверяются целыми массивами (в том числе на повторы и движение
+относительно уже записанных наблюдений) и сразу добавляются в хранилище.
+"""
+import csv
+import io
+from itertools import islice
+
+import numpy as np
+
+from observation_store import datetimes_to_jd
+from validation import summarize, validate_observations
+
+CHUNK_LINES = 10000
+
+_SEXAGESIMAL_SEPARATORS = 'hdms:°\'"'
+# Вторые строки наблюдений со спутников и подвижных станций (колонка 15)
+_MPC_SECOND_LINE_NOTES = b'srv'
+_CSV_COLUMNS = {
+    'time': ('observation_time', 'time', 'date', 'datetime', 'utc'),
+    'ra': ('ra_hours', 'ra', 'right_ascension'),
+    'dec': ('dec_degrees', 'dec', 'declination'),
+}
+
+
+def _safe_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _to_float(values, empty=np.nan):
+    """Строковый массив -> float; пустые строки дают empty, неразборчивые — NaN"""
+    values = np.char.strip(np.asarray(values))
+    result = np.full(values.shape, empty, dtype=float)
+    filled = np.char.str_len(values) > 0
+    try:
+        result[filled] = values[filled].astype(float)
+    except ValueError:
+        result[filled] = [_safe_float(v) for v in values[filled]]
+    return result
+
+
+def parse_sexagesimal(values):
+    """
+    Векторный разбор '12h43m27.81s', '-04d19m29.7s', '12 43 27.81', '12:43:27.81'
+    и десятичных чисел. Возвращает float-массив, NaN для неразборчивых значений.
+    """
+    values = np.atleast_1d(np.asarray(values, dtype=str))
+    for separator in _SEXAGESIMAL_SEPARATORS:
+        values = np.char.replace(values, separator, ' ')
+    values = np.char.strip(values)
+    parts = np.char.partition(values, ' ')
+    head = parts[:, 0]
+    parts = np.char.partition(np.char.lstrip(parts[:, 2]), ' ')
+    minutes, seconds = parts[:, 0], parts[:, 2]
+
+    sign = np.where(np.char.startswith(head, '-'), -1.0, 1.0)
+    whole = np.abs(_to_float(head))
+    return sign * (whole + _to_float(minutes, 0.0) / 60 + _to_float(seconds, 0.0) / 3600)
+
+
+def validate_observation_arrays(ra_hours, dec_degrees, jd, reference=None):
+    """
+    Проверки validate_observation_data для целых массивов (validation.validate_observations).
+    Возвращает маску корректных строк и словарь {сообщение: число отброшенных строк}.
+    """
+    return summarize(validate_observations(ra_hours, dec_degrees, jd, reference))
+
+
+def parse_mpc_lines(lines):
+    """Разбор блока строк MPC 80-колоночного формата в массивы (ra_hours, dec_degrees, jd)"""
+    raw = np.array([line.rstrip(b'\r\n') for line in lines], dtype='S80')
+    raw = raw[np.char.str_len(raw) >= 56]
+    raw = raw[~np.isin(raw.view(np.uint8).reshape(-1, 80)[:, 14], list(_MPC_SECOND_LINE_NOTES))]
+    chars = raw.view(np.uint8).reshape(-1, 80)
+
+    def field(start, stop):
+        # Колонки в спецификации MPC нумеруются с единицы
+        return np.ascontiguousarray(chars[:, start - 1:stop]).view(f'S{stop - start + 1}').ravel()
+
+    year = _to_float(field(16, 19))
+    month = _to_float(field(21, 22))
+    day = _to_float(field(24, 32))
+    ra_hours = _to_float(field(33, 34)) + _to_float(field(36, 37), 0.0) / 60 \
+        + _to_float(field(39, 44), 0.0) / 3600
+    dec_sign = np.where(chars[:, 44] == ord('-'), -1.0, 1.0)
+    dec_degrees = dec_sign * (_to_float(field(46, 47)) + _to_float(field(49, 50), 0.0) / 60
+                              + _to_float(field(52, 56), 0.0) / 3600)
+
+    dated = np.isfinite(year) & np.isfinite(month) & (month >= 1) & (month <= 12)
+    months = np.where(dated, (year - 1970) * 12 + month - 1, 0).astype(np.int64)
+    midnight = months.astype('datetime64[M]').astype('datetime64[D]')
+    jd = np.where(dated, datetimes_to_jd(midnight) + day - 1, np.nan)
+    return ra_hours, dec_degrees, jd
+
+
+def _csv_column(header, name):
+    normalized = [h.strip().lower() for h in header]
+    for alias in _CSV_COLUMNS[name]:
+        if alias in normalized:
+            return normalized.index(alias)
+    raise ValueError(f"CSV header must contain one of: {', '.join(_CSV_COLUMNS[name])}")
+
+
+def parse_csv_rows(rows, columns):
+    """Разбор блока строк CSV в массивы (ra_hours, dec_degrees, jd)"""
+    width = max(columns) + 1
+    rows = [row for row in rows if len(row) >= width]
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0)
+    table = np.array([[row[c] for c in columns] for row in rows], dtype=str)
+    time_column, ra_column, dec_column = table.T
+
+    ra_hours = parse_sexagesimal(ra_column)
+    dec_degrees = parse_sexagesimal(dec_column)
+    try:
+        jd = datetimes_to_jd(np.char.strip(time_column))
+    except ValueError:
+        jd = np.array([_safe_jd(t) for t in time_column])
+    return ra_hours, dec_degrees, jd
+
+
+def _safe_jd(value):
+    try:
+        return float(datetimes_to_jd(value.strip()))
+    except ValueError:
+        return np.nan
+
+
+def iter_observation_chunks(stream, file_format, chunk_lines=CHUNK_LINES):
+    """Генератор блоков (ra_hours, dec_degrees, jd) из бинарного потока"""
+    if file_format == 'mpc':
+        while True:
+            lines = list(islice(stream, chunk_lines))
+            if not lines:
+                return
+            yield parse_mpc_lines(lines)
+    elif file_format == 'csv':
+        reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline=''))
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [_csv_column(header, name) for name in ('time', 'ra', 'dec')]
+        while True:
+            rows = list(islice(reader, chunk_lines))
+            if not rows:
+                return
+            yield parse_csv_rows(rows, columns)
+    else:
+        raise ValueError(f"Unsupported observation file format: {file_format}")
+
+
+def detect_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'mpc'
+
+
+def import_observations(stream, store, file_format, chunk_lines=CHUNK_LINES):
+    """
+    Потоковый импорт в хранилище наблюдений.
+    Возвращает (число добавленных строк, число отброшенных строк, {ошибка: число строк}).
+    """
+    imported = rejected = 0
+    errors = {}
+    for ra_hours, dec_degrees, jd in iter_observation_chunks(stream, file_format, chunk_lines):
+        valid, chunk_errors = validate_observation_arrays(ra_hours, dec_degrees, jd, store.sorted_arrays())
+        store.extend(ra_hours[valid], dec_degrees[valid], jd[valid])
+        accepted = int(np.count_nonzero(valid))
+        imported += accepted
+        rejected += len(valid) - accepted
+        for message, count in chunk_errors.items():
+            errors[message] = errors.get(message, 0) + count
+    return imported, rejected, errors
@@ -0,0 +1,236 @@
+"""
+Очередь фоновых расчетов на пуле процессов.
+
+Запрос к /calculate_orbit только ставит задание в очередь и получает его
+идентификатор, а сам расчет идет в отдельном процессе. Одинаковые задания,
+которые еще выполняются, не запускаются повторно: возвращается уже
+существующее задание. Сообщения о ходе заданий из рабочих процессов
+приходят в общую очередь и разбираются одним потоком (см. progress).
+"""
+import hashlib
+import multiprocessing
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import metrics
+import progress
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 16
+DEFAULT_TIMEOUT = 120.0
+# Сколько завершенных заданий хранится для опроса их результатов
+FINISHED_JOBS_KEPT = 256
+
+JOBS_FINISHED = metrics.REGISTRY.counter('comet_jobs_finished_total', 'Background jobs by final status.',
+                                         labels=('status',))
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class JobTimeout(RuntimeError):
+    pass
+
+
+def array_key(*arrays):
+    """Хеш содержимого массивов: ключ для поиска одинаковых заданий"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _raise_timeout(signum, frame):
+    raise JobTimeout("Job exceeded its time limit")
+
+
+def _run_with_timeout(timeout, fn, args, job_id=None):
+    """
+    Выполняется в рабочем процессе: SIGALRM прерывает расчет по истечении
+    времени. Возвращает результат и метрики, записанные за время задания.
+    """
+    progress.start(job_id)
+    progress.report('status', force=True, status='running')
+    try:
+        with metrics.capture() as samples:
+            if timeout is None or not hasattr(signal, 'setitimer'):
+                return fn(*args), samples
+            previous = signal.signal(signal.SIGALRM, _raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                return fn(*args), samples
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous)
+    finally:
+        progress.stop()
+
+
+class Job:
+    def __init__(self, key, future, context=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.future = future
+        # Данные вызывающего кода, нужные для обработки результата
+        self.context = context or {}
+        self.progress = progress.JobProgress()
+        self.submitted = time.monotonic()
+        self.cancelled = False
+
+    @property
+    def status(self):
+        if self.cancelled or self.future.cancelled():
+            return 'cancelled'
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        error = self.future.exception()
+        if isinstance(error, JobTimeout):
+            return 'timeout'
+        return 'failed' if error else 'done'
+
+    @property
+    def done(self):
+        return self.status not in ('queued', 'running')
+
+    @property
+    def error(self):
+        if self.status in ('failed', 'timeout'):
+            return self.future.exception()
+        return None
+
+    def result(self):
+        if self.cancelled:
+            raise CancelledError()
+        return self.future.result(timeout=0)[0]
+
+
+class JobQueue:
+    """
+    Не более max_workers заданий выполняются одновременно, не более max_pending
+    ждут или выполняются; сверх этого submit отвечает QueueFull.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 timeout=DEFAULT_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._messages = None
+        self._dispatcher = None
+        # RLock: future.cancel() вызывает _finish синхронно, под той же блокировкой
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+
+    def _pool(self):
+        # Пул создается при первом задании, чтобы не порождать процессы при импорте
+        if self._executor is None:
+            self._messages = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 initializer=progress.attach, initargs=(self._messages,))
+            self._dispatcher = threading.Thread(target=self._dispatch, args=(self._messages,),
+                                                name='job-progress', daemon=True)
+            self._dispatcher.start()
+        return self._executor
+
+    def _detach_pool(self):
+        """Забирает пул, очередь сообщений и поток разбора; следующее задание создаст новые"""
+        with self._lock:
+            pool = self._executor, self._messages, self._dispatcher
+            self._executor = self._messages = self._dispatcher = None
+        return pool
+
+    @staticmethod
+    def _close_pool(executor, messages, dispatcher, wait):
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if messages is not None:
+            messages.put(None)
+            if wait:
+                dispatcher.join()
+
+    def _dispatch(self, messages):
+        """Раскладывает сообщения рабочих процессов по заданиям; None — конец работы"""
+        for message in iter(messages.get, None):
+            job_id, stage, data = message
+            job = self.get(job_id)
+            if job is not None:
+                job.progress.update(stage, data)
+
+    def submit(self, key, fn, *args, context=None):
+        """Ставит fn(*args) в очередь; для ключа, который уже считается, возвращает то же задание"""
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None and not job.future.done():
+                if job.cancelled:
+                    raise QueueFull("The cancelled calculation is still stopping, try again later")
+                return job
+            if len(self._in_flight) >= self.max_pending:
+                raise QueueFull("Too many orbit calculations in progress, try again later")
+
+            job_id = uuid.uuid4().hex
+            try:
+                future = self._pool().submit(_run_with_timeout, self.timeout, fn, args, job_id)
+            except BrokenProcessPool:
+                # Рабочий процесс погиб (нехватка памяти, kill): такой пул больше не принимает заданий
+                self._close_pool(*self._detach_pool(), wait=False)
+                future = self._pool().submit(_run_with_timeout, self.timeout, fn, args, job_id)
+            job = Job(key, future, context, job_id)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            future.add_done_callback(lambda _, job=job: self._finish(job))
+            self._prune()
+            return job
+
+    def _finish(self, job):
+        with self._lock:
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+        status = job.status
+        job.progress.finish(status)
+        JOBS_FINISHED.inc(status)
+        if status == 'done':
+            metrics.REGISTRY.replay(job.future.result()[1])
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - FINISHED_JOBS_KEPT, 0)]:
+            del self._jobs[job_id]
+
+    @property
+    def in_flight(self):
+        """Число заданий в очереди и в работе"""
+        with self._lock:
+            return len(self._in_flight)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Задание из очереди снимается; у уже выполняющегося результат будет отброшен,
+        но место в очереди занято, пока процесс не закончит расчет.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            if not job.future.cancel():
+                job.cancelled = True
+            job.progress.finish('cancelled')
+            return True
+
+    def shutdown(self, wait=True):
+        self._close_pool(*self._detach_pool(), wait=wait)
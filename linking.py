@@ -0,0 +1,333 @@
+"""
+Связывание неразмеченных наблюдений в объекты.
+
+Наблюдения за ночь смешивают много объектов, поэтому сначала внутри каждой
+ночи собираются треклеты: пары наблюдений, разделенные небольшим интервалом
+и лежащие в круге, который объект успел бы пройти с допустимой скоростью.
+Затем треклеты разных ночей связываются: положение треклета переносится
+с его собственной скоростью на время другой ночи и ищется ближайший треклет
+с похожей скоростью. Связка проверяется пробной моделью движения (квадратичное
+движение в касательной плоскости) по всем ее наблюдениям.
+
+Соседей ищет SkyIndex — сетка кубических ячеек над единичными векторами,
+упорядоченная по номеру ячейки: построение O(n log n), запрос — бинарный
+поиск по 27 соседним ячейкам. Попарного сравнения всех наблюдений нет.
+"""
+import numpy as np
+
+from orbit import ARCSEC, line_of_sight
+
+MAX_RATE_DEG_PER_DAY = 2.0
+# Интервал между наблюдениями одного треклета, сутки
+TRACKLET_MIN_DT = 5 / 1440
+TRACKLET_MAX_DT = 0.25
+TRACKLET_TOLERANCE_ARCSEC = 2.0
+LINK_MAX_GAP_DAYS = 4.0
+LINK_RADIUS_DEG = 0.02
+# Ускорение видимого движения, которое допускается при линейном переносе треклета, град/сут^2
+LINK_ACCELERATION_DEG = 0.05
+LINK_TOLERANCE_ARCSEC = 5.0
+MIN_NIGHTS = 3
+# Перерыв в наблюдениях, который отделяет ночи, сутки: больше TRACKLET_MAX_DT,
+# поэтому пара треклета никогда не попадает в разные ночи
+NIGHT_GAP_DAYS = 1 / 3
+# Непрерывное покрытие несколькими обсерваториями делится на такие отрезки, сутки
+NIGHT_MAX_DAYS = 1.0
+
+_NEIGHBOURS = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'),
+                       axis=-1).reshape(-1, 3)
+# Меньшие ячейки не помещают номер ячейки в int64
+_MIN_CELL = 1e-5
+
+
+class SkyIndex:
+    """Пространственный индекс единичных векторов на равномерной кубической сетке"""
+
+    def __init__(self, vectors, cell):
+        self.vectors = np.asarray(vectors, dtype=float)
+        self.cell = max(cell, _MIN_CELL)
+        self._size = int(np.ceil(2 / self.cell)) + 3
+        keys = self._keys(self._cells(self.vectors))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def _cells(self, vectors):
+        return np.floor((vectors + 1) / self.cell).astype(np.int64) + 1
+
+    def _keys(self, cells):
+        return (cells[..., 0] * self._size + cells[..., 1]) * self._size + cells[..., 2]
+
+    def query(self, points, radius):
+        """
+        Все пары (номер точки запроса, номер точки индекса), хордовое расстояние
+        между которыми не больше radius. Радиус не может превышать размер ячейки.
+        """
+        if radius > self.cell:
+            raise ValueError("Query radius exceeds the index cell size")
+        points = np.asarray(points, dtype=float)
+        # Номер ячейки линеен по координатам ячейки: соседние ячейки получаются сдвигом номера,
+        # и бинарный поиск идет по упорядоченным уникальным ячейкам запроса
+        cells, inverse = np.unique(self._keys(self._cells(points)), return_inverse=True)
+        queries, found = [], []
+        for offset in self._keys(_NEIGHBOURS):
+            lo = np.searchsorted(self.keys, cells + offset, side='left')[inverse]
+            hi = np.searchsorted(self.keys, cells + offset, side='right')[inverse]
+            query, position = _expand_ranges(lo, hi)
+            queries.append(query)
+            found.append(self.order[position])
+        query, found = np.concatenate(queries), np.concatenate(found)
+        distance2 = np.einsum('ij,ij->i', points[query] - self.vectors[found],
+                              points[query] - self.vectors[found])
+        keep = distance2 <= radius ** 2
+        return query[keep], found[keep]
+
+
+def _expand_ranges(lo, hi):
+    """Для диапазонов [lo, hi) — номера диапазонов и все позиции внутри них"""
+    counts = hi - lo
+    starts = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(lo)), counts)
+    return owner, np.arange(counts.sum()) - starts[owner] + lo[owner]
+
+
+def components(size, i, j):
+    """Связные компоненты графа с ребрами (i, j): метка — наименьший номер вершины"""
+    labels = np.arange(size)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        updated = labels.copy()
+        np.minimum.at(updated, i, low)
+        np.minimum.at(updated, j, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def motion_fit(groups, jd, vectors, degree):
+    """
+    Полиномиальная модель движения степени degree в касательной плоскости
+    для каждой группы наблюдений (groups — номера групп 0..G-1).
+    Возвращает центр (G, 3), базис (G, 2, 3), среднее время, коэффициенты
+    (G, 2, degree+1) и среднеквадратичное отклонение в радианах.
+    """
+    count = np.bincount(groups)
+    center = np.zeros((len(count), 3))
+    np.add.at(center, groups, vectors)
+    center /= np.linalg.norm(center, axis=1, keepdims=True)
+    t_mean = np.bincount(groups, weights=jd) / count
+
+    # Касательный базис; у полюса вместо оси z берется ось x
+    axis = np.where(np.abs(center[:, 2:]) > 0.9, [1.0, 0.0, 0.0], [0.0, 0.0, 1.0])
+    east = np.cross(axis, center)
+    east /= np.linalg.norm(east, axis=1, keepdims=True)
+    north = np.cross(center, east)
+    basis = np.stack([east, north], axis=1)
+
+    # Гномоническая проекция
+    c = center[groups]
+    plane = np.einsum('nki,ni->nk', basis[groups], vectors) / np.einsum('ni,ni->n', c, vectors)[:, None]
+    t = jd - t_mean[groups]
+    powers = t[:, None] ** np.arange(2 * degree + 1)
+    normal = np.zeros((len(count), 2 * degree + 1))
+    np.add.at(normal, groups, powers)
+    normal = normal[:, np.add.outer(np.arange(degree + 1), np.arange(degree + 1))]
+    rhs = np.zeros((len(count), 2, degree + 1))
+    np.add.at(rhs, groups, plane[:, :, None] * powers[:, None, :degree + 1])
+    # Группы с числом разных моментов меньше числа коэффициентов решаются псевдообратной матрицей
+    coefficients = np.einsum('gij,gkj->gki', np.linalg.pinv(normal), rhs)
+
+    model = np.einsum('nkj,nj->nk', coefficients[groups], powers[:, :degree + 1])
+    rms = np.sqrt(np.bincount(groups, weights=np.sum((plane - model) ** 2, axis=1)) / count)
+    return center, basis, t_mean, coefficients, rms
+
+
+def observing_nights(jd, gap=NIGHT_GAP_DAYS, max_length=NIGHT_MAX_DAYS):
+    """
+    Номер ночи (0, 1, ... по времени) для каждого наблюдения. Ночь — серия
+    наблюдений без перерывов длиннее gap суток; сутки JD начинаются в полдень
+    UTC, то есть посреди ночи для Азии и Океании, поэтому календарь не
+    используется. Серия длиннее max_length суток делится на отрезки от ее начала.
+    """
+    order = np.argsort(jd, kind='stable')
+    times = jd[order]
+    starts = np.concatenate([[True], np.diff(times) > gap])
+    run = np.cumsum(starts) - 1
+    chunk = np.floor((times - times[starts][run]) / max_length).astype(np.int64)
+    boundary = starts | np.concatenate([[False], np.diff(chunk) != 0])
+    night = np.empty(len(jd), dtype=np.int64)
+    night[order] = np.cumsum(boundary) - 1
+    return night
+
+
+def _mutual_best(i, j, score):
+    """Ребра, лучшие (с наименьшим score) одновременно для своего начала и своего конца"""
+    order = np.argsort(score, kind='stable')
+    i, j = i[order], j[order]
+    _, best_for_i = np.unique(i, return_index=True)
+    _, best_for_j = np.unique(j, return_index=True)
+    mutual = np.intersect1d(best_for_i, best_for_j)
+    return i[mutual], j[mutual]
+
+
+def find_pairs(jd, vectors, night, max_rate, min_dt=TRACKLET_MIN_DT, max_dt=TRACKLET_MAX_DT):
+    """
+    Пары наблюдений одной ночи (i раньше j), совместимые с движением не быстрее
+    max_rate рад/сут. У каждого наблюдения остается не больше одного партнера
+    позже и одного раньше — ближайшие, поэтому пары складываются в цепочки, и
+    соседние объекты в плотном поле не сливаются в один треклет.
+    """
+    radius = max_rate * max_dt
+    i, j = SkyIndex(vectors, radius).query(vectors, radius)
+    dt = jd[j] - jd[i]
+    distance = np.linalg.norm(vectors[j] - vectors[i], axis=1)
+    keep = (night[i] == night[j]) & (dt >= min_dt) & (dt <= max_dt) & (distance <= max_rate * dt)
+    return _mutual_best(i[keep], j[keep], distance[keep])
+
+
+def _split_chains(i, j, jd, vectors, tolerance):
+    """
+    Разрывает цепочки пар там, где скорость на соседних парах различается
+    больше ошибки положения: из двух пар отбрасывается более длинная по времени,
+    обычно это случайный сосед, а не следующее наблюдение того же объекта.
+    """
+    velocity = (vectors[j] - vectors[i]) / (jd[j] - jd[i])[:, None]
+    outgoing = np.full(len(jd), -1)
+    incoming = np.full(len(jd), -1)
+    outgoing[i] = incoming[j] = np.arange(len(i))
+    inner = np.flatnonzero((outgoing >= 0) & (incoming >= 0))
+    before, after = incoming[inner], outgoing[inner]
+    dt_before, dt_after = jd[j[before]] - jd[i[before]], jd[j[after]] - jd[i[after]]
+    mismatch = np.linalg.norm(velocity[before] - velocity[after], axis=1)
+    broken = mismatch > 2 * tolerance / np.minimum(dt_before, dt_after)
+    keep = np.ones(len(i), dtype=bool)
+    keep[np.where(dt_before > dt_after, before, after)[broken]] = False
+    return i[keep], j[keep]
+
+
+class Tracklets:
+    """Треклеты одной или нескольких ночей: положение и скорость на среднее время"""
+
+    def __init__(self, labels, jd, position, velocity, night):
+        self.labels = labels  # номер треклета для каждого наблюдения или -1
+        self.jd = jd
+        self.position = position
+        self.velocity = velocity  # рад/сут в касательной плоскости
+        self.night = night
+
+    def __len__(self):
+        return len(self.jd)
+
+
+def build_tracklets(jd, vectors, night, max_rate, tolerance):
+    n = len(jd)
+    i, j = _split_chains(*find_pairs(jd, vectors, night, max_rate), jd, vectors, tolerance)
+    labels = components(n, i, j)
+    paired = np.zeros(n, dtype=bool)
+    paired[i] = paired[j] = True
+    labels = np.where(paired, labels, -1)
+    _, groups = np.unique(labels[paired], return_inverse=True)
+
+    center, basis, t_mean, coefficients, rms = motion_fit(groups, jd[paired], vectors[paired], 1)
+    # Компоненты, не описываемые равномерным движением, — перепутанные соседние объекты
+    good = rms <= tolerance
+    renumber = np.where(good, np.cumsum(good) - 1, -1)
+    labels[paired] = renumber[groups]
+
+    position = center + np.einsum('gk,gki->gi', coefficients[:, :, 0], basis)
+    position /= np.linalg.norm(position, axis=1, keepdims=True)
+    velocity = np.einsum('gk,gki->gi', coefficients[:, :, 1], basis)
+    first = np.zeros(len(good), dtype=int)
+    first[groups[::-1]] = np.flatnonzero(paired)[::-1]
+    return Tracklets(labels, t_mean[good], position[good], velocity[good], night[first][good])
+
+
+def _link_candidates(tracklets, gap_days, radius, acceleration, rate_tolerance):
+    """Кандидаты связей (a, b) между треклетами разных ночей: b не позже gap_days после a"""
+    edges_a, edges_b, scores = [], [], []
+    for night in np.unique(tracklets.night):
+        targets = np.flatnonzero(tracklets.night == night)
+        earliest = np.min(tracklets.jd[targets]) - gap_days
+        sources = np.flatnonzero((tracklets.night < night) & (tracklets.jd >= earliest))
+        if not len(sources):
+            continue
+        middle = np.median(tracklets.jd[targets])
+        spread = np.max(np.abs(tracklets.jd[targets] - middle))
+        dt = middle - tracklets.jd[sources]
+        predicted = tracklets.position[sources] + tracklets.velocity[sources] * dt[:, None]
+        # Грубый поиск на среднее время ночи, затем точная проверка на время треклета
+        speed = np.linalg.norm(tracklets.velocity[sources], axis=1)
+        coarse = radius + acceleration * (dt + spread) ** 2 + speed * spread
+        index = SkyIndex(tracklets.position[targets], np.max(coarse))
+        q, f = index.query(predicted, np.max(coarse))
+        a, b = sources[q], targets[f]
+
+        dt = tracklets.jd[b] - tracklets.jd[a]
+        predicted = tracklets.position[a] + tracklets.velocity[a] * dt[:, None]
+        miss = np.linalg.norm(predicted / np.linalg.norm(predicted, axis=1, keepdims=True)
+                              - tracklets.position[b], axis=1)
+        rate_miss = np.linalg.norm(tracklets.velocity[a] - tracklets.velocity[b], axis=1)
+        keep = (miss <= radius + acceleration * dt ** 2) & \
+               (rate_miss <= rate_tolerance + 2 * acceleration * dt)
+        edges_a.append(a[keep])
+        edges_b.append(b[keep])
+        scores.append(miss[keep])
+    if not edges_a:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    a, b, score = np.concatenate(edges_a), np.concatenate(edges_b), np.concatenate(scores)
+
+    # Оставляются только взаимно лучшие связи для каждой пары ночей
+    nights = np.max(tracklets.night) + 1
+    a_by_night, b_by_night = _mutual_best(a * nights + tracklets.night[b],
+                                          b * nights + tracklets.night[a], score)
+    return a_by_night // nights, b_by_night // nights
+
+
+class Linkage:
+    def __init__(self, labels, tracklets, objects):
+        self.labels = labels  # номер объекта для каждого наблюдения или -1
+        self.tracklets = tracklets
+        self.objects = objects
+
+    @property
+    def linked(self):
+        return int(np.sum(self.labels >= 0))
+
+
+def link_observations(jd, ra_hours, dec_degrees, max_rate=MAX_RATE_DEG_PER_DAY,
+                      tracklet_tolerance=TRACKLET_TOLERANCE_ARCSEC, gap_days=LINK_MAX_GAP_DAYS,
+                      link_radius=LINK_RADIUS_DEG, acceleration=LINK_ACCELERATION_DEG,
+                      tolerance=LINK_TOLERANCE_ARCSEC, min_nights=MIN_NIGHTS):
+    """
+    Разбивает наблюдения на объекты. Скорости и допуски — в градусах и
+    угловых секундах. Объектом считается связка треклетов не менее чем
+    из min_nights ночей, которую квадратичная модель движения описывает
+    с отклонением не больше tolerance; остальные наблюдения получают метку -1.
+    """
+    jd = np.asarray(jd, dtype=float)
+    vectors = line_of_sight(ra_hours, dec_degrees).reshape(-1, 3)
+    labels = np.full(len(jd), -1)
+    if not len(jd):
+        return Linkage(labels, None, 0)
+    night = observing_nights(jd)
+
+    tracklets = build_tracklets(jd, vectors, night, np.radians(max_rate),
+                                tracklet_tolerance * ARCSEC)
+    if not len(tracklets):
+        return Linkage(labels, tracklets, 0)
+    rate_tolerance = 2 * tracklet_tolerance * ARCSEC / TRACKLET_MIN_DT
+    a, b = _link_candidates(tracklets, gap_days, np.radians(link_radius),
+                            np.radians(acceleration), rate_tolerance)
+    candidates = components(len(tracklets), a, b)
+
+    # Пробная модель по всем наблюдениям каждой связки
+    observed = tracklets.labels >= 0
+    _, groups = np.unique(candidates[tracklets.labels[observed]], return_inverse=True)
+    *_, rms = motion_fit(groups, jd[observed], vectors[observed], 2)
+    nights = np.zeros(len(rms), dtype=int)
+    group_nights = np.unique(np.column_stack([groups, night[observed]]), axis=0)
+    np.add.at(nights, group_nights[:, 0], 1)
+    good = (rms <= tolerance * ARCSEC) & (nights >= min_nights)
+    renumber = np.where(good, np.cumsum(good) - 1, -1)
+    labels[observed] = renumber[groups]
+    return Linkage(labels, tracklets, int(good.sum()))
@@ -0,0 +1,218 @@
+"""
+Метрики расчетов в текстовом формате Prometheus.
+
+Этапы (подгонка, поиск сближения, части графика, кодирование PNG, создание
+наблюдений, сохранение загрузки) замеряются span и попадают в гистограмму
+comet_stage_seconds с меткой stage. Замер — два вызова perf_counter и
+обновление счетчика корзины под блокировкой, поэтому его можно оставлять
+на горячем пути.
+
+Задания выполняются в других процессах пула, где метрики приложения не
+видны. В рабочем процессе capture перехватывает замеры задания, они
+возвращаются вместе с результатом и переносятся replay в реестр процесса,
+отдающего /metrics — единственного рабочего процесса gunicorn.
+"""
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Границы корзин времени этапов, секунды
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# В рабочем процессе на время задания — список замеров вместо записи в реестр
+_captured = None
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if _captured is not None:
+            _captured.append((self.name, labels, amount))
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    _record = inc
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if _captured is not None:
+            _captured.append((self.name, labels, value))
+            return
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Счетчики корзин (последняя — +Inf) и сумма
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _record(self, *labels, amount):
+        self.observe(amount, *labels)
+
+    def count(self, *labels):
+        counts = self._values.get(labels)
+        return 0 if counts is None else sum(counts[:-1])
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [le])} {cumulative}')
+            suffix = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{suffix} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение, вычисляемое при каждом сборе: function() -> число или {метки: число}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labels=(), kind='gauge'):
+        super().__init__(name, documentation, labels)
+        self.function = function
+        self.kind = kind
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, function, labels=(), kind='gauge'):
+        """Метрика по функции; kind='counter' для уже накопленных где-то счетчиков"""
+        return self.register(Gauge(name, documentation, function, labels, kind))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if samples:
+                lines += metric.header() + samples
+        return '\n'.join(lines) + '\n'
+
+    def replay(self, samples):
+        """Переносит замеры, перехваченные capture в другом процессе"""
+        for name, labels, amount in samples:
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric._record(*labels, amount=amount)
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('comet_stage_seconds', 'Time spent in a processing stage.',
+                                   labels=('stage',))
+
+
+class span:
+    """
+    Замер этапа: with span('orbit.fit'): ... Время попадает в
+    comet_stage_seconds, в том числе если этап закончился исключением.
+    """
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, self.stage)
+
+
+@contextlib.contextmanager
+def capture():
+    """В рабочем процессе: замеры внутри блока собираются в список для replay"""
+    global _captured
+    previous, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = previous
@@ -0,0 +1,193 @@
+"""
+Оценка неопределенности сближения с Землей методом Монте-Карло.
+
+Клоны орбиты выбираются из нормального распределения с ковариацией подгонки
+(вектор состояния на эпоху). Все клоны сразу переносятся к моменту
+номинального сближения, затем для каждого ищется минимум расстояния до Земли
+в окне вокруг этого момента: сначала на сетке (массив клоны x моменты), потом
+уточнением по смене знака скорости сближения. Клоны считаются частями
+(большие наборы — в пуле процессов), после каждой части в ход задания
+сообщается промежуточная статистика.
+
+Если номинальное сближение найдено с возмущениями планет, номинал переносится
+к нему интегрированием, а каждый клон — как номинал плюс его отклонение от
+номинала в задаче двух тел: интегрировать каждый клон на десятилетия слишком
+долго, а отличие отклонения от двухтельного — второго порядка малости.
+"""
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import progress
+from nbody import PerturbedOrbit
+from orbit import earth_state, propagate
+
+DEFAULT_CLONES = 10000
+DEFAULT_WINDOW_DAYS = 30.0
+# Меньшие наборы быстрее посчитать в одном процессе, чем раздать по пулу
+PARALLEL_MIN_CLONES = 4000
+# Клонов в одной части расчета
+CHUNK_CLONES = 2000
+EARTH_RADIUS_AU = 6378.137 / 149597870.7
+PERCENTILES = (0, 5, 25, 50, 75, 95, 100)
+
+
+class CloseApproachDistribution:
+    def __init__(self, nominal_jd, nominal_distance, times, distances, unresolved, propagation='two-body'):
+        self.nominal_jd = nominal_jd
+        self.nominal_distance = nominal_distance
+        self.times = times  # JD минимального расстояния для каждого клона
+        self.distances = distances  # а.е.
+        # Клоны, у которых минимум пришелся на край окна поиска
+        self.unresolved = unresolved
+        self.clones = len(distances)
+        self.impact_probability = float(np.mean(distances < EARTH_RADIUS_AU))
+        # Модель переноса к сближению: 'two-body' или 'n-body' (номинал с возмущениями)
+        self.propagation = propagation
+
+    def distance_percentiles(self):
+        return dict(zip(PERCENTILES, np.percentile(self.distances, PERCENTILES).tolist()))
+
+    def time_percentiles(self):
+        """Отклонение момента сближения от номинального, сутки"""
+        return dict(zip(PERCENTILES, np.percentile(self.times - self.nominal_jd, PERCENTILES).tolist()))
+
+
+def sample_clones(fit, clones, seed=0):
+    """
+    Векторы состояния (clones, 6), распределенные по N(fit.state, fit.covariance).
+    Ковариация из псевдообратной матрицы может быть вырожденной, поэтому
+    используется спектральное разложение вместо Холецкого.
+    """
+    w, V = np.linalg.eigh(fit.covariance)
+    L = V * np.sqrt(np.clip(w, 0, None))
+    z = np.random.default_rng(seed).standard_normal((clones, 6))
+    return fit.state + z @ L.T
+
+
+def _approach_geometry(r0, v0, t0, jd):
+    r, v = propagate(r0, v0, jd - t0)
+    re, ve = earth_state(jd)
+    d = r - re
+    return np.linalg.norm(d, axis=-1), np.einsum('...i,...i', d, v - ve)
+
+
+def clone_approaches(states, t0, window=DEFAULT_WINDOW_DAYS, step=1.0, max_shifts=8,
+                     tol=1e-6, max_iter=40):
+    """
+    Минимальное расстояние до Земли для каждого клона вблизи t0.
+    states — состояния клонов (N, 6) на момент t0. Окно ±window строится вокруг
+    линейной оценки момента сближения каждого клона и сдвигается, пока минимум
+    лежит на его краю. Возвращает моменты, расстояния и маску клонов, для
+    которых минимум так и не оказался внутри окна.
+    """
+    r0, v0 = states[:, :3], states[:, 3:]
+    re, ve = earth_state(t0)
+    d, u = r0 - re, v0 - ve
+    center = t0 - np.einsum('ij,ij->i', d, u) / np.einsum('ij,ij->i', u, u)
+    offsets = np.arange(-window, window + step / 2, step)
+    k = np.empty(len(states), dtype=int)
+    grid = np.empty((len(states), len(offsets)))
+    todo = np.arange(len(states))
+
+    for _ in range(max_shifts):
+        grid[todo] = center[todo, None] + offsets
+        distance, _ = _approach_geometry(r0[todo, None], v0[todo, None], t0, grid[todo])
+        k[todo] = np.argmin(distance, axis=1)
+        at_edge = (k[todo] == 0) | (k[todo] == len(offsets) - 1)
+        todo = todo[at_edge]
+        if not len(todo):
+            break
+        center[todo] = grid[todo, k[todo]]
+    unresolved = np.zeros(len(states), dtype=bool)
+    unresolved[todo] = True
+
+    # Минимум лежит между соседними узлами сетки: там скорость сближения меняет знак
+    rows = np.arange(len(states))
+    lo = grid[rows, np.maximum(k - 1, 0)]
+    hi = grid[rows, np.minimum(k + 1, len(offsets) - 1)]
+    _, f_lo = _approach_geometry(r0, v0, t0, lo)
+    _, f_hi = _approach_geometry(r0, v0, t0, hi)
+    bracketed = (f_lo < 0) & (f_hi >= 0)
+    side = np.zeros(len(states), dtype=int)
+
+    for _ in range(max_iter):
+        if np.all(~bracketed | (hi - lo <= tol)):
+            break
+        mid = (lo * f_hi - hi * f_lo) / (f_hi - f_lo)
+        mid = np.where(bracketed & (mid > lo) & (mid < hi), mid, (lo + hi) / 2)
+        _, f_mid = _approach_geometry(r0, v0, t0, mid)
+
+        left = f_mid < 0
+        lo = np.where(left, mid, lo)
+        f_lo = np.where(left, f_mid, f_lo)
+        hi = np.where(left, hi, mid)
+        f_hi = np.where(left, f_hi, f_mid)
+        f_hi = np.where(left & (side == -1), f_hi / 2, f_hi)
+        f_lo = np.where(~left & (side == 1), f_lo / 2, f_lo)
+        side = np.where(left, -1, 1)
+
+    times = np.where(bracketed, (lo + hi) / 2, grid[rows, k])
+    distances, _ = _approach_geometry(r0, v0, t0, times)
+    return times, distances, unresolved
+
+
+def _clone_approaches_chunk(args):
+    return clone_approaches(*args)
+
+
+def _report_clones(parts, clones):
+    """Статистика по уже посчитанным частям для потока событий задания"""
+    done = sum(len(part[1]) for part in parts)
+    if not (progress.active() and (done == clones or progress.due('monte_carlo'))):
+        return
+    distances = np.concatenate([part[1] for part in parts])
+    low, median, high = np.percentile(distances, (5, 50, 95)).tolist()
+    progress.report('monte_carlo', force=True, clones_done=done, clones=clones,
+                    impact_probability=float(np.mean(distances < EARTH_RADIUS_AU)),
+                    distance_p5_au=low, distance_median_au=median, distance_p95_au=high,
+                    unresolved=int(sum(np.count_nonzero(part[2]) for part in parts)))
+
+
+def monte_carlo_close_approach(elements, approach_jd, clones=DEFAULT_CLONES,
+                               window=DEFAULT_WINDOW_DAYS, seed=0, workers=1, ephemeris=None):
+    """
+    Распределение минимального расстояния и момента сближения для клонов орбиты
+    вокруг номинального сближения approach_jd. Элементы должны содержать fit.
+    С ephemeris клоны переносятся к сближению вместе с номиналом, посчитанным
+    с возмущениями планет (см. описание модуля).
+    """
+    fit = elements.fit
+    if fit is None:
+        raise ValueError("Orbit uncertainty requires a fitted orbit")
+
+    states = sample_clones(fit, clones, seed)
+    # Один перенос всех клонов от эпохи подгонки к моменту сближения
+    r, v = propagate(states[:, :3], states[:, 3:], approach_jd - fit.epoch)
+    nominal_r, nominal_v = propagate(fit.state[:3], fit.state[3:], approach_jd - fit.epoch)
+    if ephemeris is not None:
+        perturbed_r, perturbed_v = PerturbedOrbit(fit.state, fit.epoch, approach_jd, approach_jd,
+                                                  ephemeris).state_at(approach_jd)
+        r, v = r + (perturbed_r - nominal_r), v + (perturbed_v - nominal_v)
+        nominal_r, nominal_v = perturbed_r, perturbed_v
+    states = np.hstack([r, v])
+
+    parallel = workers > 1 and clones >= PARALLEL_MIN_CLONES
+    count = max(-(-clones // CHUNK_CLONES), workers if parallel else 1)
+    chunks = [(chunk, approach_jd, window) for chunk in np.array_split(states, count)]
+    parts = []
+    with contextlib.ExitStack() as stack:
+        if parallel:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = pool.map(_clone_approaches_chunk, chunks)
+        else:
+            results = map(_clone_approaches_chunk, chunks)
+        for part in results:
+            parts.append(part)
+            _report_clones(parts, clones)
+    times, distances, unresolved = (np.concatenate(part) for part in zip(*parts))
+
+    nominal = clone_approaches(np.hstack([nominal_r, nominal_v])[None, :], approach_jd, window)
+    return CloseApproachDistribution(float(nominal[0][0]), float(nominal[1][0]), times, distances, unresolved,
+                                     'two-body' if ephemeris is None else 'n-body')
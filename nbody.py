@@ -0,0 +1,149 @@
+"""
+Движение кометы с возмущениями от больших планет.
+
+Уравнения движения в гелиоцентрической системе (притяжение Солнца, прямое
+и косвенное ускорения от планет) интегрируются методом Булирша–Штёра:
+модифицированный метод средней точки с экстраполяцией Ричардсона, порядок
+и шаг выбираются адаптивно. Интегрируется сразу массив состояний (B, 6);
+положения планет на все подшаги шага берутся из таблицы Чебышева одним
+вызовом. Между шагами состояние восстанавливается интерполяцией Эрмита
+пятой степени по положению, скорости и ускорению на концах шага.
+"""
+import numpy as np
+
+import progress
+from orbit import GAUSS_K, MU_SUN
+
+# Последовательность числа подшагов средней точки
+_SEQUENCE = np.arange(2, 18, 2)
+_FRACTIONS = [np.arange(n + 1) / n for n in _SEQUENCE]
+_OFFSETS = np.concatenate([[0], np.cumsum([n + 1 for n in _SEQUENCE])])
+_ALL_FRACTIONS = np.concatenate(_FRACTIONS)
+# Порядок экстраполяции, на котором шаг считается удачно подобранным
+_TARGET_COLUMN = 5
+DEFAULT_TOLERANCE = 1e-11
+MAX_STEP_DAYS = 60.0
+# Угол среднего движения за шаг: ограничивает ошибку интерполяции между узлами
+MAX_STEP_ANGLE = 0.2
+
+
+def accelerations(r, planets, gm):
+    """
+    Гелиоцентрическое ускорение для положений r (B, 3) при положениях планет (P, 3).
+    Косвенный член учитывает ускорение самого Солнца планетами.
+    """
+    rn = np.linalg.norm(r, axis=-1, keepdims=True)
+    d = planets[None] - r[:, None]
+    dn = np.linalg.norm(d, axis=-1, keepdims=True)
+    pn = np.linalg.norm(planets, axis=-1, keepdims=True)
+    direct = np.einsum('p,bpi->bi', gm, d / dn ** 3)
+    indirect = gm @ (planets / pn ** 3)
+    return -MU_SUN * r / rn ** 3 + direct - indirect
+
+
+def _derivative(y, planets, gm):
+    return np.concatenate([y[:, 3:], accelerations(y[:, :3], planets, gm)], axis=1)
+
+
+def _bulirsch_stoer_step(t, y, f0, H, ephemeris, tol):
+    """
+    Один шаг длины H. Возвращает (новое состояние, номер столбца экстраполяции)
+    или (None, None), если точность не достигнута.
+    """
+    planets = ephemeris.positions(t + H * _ALL_FRACTIONS)
+    gm = ephemeris.gm
+    table = []
+    for j, n in enumerate(_SEQUENCE):
+        P = planets[_OFFSETS[j]:_OFFSETS[j + 1]]
+        h = H / n
+        z0, z1 = y, y + h * f0
+        for m in range(1, n):
+            z0, z1 = z1, z0 + 2 * h * _derivative(z1, P[m], gm)
+        row = [(z0 + z1 + h * _derivative(z1, P[n], gm)) / 2]
+        for k in range(1, j + 1):
+            ratio = (n / _SEQUENCE[j - k]) ** 2 - 1
+            row.append(row[k - 1] + (row[k - 1] - table[j - 1][k - 1]) / ratio)
+        table.append(row)
+
+        if j >= 2:
+            scale = tol * np.maximum(np.maximum(np.abs(y), np.abs(row[j])), 1e-3)
+            if np.max(np.abs(row[j] - row[j - 1]) / scale) <= 1:
+                return row[j], j
+    return None, None
+
+
+def integrate(states, t0, t1, ephemeris, tol=DEFAULT_TOLERANCE, max_step=MAX_STEP_DAYS):
+    """
+    Интегрирует состояния (B, 6) от t0 до t1 (в любую сторону).
+    Возвращает узлы шагов: моменты (S+1,), положения, скорости и ускорения (S+1, B, 3).
+    """
+    y = np.array(states, dtype=float).reshape(-1, 6)
+    direction = 1.0 if t1 >= t0 else -1.0
+    t = t0
+    H = direction * min(1.0, abs(t1 - t0)) if t1 != t0 else 0.0
+    f = _derivative(y, ephemeris.positions(t), ephemeris.gm)
+    times, positions, velocities, accels = [t], [y[:, :3]], [y[:, 3:]], [f[:, 3:]]
+
+    while direction * (t1 - t) > 1e-12:
+        r = np.min(np.linalg.norm(y[:, :3], axis=1))
+        H = direction * min(abs(H), abs(t1 - t), max_step, MAX_STEP_ANGLE * r ** 1.5 / GAUSS_K)
+        y_new, column = _bulirsch_stoer_step(t, y, f, H, ephemeris, tol)
+        if y_new is None:
+            H /= 2
+            continue
+
+        t, y = t + H, y_new
+        f = _derivative(y, ephemeris.positions(t), ephemeris.gm)
+        times.append(t)
+        positions.append(y[:, :3])
+        velocities.append(y[:, 3:])
+        accels.append(f[:, 3:])
+        progress.report('integration', start_jd=float(t0), end_jd=float(t1), jd=float(t),
+                        steps=len(times) - 1)
+        # Быстрая сходимость — шаг можно увеличить, медленная — уменьшить
+        if column < _TARGET_COLUMN:
+            H *= 1.6
+        elif column > _TARGET_COLUMN:
+            H *= 0.7
+
+    return np.array(times), np.array(positions), np.array(velocities), np.array(accels)
+
+
+def hermite_state(nodes, jd):
+    """Положение и скорость (jd.shape + (B, 3)) по узлам интегрирования"""
+    times, r, v, a = nodes
+    jd = np.asarray(jd, dtype=float)
+    k = np.clip(np.searchsorted(times, jd, side='right') - 1, 0, len(times) - 2)
+    H = (times[k + 1] - times[k])[..., None, None]
+    s = ((jd - times[k]) / (times[k + 1] - times[k]))[..., None, None]
+    s2, s3 = s * s, s * s * s
+    s4, s5 = s3 * s, s3 * s2
+
+    r0, r1, v0, v1, a0, a1 = r[k], r[k + 1], v[k], v[k + 1], a[k], a[k + 1]
+    position = ((1 - 10 * s3 + 15 * s4 - 6 * s5) * r0 + (10 * s3 - 15 * s4 + 6 * s5) * r1
+                + H * ((s - 6 * s3 + 8 * s4 - 3 * s5) * v0 + (-4 * s3 + 7 * s4 - 3 * s5) * v1)
+                + H * H * ((s2 - 3 * s3 + 3 * s4 - s5) / 2 * a0 + (s3 - 2 * s4 + s5) / 2 * a1))
+    velocity = ((-30 * s2 + 60 * s3 - 30 * s4) * (r0 - r1) / H
+                + (1 - 18 * s2 + 32 * s3 - 15 * s4) * v0 + (-12 * s2 + 28 * s3 - 15 * s4) * v1
+                + H * ((2 * s - 9 * s2 + 12 * s3 - 5 * s4) / 2 * a0 + (3 * s2 - 8 * s3 + 5 * s4) / 2 * a1))
+    return position, velocity
+
+
+class PerturbedOrbit:
+    """
+    Траектория одного объекта с возмущениями на интервале [jd_start, jd_end].
+    Метод state_at позволяет передавать ее в find_close_approach вместо элементов.
+    """
+
+    def __init__(self, state, epoch, jd_start, jd_end, ephemeris, tol=DEFAULT_TOLERANCE):
+        self.jd_start = min(jd_start, epoch)
+        self.jd_end = max(jd_end, epoch)
+        backward = integrate(state, epoch, self.jd_start, ephemeris, tol)
+        forward = integrate(state, epoch, self.jd_end, ephemeris, tol)
+        # Узлы обратного интегрирования разворачиваются, общий узел эпохи берется один раз
+        self.nodes = tuple(np.concatenate([b[::-1][:-1], f]) for b, f in zip(backward, forward))
+        self.steps = len(self.nodes[0]) - 1
+
+    def state_at(self, jd):
+        r, v = hermite_state(self.nodes, jd)
+        return r[..., 0, :], v[..., 0, :]
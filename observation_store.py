@@ -0,0 +1,245 @@
+"""
+Колоночное хранилище наблюдений.
+
+RA, Dec и JD лежат в непрерывных массивах NumPy, ссылки на изображения —
+индексы в таблице имен файлов. На одно наблюдение приходится 28 байт.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from orbit import J2000
+
+_J2000_DATETIME = datetime(2000, 1, 1, 12)
+_UNIX_EPOCH_JD = 2440587.5
+_INITIAL_CAPACITY = 64
+
+# Сутки UTC, в конце которых добавлялась секунда координации: их длина 86401 с
+_LEAP_SECOND_DAYS = np.array([
+    '1972-06-30', '1972-12-31', '1973-12-31', '1974-12-31', '1975-12-31', '1976-12-31',
+    '1977-12-31', '1978-12-31', '1979-12-31', '1981-06-30', '1982-06-30', '1983-06-30',
+    '1985-06-30', '1987-12-31', '1989-12-31', '1990-12-31', '1992-06-30', '1993-06-30',
+    '1994-06-30', '1995-12-31', '1997-06-30', '1998-12-31', '2005-12-31', '2008-12-31',
+    '2012-06-30', '2015-06-30', '2016-12-31',
+], dtype='datetime64[D]')
+
+
+def _to_datetime64(times):
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype('datetime64[us]')
+    if times.dtype.kind == 'U':
+        times = np.char.rstrip(times, 'Z')
+        # Знак смещения часового пояса может стоять только после даты YYYY-MM-DD
+        has_offset = (np.char.rfind(times, '+') >= 10) | (np.char.rfind(times, '-') >= 10)
+        if not np.any(has_offset):
+            return times.astype('datetime64[us]')
+        # Строки со смещением часового пояса разбираются поштучно
+        times = np.array([datetime.fromisoformat(t) for t in times.ravel()],
+                         dtype=object).reshape(times.shape)
+    flat = [t.astimezone(timezone.utc).replace(tzinfo=None) if t.tzinfo else t for t in times.ravel()]
+    return np.array(flat, dtype='datetime64[us]').reshape(times.shape)
+
+
+def datetimes_to_jd(times):
+    """
+    UTC -> JD для целого массива моментов (datetime, datetime64 или ISO-строки)
+    без создания объектов astropy Time. Совпадает с Time(times).jd, включая
+    сутки с секундой координации.
+    """
+    times = _to_datetime64(times)
+    day = times.astype('datetime64[D]')
+    seconds = (times - day) / np.timedelta64(1, 's')
+    day_length = np.where(np.isin(day, _LEAP_SECOND_DAYS), 86401.0, 86400.0)
+    return _UNIX_EPOCH_JD + day.astype(np.int64) + seconds / day_length
+
+
+def jd_to_datetime(jd):
+    """JD (UTC) -> datetime с точностью до миллисекунды"""
+    return _J2000_DATETIME + timedelta(milliseconds=round((jd - J2000) * 86400000))
+
+
+def jd_to_iso(jd):
+    """JD (UTC) -> строки ISO 8601 с миллисекундами для целого массива, как jd_to_datetime"""
+    milliseconds = np.round((np.asarray(jd, dtype=float) - J2000) * 86400000).astype(np.int64)
+    return np.datetime_as_string(np.datetime64(_J2000_DATETIME, 'ms') + milliseconds.astype('timedelta64[ms]'),
+                                 unit='ms')
+
+
+class ObservationRow:
+    """Легковесное представление одной строки хранилища с интерфейсом Observation"""
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def ra_hours(self):
+        return float(self._store._ra[self._index])
+
+    @property
+    def dec_degrees(self):
+        return float(self._store._dec[self._index])
+
+    @property
+    def jd(self):
+        return float(self._store._jd[self._index])
+
+    @property
+    def observation_time(self):
+        return jd_to_datetime(self.jd)
+
+    @property
+    def image_filename(self):
+        return self._store.image_filename(self._index)
+
+
+class ObservationStore:
+    def __init__(self, capacity=_INITIAL_CAPACITY):
+        self._ra = np.empty(capacity)
+        self._dec = np.empty(capacity)
+        self._jd = np.empty(capacity)
+        self._image = np.empty(capacity, dtype=np.int32)
+        self._images = []
+        self._size = 0
+        self._is_sorted = True
+        self._sorted_cache = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield ObservationRow(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            if step != 1:
+                raise ValueError("Only contiguous slices are supported")
+            return self._view(start, stop)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Observation index out of range")
+        return ObservationRow(self, index)
+
+    def _view(self, start, stop):
+        """Срез без копирования столбцов: новое хранилище над теми же буферами"""
+        view = ObservationStore.__new__(ObservationStore)
+        view._ra = self._ra[start:stop]
+        view._dec = self._dec[start:stop]
+        view._jd = self._jd[start:stop]
+        view._image = self._image[start:stop]
+        # Свой список имен: добавление снимков через срез не меняет таблицу исходного хранилища
+        view._images = list(self._images)
+        view._size = max(stop - start, 0)
+        view._is_sorted = bool(np.all(np.diff(view._jd) >= 0))
+        view._sorted_cache = None
+        view._lock = threading.RLock()
+        return view
+
+    @property
+    def ra_hours(self):
+        return self._ra[:self._size]
+
+    @property
+    def dec_degrees(self):
+        return self._dec[:self._size]
+
+    @property
+    def jd(self):
+        return self._jd[:self._size]
+
+    @property
+    def nbytes(self):
+        return sum(a[:self._size].nbytes for a in (self._ra, self._dec, self._jd, self._image))
+
+    def image_filename(self, index):
+        image = self._image[index]
+        return self._images[image] if image >= 0 else None
+
+    def image_filenames(self):
+        """Имена всех снимков, на которые ссылаются наблюдения"""
+        return set(self._images)
+
+    def image_column(self):
+        """Имя снимка (или None) для каждого наблюдения, массив объектов"""
+        names = np.array(self._images + [None], dtype=object)
+        return names[self._image[:self._size]]
+
+    def _reserve(self, size):
+        capacity = len(self._jd)
+        if size <= capacity:
+            return
+        # Удвоение емкости дает амортизированное O(1) на добавление
+        capacity = max(size, 2 * capacity, _INITIAL_CAPACITY)
+        for name in ('_ra', '_dec', '_jd', '_image'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def append(self, ra_hours, dec_degrees, jd, image_filename=None):
+        self.extend([ra_hours], [dec_degrees], [jd],
+                    None if image_filename is None else [image_filename])
+
+    def append_observation(self, observation):
+        self.append(observation.ra_hours, observation.dec_degrees,
+                    observation.jd, observation.image_filename)
+
+    def extend(self, ra_hours, dec_degrees, jd, image_filenames=None):
+        """Пакетное добавление наблюдений из массивов"""
+        jd = np.asarray(jd, dtype=float)
+        count = len(jd)
+        if not count:
+            return
+        with self._lock:
+            self._extend(ra_hours, dec_degrees, jd, image_filenames)
+
+    def _extend(self, ra_hours, dec_degrees, jd, image_filenames):
+        count = len(jd)
+        start, stop = self._size, self._size + count
+        self._reserve(stop)
+
+        self._ra[start:stop] = ra_hours
+        self._dec[start:stop] = dec_degrees
+        self._jd[start:stop] = jd
+        if image_filenames is None:
+            self._image[start:stop] = -1
+        else:
+            for i, filename in enumerate(image_filenames, start):
+                if filename:
+                    self._images.append(filename)
+                    self._image[i] = len(self._images) - 1
+                else:
+                    self._image[i] = -1
+
+        if self._is_sorted:
+            previous = self._jd[start - 1:stop] if start else jd
+            self._is_sorted = bool(np.all(np.diff(previous) >= 0))
+        self._size = stop
+        self._sorted_cache = None
+
+    def sorted_arrays(self):
+        """
+        Массивы (jd, ra_hours, dec_degrees), упорядоченные по времени.
+        Если наблюдения поступали по порядку, возвращаются представления без копирования;
+        иначе результат сортировки кешируется до следующего изменения.
+        """
+        if self._is_sorted:
+            return self.jd, self.ra_hours, self.dec_degrees
+        if self._sorted_cache is None:
+            order = np.argsort(self.jd, kind='stable')
+            self._sorted_cache = (self.jd[order], self.ra_hours[order], self.dec_degrees[order])
+        return self._sorted_cache
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._images = []
+            self._is_sorted = True
+            self._sorted_cache = None
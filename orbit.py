@@ -0,0 +1,789 @@
+"""
+Определение орбиты кометы по угловым наблюдениям.
+
+Начальная орбита строится методом Гаусса, затем уточняется дифференциальной
+коррекцией (метод наименьших квадратов) сразу по всем парам RA/Dec.
+Все вычисления ведутся массивами NumPy: гелиоцентрические векторы в
+экваториальной системе J2000, единицы — а.е. и сутки.
+"""
+import numpy as np
+
+import earth
+import progress
+
+GAUSS_K = 0.01720209895
+MU_SUN = GAUSS_K ** 2  # а.е.^3 / сут^2
+SPEED_OF_LIGHT = 173.1446326846693  # а.е. / сут
+J2000 = 2451545.0
+ARCSEC = np.pi / (180 * 3600)
+# Допуск по эксцентриситету, внутри которого орбита считается параболической
+PARABOLIC_TOLERANCE = 1e-8
+# Невязка, после которой остальные кандидаты начальной орбиты не перебираются
+ACCEPTABLE_RMS_ARCSEC = 60.0
+# Наблюдение с невязкой больше CLIP_SIGMA среднеквадратичных исключается из подгонки
+# (если невязка больше CLIP_MIN_ARCSEC); отбрасывание повторяется до CLIP_MAX_ROUNDS раз.
+# Если выбросами оказывается больше CLIP_MAX_FRACTION наблюдений, плоха сама орбита
+CLIP_SIGMA = 3.0
+CLIP_MIN_ARCSEC = 1.0
+CLIP_MAX_ROUNDS = 5
+CLIP_MAX_FRACTION = 0.25
+# Узлов сетки поиска сближения в одном блоке (около 10 лет при шаге в сутки)
+_SCAN_BLOCK = 3653
+
+_EPS = np.radians(23.4392911)
+# Поворот из экваториальной системы J2000 в эклиптическую
+EQ_TO_ECL = np.array([[1.0, 0.0, 0.0],
+                      [0.0, np.cos(_EPS), np.sin(_EPS)],
+                      [0.0, -np.sin(_EPS), np.cos(_EPS)]])
+
+
+class OrbitalElements:
+    def __init__(self, a, e, i, raan, arg_peri, t_peri, q=None, fit=None):
+        self.a = a
+        self.e = e
+        self.i = i
+        self.raan = raan
+        self.arg_peri = arg_peri
+        self.t_peri = t_peri
+        self.q = a * (1 - e) if q is None else q
+        # Результат подгонки (OrbitFit), если элементы получены из наблюдений
+        self.fit = fit
+
+
+class OrbitFit:
+    def __init__(self, epoch, state, covariance, residuals, iterations, jd=None, jacobian=None,
+                 rejected=None):
+        self.epoch = epoch
+        self.state = state
+        self.covariance = covariance
+        self.residuals = residuals  # угловые секунды, (N, 2): RA*cos(Dec), Dec
+        self.iterations = iterations
+        self.nobs = len(residuals)
+        # Наблюдения, исключенные из подгонки как выбросы (маска в порядке времени)
+        self.rejected = np.zeros(self.nobs, dtype=bool) if rejected is None else rejected
+        kept = residuals[~self.rejected]
+        self.rms_arcsec = float(np.sqrt(np.mean(kept ** 2)))
+        # Для уточнения после добавления наблюдений: моменты наблюдений, якобиан
+        # невязок по состоянию (N, 2, 6), нормальная матрица J^T J и градиент J^T r
+        # (по оставленным наблюдениям)
+        self.jd = jd
+        self.jacobian = jacobian
+        self.normal_matrix = self.gradient = None
+        if jacobian is not None:
+            J = jacobian[~self.rejected].reshape(-1, 6)
+            self.normal_matrix = J.T @ J
+            self.gradient = J.T @ (kept.ravel() * ARCSEC)
+
+    @property
+    def rejected_count(self):
+        return int(np.count_nonzero(self.rejected))
+
+
+def earth_state(jd):
+    """
+    Гелиоцентрические положение (а.е.) и скорость (а.е./сут) Земли в экваторе J2000
+    по таблице earth; для дат вне ее интервала — формулы Almanac
+    """
+    jd = np.asarray(jd, dtype=float)
+    table = earth.table()
+    inside = table.covers(jd)
+    if np.all(inside):
+        return table.state(jd)
+    r, v = almanac_earth_state(jd)
+    if np.any(inside):
+        r[inside], v[inside] = table.state(jd[inside])
+    return r, v
+
+
+def almanac_earth_state(jd):
+    """Состояние Земли по формулам Astronomical Almanac для Солнца (точность ~0.01°)"""
+    n = np.asarray(jd, dtype=float) - J2000
+    dL = np.radians(0.9856474)
+    dg = np.radians(0.9856003)
+    L = np.radians(280.460) + dL * n
+    g = np.radians(357.528) + dg * n
+    lam = L + np.radians(1.915) * np.sin(g) + np.radians(0.020) * np.sin(2 * g)
+    dlam = dL + (np.radians(1.915) * np.cos(g) + np.radians(0.040) * np.cos(2 * g)) * dg
+    R = 1.00014 - 0.01671 * np.cos(g) - 0.00014 * np.cos(2 * g)
+    dR = (0.01671 * np.sin(g) + 0.00028 * np.sin(2 * g)) * dg
+    eps = np.radians(23.439 - 0.0000004 * n)
+
+    cos_lam, sin_lam = np.cos(lam), np.sin(lam)
+    r = -np.stack([R * cos_lam,
+                   R * np.cos(eps) * sin_lam,
+                   R * np.sin(eps) * sin_lam], axis=-1)
+    dx = dR * cos_lam - R * sin_lam * dlam
+    dy = dR * sin_lam + R * cos_lam * dlam
+    v = -np.stack([dx, np.cos(eps) * dy, np.sin(eps) * dy], axis=-1)
+    return r, v
+
+
+def earth_position(jd):
+    """Гелиоцентрическое положение Земли (а.е., экватор J2000)"""
+    return earth_state(jd)[0]
+
+
+def line_of_sight(ra_hours, dec_degrees):
+    """Единичные векторы направления на объект"""
+    ra = np.radians(np.asarray(ra_hours, dtype=float) * 15)
+    dec = np.radians(np.asarray(dec_degrees, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def _stumpff(z):
+    # Быстрые ветви: у одного состояния знак z на всех шагах по времени одинаков
+    if np.all(z > 1e-8):
+        sz = np.sqrt(z)
+        return (1 - np.cos(sz)) / z, (sz - np.sin(sz)) / (z * sz)
+    if np.all(z < -1e-8):
+        sz = np.sqrt(-z)
+        return (np.cosh(sz) - 1) / -z, (np.sinh(sz) - sz) / (-z * sz)
+
+    c = np.empty_like(z)
+    s = np.empty_like(z)
+    pos = z > 1e-8
+    neg = z < -1e-8
+    small = ~(pos | neg)
+
+    sz = np.sqrt(z[pos])
+    c[pos] = (1 - np.cos(sz)) / z[pos]
+    s[pos] = (sz - np.sin(sz)) / sz ** 3
+
+    sz = np.sqrt(-z[neg])
+    c[neg] = (np.cosh(sz) - 1) / -z[neg]
+    s[neg] = (np.sinh(sz) - sz) / sz ** 3
+
+    zs = z[small]
+    c[small] = 1 / 2 - zs / 24 + zs ** 2 / 720
+    s[small] = 1 / 6 - zs / 120 + zs ** 2 / 5040
+    return c, s
+
+
+def propagate(r0, v0, dt, mu=MU_SUN, tol=1e-13, max_iter=40):
+    """
+    Задача двух тел в универсальных переменных для любых конических сечений.
+    r0, v0 — (..., 3), dt — массив, совместимый по форме с r0[..., 0].
+    Уравнение Кеплера решается методом Лагерра сразу для всего массива.
+    """
+    r0 = np.asarray(r0, dtype=float)
+    v0 = np.asarray(v0, dtype=float)
+    dt = np.asarray(dt, dtype=float)
+    shape = np.broadcast_shapes(r0.shape[:-1], v0.shape[:-1], dt.shape)
+    r0 = np.broadcast_to(r0, shape + (3,))
+    v0 = np.broadcast_to(v0, shape + (3,))
+    dt = np.broadcast_to(dt, shape)
+
+    sqmu = np.sqrt(mu)
+    r0n = np.linalg.norm(r0, axis=-1)
+    sigma0 = np.einsum('...i,...i', r0, v0) / sqmu
+    alpha = 2 / r0n - np.einsum('...i,...i', v0, v0) / mu
+    beta = 1 - alpha * r0n
+
+    chi = np.where(alpha > 0, sqmu * dt * alpha, sqmu * dt / r0n)
+    for _ in range(max_iter):
+        z = alpha * chi ** 2
+        c, s = _stumpff(z)
+        F = sigma0 * chi ** 2 * c + beta * chi ** 3 * s + r0n * chi - sqmu * dt
+        dF = sigma0 * chi * (1 - z * s) + beta * chi ** 2 * c + r0n
+        ddF = sigma0 * (1 - z * c) + beta * chi * (1 - z * s)
+        root = np.sqrt(np.abs(16 * dF ** 2 - 20 * F * ddF))
+        delta = 5 * F / (dF + root)
+        chi = chi - delta
+        if np.all(np.abs(delta) <= tol * np.maximum(np.abs(chi), 1.0)):
+            break
+
+    z = alpha * chi ** 2
+    c, s = _stumpff(z)
+    f = 1 - chi ** 2 / r0n * c
+    g = dt - chi ** 3 * s / sqmu
+    r = f[..., None] * r0 + g[..., None] * v0
+    rn = np.linalg.norm(r, axis=-1)
+    fdot = sqmu / (rn * r0n) * chi * (z * s - 1)
+    gdot = 1 - chi ** 2 / rn * c
+    v = fdot[..., None] * r0 + gdot[..., None] * v0
+    return r, v
+
+
+def predict_radec(states, epoch, jd, earth):
+    """
+    Видимые RA/Dec (радианы) для набора состояний states (B, 6) на моменты jd (N,)
+    с учетом светового времени. Возвращает массивы формы (B, N).
+    """
+    r0 = states[:, None, :3]
+    v0 = states[:, None, 3:]
+    dt = jd[None, :] - epoch
+    r, v = propagate(r0, v0, dt)
+    # Световое время: за ~0.01 сут поправка второго порядка пренебрежимо мала
+    light_time = np.linalg.norm(r - earth, axis=-1) / SPEED_OF_LIGHT
+    topo = r - light_time[..., None] * v - earth
+    ra = np.arctan2(topo[..., 1], topo[..., 0])
+    dec = np.arcsin(topo[..., 2] / np.linalg.norm(topo, axis=-1))
+    return ra, dec
+
+
+def _residuals(states, epoch, jd, earth, ra_obs, dec_obs):
+    ra, dec = predict_radec(states, epoch, jd, earth)
+    dra = np.angle(np.exp(1j * (ra_obs - ra))) * np.cos(dec_obs)
+    return np.concatenate([dra, dec_obs - dec], axis=-1)
+
+
+def gauss_iod(jd, los, earth, mu=MU_SUN, max_iter=10):
+    """
+    Предварительная орбита методом Гаусса сразу для K троек наблюдений:
+    jd — (K, 3), los и earth — (K, 3, 3). Возвращает массив кандидатов (M, 6)
+    на момент второго наблюдения каждой тройки.
+
+    Для каждого корня уравнения Гаусса орбита уточняется итерациями с точными
+    f, g и световым временем. На длинных дугах итерации могут расходиться,
+    поэтому в ответ попадают все промежуточные состояния — лучшее выбирается
+    по невязкам всей дуги.
+    """
+    tau1 = jd[:, 0] - jd[:, 1]
+    tau3 = jd[:, 2] - jd[:, 1]
+    tau = tau3 - tau1
+
+    p = np.stack([np.cross(los[:, 1], los[:, 2]),
+                  np.cross(los[:, 0], los[:, 2]),
+                  np.cross(los[:, 0], los[:, 1])], axis=1)
+    D0 = np.einsum('ki,ki->k', los[:, 0], p[:, 0])
+    D = np.einsum('kia,kja->kij', earth, p)  # D[k, i, j] = R_i . p_j
+
+    A = (-D[:, 0, 1] * tau3 / tau + D[:, 1, 1] + D[:, 2, 1] * tau1 / tau) / D0
+    B = (D[:, 0, 1] * (tau3 ** 2 - tau ** 2) * tau3 / tau
+         + D[:, 2, 1] * (tau ** 2 - tau1 ** 2) * tau1 / tau) / (6 * D0)
+    E = np.einsum('ki,ki->k', earth[:, 1], los[:, 1])
+    a = -(A ** 2 + 2 * A * E + np.einsum('ki,ki->k', earth[:, 1], earth[:, 1]))
+    b = -2 * mu * B * (A + E)
+    c = -mu ** 2 * B ** 2
+
+    triplet, r2 = [], []
+    for k in np.flatnonzero((np.abs(D0) > 1e-14) & (tau1 < 0) & (tau3 > 0)):
+        roots = np.roots([1, 0, a[k], 0, 0, b[k], 0, 0, c[k]])
+        roots = roots[(np.abs(roots.imag) < 1e-10) & (roots.real > 0)].real
+        triplet.extend([k] * len(roots))
+        r2.extend(roots)
+    if not triplet:
+        return np.empty((0, 6))
+
+    k = np.array(triplet)
+    r23 = np.array(r2) ** 3
+    tau1, tau3, tau, D, D0 = tau1[k], tau3[k], tau[k], D[k], D0[k]
+    los, earth = los[k], earth[k]
+
+    rho = np.stack([
+        ((6 * (D[:, 2, 0] * tau1 / tau3 + D[:, 1, 0] * tau / tau3) * r23
+          + mu * D[:, 2, 0] * (tau ** 2 - tau1 ** 2) * tau1 / tau3)
+         / (6 * r23 + mu * (tau ** 2 - tau3 ** 2)) - D[:, 0, 0]) / D0,
+        A[k] + mu * B[k] / r23,
+        ((6 * (D[:, 0, 2] * tau3 / tau1 - D[:, 1, 2] * tau / tau1) * r23
+          + mu * D[:, 0, 2] * (tau ** 2 - tau3 ** 2) * tau3 / tau1)
+         / (6 * r23 + mu * (tau ** 2 - tau1 ** 2)) - D[:, 2, 2]) / D0,
+    ], axis=1)
+    f1 = 1 - mu * tau1 ** 2 / (2 * r23)
+    g1 = tau1 - mu * tau1 ** 3 / (6 * r23)
+    f3 = 1 - mu * tau3 ** 2 / (2 * r23)
+    g3 = tau3 - mu * tau3 ** 3 / (6 * r23)
+
+    states = []
+    active = np.all(rho > 0, axis=1)
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+        r = earth + rho[..., None] * los
+        v2 = (-f3[:, None] * r[:, 0] + f1[:, None] * r[:, 2]) / (f1 * g3 - f3 * g1)[:, None]
+        states.append(np.concatenate([r[:, 1], v2], axis=1)[active])
+
+        # Промежутки между моментами излучения света
+        t_emit = np.stack([tau1, np.zeros_like(tau1), tau3], axis=1) - rho / SPEED_OF_LIGHT
+        dt = t_emit[:, [0, 2]] - t_emit[:, 1:2]
+        with np.errstate(all='ignore'):
+            r_dt, _ = propagate(r[:, None, 1], v2[:, None], dt, mu=mu)
+            # r(dt) = f r2 + g v2: f и g из нормальных уравнений 2x2
+            rr = np.einsum('ki,ki->k', r[:, 1], r[:, 1])
+            rv = np.einsum('ki,ki->k', r[:, 1], v2)
+            vv = np.einsum('ki,ki->k', v2, v2)
+            rx = np.einsum('ki,kji->kj', r[:, 1], r_dt)
+            vx = np.einsum('ki,kji->kj', v2, r_dt)
+            det = rr * vv - rv ** 2
+            f = (vv[:, None] * rx - rv[:, None] * vx) / det[:, None]
+            g = (rr[:, None] * vx - rv[:, None] * rx) / det[:, None]
+            f1, f3 = f[:, 0], f[:, 1]
+            g1, g3 = g[:, 0], g[:, 1]
+
+            det = f1 * g3 - f3 * g1
+            c1 = g3 / det
+            c3 = -g1 / det
+            rho_new = np.stack([
+                (-D[:, 0, 0] + D[:, 1, 0] / c1 - c3 / c1 * D[:, 2, 0]) / D0,
+                (-c1 * D[:, 0, 1] + D[:, 1, 1] - c3 * D[:, 2, 1]) / D0,
+                (-c1 / c3 * D[:, 0, 2] + D[:, 1, 2] / c3 - D[:, 2, 2]) / D0,
+            ], axis=1)
+        active &= np.all(np.isfinite(rho_new) & (rho_new > 0), axis=1)
+        active &= ~np.all(np.abs(rho_new - rho) <= 1e-12 * rho, axis=1)
+        rho = np.where(active[:, None], rho_new, rho)
+
+    if not states:
+        return np.empty((0, 6))
+    return np.concatenate(states)
+
+
+def differential_correction(state, epoch, jd, earth, ra_obs, dec_obs, max_iter=50, tol=1e-10):
+    """
+    Уточнение состояния методом Левенберга–Марквардта.
+    Якобиан (конечные разности) считается одним пакетом из 6 возмущенных состояний.
+    """
+    x = np.array(state, dtype=float)
+    res = _residuals(x[None], epoch, jd, earth, ra_obs, dec_obs)[0]
+    cost = res @ res
+    lam = 1e-3
+    iterations = 0
+    J = None
+
+    for iterations in range(1, max_iter + 1):
+        scale = np.repeat([np.linalg.norm(x[:3]), np.linalg.norm(x[3:])], 3)
+        h = 1e-7 * scale
+        res_batch = _residuals(x + np.diag(h), epoch, jd, earth, ra_obs, dec_obs)
+        J = ((res_batch - res) / h[:, None]).T
+
+        A = J.T @ J
+        g = J.T @ res
+        improved = False
+        while lam < 1e12:
+            dx = np.linalg.solve(A + lam * np.diag(np.diag(A)), -g)
+            x_new = x + dx
+            res_new = _residuals(x_new[None], epoch, jd, earth, ra_obs, dec_obs)[0]
+            cost_new = res_new @ res_new
+            if np.isfinite(cost_new) and cost_new < cost:
+                improved = True
+                break
+            lam *= 10
+
+        if not improved:
+            break
+
+        converged = cost - cost_new <= tol * cost or np.all(np.abs(dx) <= 1e-12 * scale)
+        x, res, cost = x_new, res_new, cost_new
+        lam = max(lam / 10, 1e-12)
+        if progress.due('fit'):
+            _report_fit(state_to_elements(x, epoch), iterations, res)
+        if converged:
+            break
+
+    return x, res, J, iterations
+
+
+def state_to_elements(state, epoch, mu=MU_SUN):
+    """Гелиоцентрические эклиптические элементы орбиты по вектору состояния"""
+    r = EQ_TO_ECL @ state[:3]
+    v = EQ_TO_ECL @ state[3:]
+    rn = np.linalg.norm(r)
+    h = np.cross(r, v)
+    hn = np.linalg.norm(h)
+    node = np.array([-h[1], h[0], 0.0])
+    nn = np.linalg.norm(node)
+    e_vec = ((v @ v - mu / rn) * r - (r @ v) * v) / mu
+    e = np.linalg.norm(e_vec)
+    a = 1 / (2 / rn - (v @ v) / mu)
+    q = hn ** 2 / mu / (1 + e)
+
+    i = np.arccos(np.clip(h[2] / hn, -1, 1))
+    if nn > 1e-12:
+        raan = np.arctan2(node[1], node[0]) % (2 * np.pi)
+        arg_peri = np.arccos(np.clip(node @ e_vec / (nn * e), -1, 1))
+        if e_vec[2] < 0:
+            arg_peri = 2 * np.pi - arg_peri
+    else:
+        raan = 0.0
+        arg_peri = np.arctan2(e_vec[1], e_vec[0]) % (2 * np.pi)
+
+    nu = np.arccos(np.clip(e_vec @ r / (e * rn), -1, 1))
+    if r @ v < 0:
+        nu = -nu
+
+    if e < 1 - PARABOLIC_TOLERANCE:
+        E = 2 * np.arctan(np.sqrt((1 - e) / (1 + e)) * np.tan(nu / 2))
+        M = E - e * np.sin(E)
+        t_peri = epoch - M / np.sqrt(mu / a ** 3)
+    elif e > 1 + PARABOLIC_TOLERANCE:
+        H = 2 * np.arctanh(np.sqrt((e - 1) / (e + 1)) * np.tan(nu / 2))
+        M = e * np.sinh(H) - H
+        t_peri = epoch - M / np.sqrt(mu / (-a) ** 3)
+    else:
+        D = np.tan(nu / 2)
+        t_peri = epoch - np.sqrt(2 * q ** 3 / mu) * (D + D ** 3 / 3)
+
+    return OrbitalElements(a=float(a), e=float(e), i=float(np.degrees(i)),
+                           raan=float(np.degrees(raan)), arg_peri=float(np.degrees(arg_peri)),
+                           t_peri=float(t_peri), q=float(q))
+
+
+def _triplets(n):
+    """Тройки наблюдений для метода Гаусса: вся дуга и вложенные короткие дуги вокруг середины"""
+    mid = n // 2
+    yield [0, mid, n - 1]
+    k = min(mid, n - 1 - mid) // 2
+    for _ in range(3):
+        if k < 1:
+            break
+        yield [mid - k, mid, mid + k]
+        k //= 2
+
+
+def fit_orbit(jd, ra_hours, dec_degrees, max_iter=50, clip_sigma=CLIP_SIGMA):
+    """
+    Определение орбиты по массивам наблюдений, отсортированным по времени.
+    Возвращает OrbitalElements с заполненным атрибутом fit. Выбросы (невязка
+    больше clip_sigma среднеквадратичных) исключаются; None — без отбрасывания.
+    """
+    jd = np.asarray(jd, dtype=float)
+    if len(jd) < 3:
+        raise ValueError("At least 3 observations required")
+
+    ra_obs = np.radians(np.asarray(ra_hours, dtype=float) * 15)
+    dec_obs = np.radians(np.asarray(dec_degrees, dtype=float))
+    los = line_of_sight(ra_hours, dec_degrees)
+    earth = earth_position(jd)
+
+    mid = len(jd) // 2
+    epoch = jd[mid]
+    idx = np.array(list(_triplets(len(jd))))
+    candidates = gauss_iod(jd[idx], los[idx], earth[idx])
+    if not len(candidates):
+        raise ValueError("Initial orbit determination failed: observations are degenerate")
+
+    # Из всех кандидатов метода Гаусса уточняется тот, что лучше описывает всю дугу
+    sample = np.unique(np.linspace(0, len(jd) - 1, 64).astype(int))
+    with np.errstate(all='ignore'):
+        res = _residuals(candidates, epoch, jd[sample], earth[sample], ra_obs[sample], dec_obs[sample])
+        cost = np.einsum('ij,ij->i', res, res)
+    cost[~np.isfinite(cost)] = np.inf
+
+    best = None
+    for k in np.argsort(cost)[:3]:
+        if not np.isfinite(cost[k]):
+            break
+        with np.errstate(all='ignore'):
+            x, res, J, iterations = differential_correction(
+                candidates[k], epoch, jd, earth, ra_obs, dec_obs, max_iter=max_iter)
+        if np.isfinite(res @ res) and (best is None or res @ res < best[1] @ best[1]):
+            best = (x, res, J, iterations)
+        if best is not None and np.sqrt(np.mean(best[1] ** 2)) < ACCEPTABLE_RMS_ARCSEC * ARCSEC:
+            break
+
+    if best is None:
+        raise ValueError("Orbit determination did not converge")
+
+    x, res, J, iterations = best
+    rejected = np.zeros(len(jd), dtype=bool)
+    x, res, J, iterations, rejected = _clip_outliers(x, res, J, iterations, rejected, epoch, jd, earth,
+                                                     ra_obs, dec_obs, max_iter, clip_sigma)
+    n = len(jd)
+    return _fitted_elements(epoch, x, res.reshape(2, n).T, J.reshape(2, n, 6).transpose(1, 0, 2),
+                            jd, iterations, rejected)
+
+
+def _clip_outliers(x, res, J, iterations, rejected, epoch, jd, earth, ra_obs, dec_obs, max_iter,
+                   clip_sigma):
+    """
+    Итеративное отбрасывание выбросов. res, J — невязки и якобиан всех
+    наблюдений в точке x (как у differential_correction), rejected — уже
+    исключенные. На каждом шаге выбросами считаются наблюдения с невязкой
+    больше clip_sigma среднеквадратичных невязок оставленных, орбита уточняется
+    без них; исключенные раньше возвращаются, если новое решение их описывает.
+    """
+    n = len(jd)
+    if clip_sigma is None:
+        return x, res, J, iterations, rejected
+    for _ in range(CLIP_MAX_ROUNDS):
+        norm = np.hypot(res[:n], res[n:])
+        limit = max(clip_sigma * np.sqrt(np.mean(norm[~rejected] ** 2)), CLIP_MIN_ARCSEC * ARCSEC)
+        outliers = norm > limit
+        count = np.count_nonzero(outliers)
+        if np.array_equal(outliers, rejected) or count > CLIP_MAX_FRACTION * n or n - count < 3:
+            break
+        kept = ~outliers
+        rows = np.concatenate([kept, kept])
+        # Обычно исключается немного наблюдений: шаг Гаусса–Ньютона без них по
+        # прежнему якобиану, если линейная модель подтверждается точными невязками
+        dx = np.linalg.lstsq(J[rows], -res[rows], rcond=None)[0]
+        with np.errstate(all='ignore'):
+            res_new = _residuals((x + dx)[None], epoch, jd, earth, ra_obs, dec_obs)[0]
+        tolerance = max(0.1 * limit / clip_sigma, 0.01 * ARCSEC)
+        if np.all(np.isfinite(res_new)) and np.max(np.abs(res_new - res - J @ dx)[rows]) <= tolerance:
+            x, res, rejected = x + dx, res_new, outliers
+            iterations += 1
+            continue
+        with np.errstate(all='ignore'):
+            x_new, _, _, extra = differential_correction(x, epoch, jd[kept], earth[kept], ra_obs[kept],
+                                                         dec_obs[kept], max_iter=max_iter)
+            res_new, J_new = _jacobian(x_new, epoch, jd, earth, ra_obs, dec_obs)
+        if not np.all(np.isfinite(res_new)):
+            break
+        x, res, J, rejected = x_new, res_new, J_new, outliers
+        iterations += extra
+    return x, res, J, iterations, rejected
+
+
+def _fitted_elements(epoch, x, res, J, jd, iterations, rejected=None):
+    """
+    Элементы с результатом подгонки; res — невязки (N, 2) в радианах, J — (N, 2, 6),
+    rejected — маска наблюдений, не вошедших в подгонку
+    """
+    kept = slice(None) if rejected is None else ~rejected
+    normal_matrix = J[kept].reshape(-1, 6).T @ J[kept].reshape(-1, 6)
+    dof = max(res[kept].size - 6, 1)
+    covariance = np.linalg.pinv(normal_matrix) * np.sum(res[kept] ** 2) / dof
+    elements = state_to_elements(x, epoch)
+    elements.fit = OrbitFit(epoch, x, covariance, res / ARCSEC, iterations, jd=jd, jacobian=J,
+                            rejected=rejected)
+    _report_fit(elements, iterations, res[kept], force=True, rejected=elements.fit.rejected_count)
+    return elements
+
+
+def _report_fit(elements, iteration, res, force=False, rejected=0):
+    """Ход подгонки для потока событий задания; res — невязки в радианах"""
+    progress.report('fit', force=force, iteration=iteration, observations=res.size // 2,
+                    rms_arcsec=float(np.sqrt(np.mean(res ** 2)) / ARCSEC), rejected=rejected,
+                    a_au=elements.a, e=elements.e, i_deg=elements.i, raan_deg=elements.raan,
+                    arg_peri_deg=elements.arg_peri, q_au=elements.q, t_peri_jd=elements.t_peri)
+
+
+def _jacobian(x, epoch, jd, earth, ra_obs, dec_obs):
+    """Невязки в точке x и их якобиан по состоянию (те же конечные разности, что в подгонке)"""
+    scale = np.repeat([np.linalg.norm(x[:3]), np.linalg.norm(x[3:])], 3)
+    h = 1e-7 * scale
+    res_batch = _residuals(np.vstack([x, x + np.diag(h)]), epoch, jd, earth, ra_obs, dec_obs)
+    return res_batch[0], ((res_batch[1:] - res_batch[0]) / h[:, None]).T
+
+
+def refine_orbit(elements, jd, ra_hours, dec_degrees, new, max_iter=50, clip_sigma=CLIP_SIGMA):
+    """
+    Уточнение готовой орбиты после добавления наблюдений.
+    jd, ra_hours, dec_degrees — все наблюдения по времени, new — маска добавленных;
+    остальные должны совпадать с наблюдениями, по которым получен elements.fit.
+
+    Нормальные уравнения подгонки дополняются строками только новых наблюдений
+    (шаг Гаусса–Ньютона от прежнего решения), невязки прежних наблюдений
+    пересчитываются линейно по сохраненному якобиану. Если новые наблюдения
+    описываются линейной моделью плохо, выполняется полная подгонка
+    Левенберга–Марквардта, начатая с уточненного решения, и выбросы
+    отбираются заново. Исключенные прежде наблюдения остаются исключенными.
+    """
+    fit = elements.fit
+    jd = np.asarray(jd, dtype=float)
+    new = np.asarray(new, dtype=bool)
+    if fit is None or fit.jacobian is None or np.count_nonzero(~new) != fit.nobs:
+        raise ValueError("Orbit fit does not match the previous observations")
+
+    ra_obs = np.radians(np.asarray(ra_hours, dtype=float) * 15)
+    dec_obs = np.radians(np.asarray(dec_degrees, dtype=float))
+    epoch, x0 = fit.epoch, fit.state
+    rejected = np.zeros(len(jd), dtype=bool)
+    rejected[~new] = fit.rejected
+    earth_new = earth_position(jd[new])
+    k = np.count_nonzero(new)
+
+    res_new, J_new = _jacobian(x0, epoch, jd[new], earth_new, ra_obs[new], dec_obs[new])
+    A = fit.normal_matrix + J_new.T @ J_new
+    g = fit.gradient + J_new.T @ res_new
+    dx = np.linalg.solve(A, -g)
+    x = x0 + dx
+
+    # Проверка линейности на новых наблюдениях: предсказанные невязки против точных
+    res_exact = _residuals(x[None], epoch, jd[new], earth_new, ra_obs[new], dec_obs[new])[0]
+    res_linear = res_new + J_new @ dx
+    tolerance = max(0.1 * fit.rms_arcsec, 0.01) * ARCSEC
+    if np.all(np.isfinite(res_exact)) and np.max(np.abs(res_exact - res_linear)) <= tolerance:
+        res_old = fit.residuals * ARCSEC + fit.jacobian @ dx
+        res = np.empty((len(jd), 2))
+        res[~new] = res_old
+        res[new] = res_exact.reshape(2, k).T
+        J = np.empty((len(jd), 2, 6))
+        J[~new] = fit.jacobian
+        J[new] = J_new.reshape(2, k, 6).transpose(1, 0, 2)
+        return _fitted_elements(epoch, x, res, J, jd, 1, rejected)
+
+    earth = earth_position(jd)
+    kept = ~rejected
+    with np.errstate(all='ignore'):
+        x, _, _, iterations = differential_correction(
+            x, epoch, jd[kept], earth[kept], ra_obs[kept], dec_obs[kept], max_iter=max_iter)
+        res, J = _jacobian(x, epoch, jd, earth, ra_obs, dec_obs)
+    x, res, J, iterations, rejected = _clip_outliers(x, res, J, iterations, rejected, epoch, jd, earth,
+                                                     ra_obs, dec_obs, max_iter, clip_sigma)
+    n = len(jd)
+    return _fitted_elements(epoch, x, res.reshape(2, n).T, J.reshape(2, n, 6).transpose(1, 0, 2),
+                            jd, iterations, rejected)
+
+
+def perifocal_axes(i, raan, arg_peri):
+    """Направления на перигелий (P) и на 90° по движению (Q) в эклиптике; углы в градусах"""
+    cos_O, sin_O = np.cos(np.radians(raan)), np.sin(np.radians(raan))
+    cos_w, sin_w = np.cos(np.radians(arg_peri)), np.sin(np.radians(arg_peri))
+    cos_i, sin_i = np.cos(np.radians(i)), np.sin(np.radians(i))
+    P = np.stack([cos_O * cos_w - sin_O * sin_w * cos_i,
+                  sin_O * cos_w + cos_O * sin_w * cos_i,
+                  sin_w * sin_i], axis=-1)
+    Q = np.stack([-cos_O * sin_w - sin_O * cos_w * cos_i,
+                  -sin_O * sin_w + cos_O * cos_w * cos_i,
+                  cos_w * sin_i], axis=-1)
+    return P, Q
+
+
+def kepler_state(q, e, i, raan, arg_peri, t_peri, jd, mu=MU_SUN, tol=1e-14, max_iter=50):
+    """
+    Положение и скорость по элементам орбиты (углы в градусах, как в OrbitalElements).
+    Все аргументы — массивы, совместимые по форме; эллиптические, параболические и
+    гиперболические орбиты решаются методом Ньютона сразу для всего массива.
+    Возвращает r, v формы (..., 3) в экваторе J2000.
+    """
+    q, e, i, raan, arg_peri, t_peri, jd = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (q, e, i, raan, arg_peri, t_peri, jd)))
+    dt = jd - t_peri
+    x, y, vx, vy = (np.empty(dt.shape) for _ in range(4))
+
+    ell = e < 1 - PARABOLIC_TOLERANCE
+    hyp = e > 1 + PARABOLIC_TOLERANCE
+    par = ~(ell | hyp)
+
+    if np.any(ell):
+        ee = e[ell]
+        a = q[ell] / (1 - ee)
+        n = np.sqrt(mu / a ** 3)
+        M = np.remainder(n * dt[ell] + np.pi, 2 * np.pi) - np.pi
+        E = np.where(ee > 0.8, np.pi * np.sign(M), M + ee * np.sin(M))
+        for _ in range(max_iter):
+            delta = (E - ee * np.sin(E) - M) / (1 - ee * np.cos(E))
+            E -= delta
+            if np.all(np.abs(delta) <= tol):
+                break
+        cos_E, sin_E = np.cos(E), np.sin(E)
+        b = a * np.sqrt(1 - ee ** 2)
+        dE = n / (1 - ee * cos_E)
+        x[ell] = a * (cos_E - ee)
+        y[ell] = b * sin_E
+        vx[ell] = -a * sin_E * dE
+        vy[ell] = b * cos_E * dE
+
+    if np.any(hyp):
+        ee = e[hyp]
+        a = q[hyp] / (ee - 1)
+        n = np.sqrt(mu / a ** 3)
+        M = n * dt[hyp]
+        H = np.arcsinh(M / ee)
+        for _ in range(max_iter):
+            delta = (ee * np.sinh(H) - H - M) / (ee * np.cosh(H) - 1)
+            H -= delta
+            if np.all(np.abs(delta) <= tol * np.maximum(np.abs(H), 1.0)):
+                break
+        cosh_H, sinh_H = np.cosh(H), np.sinh(H)
+        b = a * np.sqrt(ee ** 2 - 1)
+        dH = n / (ee * cosh_H - 1)
+        x[hyp] = a * (ee - cosh_H)
+        y[hyp] = b * sinh_H
+        vx[hyp] = -a * sinh_H * dH
+        vy[hyp] = b * cosh_H * dH
+
+    if np.any(par):
+        qq = q[par]
+        scale = np.sqrt(2 * qq ** 3 / mu)
+        M = dt[par] / scale
+        # Уравнение Баркера D + D^3/3 = M
+        D = np.where(np.abs(M) < 1, M, np.cbrt(3 * M))
+        for _ in range(max_iter):
+            delta = (D + D ** 3 / 3 - M) / (1 + D ** 2)
+            D -= delta
+            if np.all(np.abs(delta) <= tol * np.maximum(np.abs(D), 1.0)):
+                break
+        dD = 1 / (scale * (1 + D ** 2))
+        x[par] = qq * (1 - D ** 2)
+        y[par] = 2 * qq * D
+        vx[par] = -2 * qq * D * dD
+        vy[par] = 2 * qq * dD
+
+    # Перифокальная система -> эклиптика -> экватор
+    P, Q = perifocal_axes(i, raan, arg_peri)
+    r = (x[..., None] * P + y[..., None] * Q) @ EQ_TO_ECL
+    v = (vx[..., None] * P + vy[..., None] * Q) @ EQ_TO_ECL
+    return r, v
+
+
+def elements_state(elements, jd):
+    """
+    Положение и скорость объекта на моменты jd. Вместо OrbitalElements можно
+    передать траекторию с методом state_at (например, nbody.PerturbedOrbit).
+    """
+    if hasattr(elements, 'state_at'):
+        return elements.state_at(jd)
+    return kepler_state(elements.q, elements.e, elements.i, elements.raan,
+                        elements.arg_peri, elements.t_peri, jd)
+
+
+def _approach_geometry(elements, jd):
+    r, v = elements_state(elements, jd)
+    re, ve = earth_state(jd)
+    d = r - re
+    return np.linalg.norm(d, axis=-1), np.einsum('...i,...i', d, v - ve)
+
+
+def find_close_approaches(elements, jd_start, days, step=1.0, tol=1e-7, max_iter=60):
+    """
+    Все сближения с Землей на интервале [jd_start, jd_start + days].
+    Минимумы расстояния ищутся по смене знака скорости сближения на
+    равномерной сетке, затем уточняются методом Иллинойса (модифицированная
+    regula falsi) сразу для всех найденных интервалов.
+    Возвращает массивы моментов (JD) и расстояний (а.е.), упорядоченные по времени.
+    """
+    t = jd_start + np.arange(0.0, days + step, step)
+    # Сетка считается блоками, чтобы сообщать об охвате интервала поиска
+    distance, rate = np.empty(len(t)), np.empty(len(t))
+    for low in range(0, len(t), _SCAN_BLOCK):
+        high = min(low + _SCAN_BLOCK, len(t))
+        distance[low:high], rate[low:high] = _approach_geometry(elements, t[low:high])
+        if progress.active() and (high == len(t) or progress.due('close_approach')):
+            nearest = int(np.argmin(distance[:high]))
+            progress.report('close_approach', force=True,
+                            searched_days=float(min(t[high - 1] - jd_start, days)), total_days=float(days),
+                            nearest_jd=float(t[nearest]), nearest_distance_au=float(distance[nearest]))
+
+    k = np.flatnonzero((rate[:-1] < 0) & (rate[1:] >= 0))
+    lo, hi = t[k], t[k + 1]
+    f_lo, f_hi = rate[k], rate[k + 1]
+    side = np.zeros(len(k), dtype=int)
+
+    for _ in range(max_iter):
+        if not len(k) or np.all(hi - lo <= tol):
+            break
+        mid = (lo * f_hi - hi * f_lo) / (f_hi - f_lo)
+        mid = np.where((mid > lo) & (mid < hi), mid, (lo + hi) / 2)
+        _, f_mid = _approach_geometry(elements, mid)
+
+        left = f_mid < 0
+        lo = np.where(left, mid, lo)
+        f_lo = np.where(left, f_mid, f_lo)
+        hi = np.where(left, hi, mid)
+        f_hi = np.where(left, f_hi, f_mid)
+        # Illinois: если граница не сдвигается второй раз подряд, ее значение уменьшается вдвое
+        f_hi = np.where(left & (side == -1), f_hi / 2, f_hi)
+        f_lo = np.where(~left & (side == 1), f_lo / 2, f_lo)
+        side = np.where(left, -1, 1)
+
+    times = (lo + hi) / 2
+    approach_distance, _ = _approach_geometry(elements, times)
+
+    # Концы интервала тоже могут быть минимумами расстояния
+    if rate[0] > 0:
+        times = np.insert(times, 0, t[0])
+        approach_distance = np.insert(approach_distance, 0, distance[0])
+    if rate[-1] < 0:
+        times = np.append(times, t[-1])
+        approach_distance = np.append(approach_distance, distance[-1])
+    return times, approach_distance
+
+
+def find_close_approach(elements, jd_start, days, step=1.0):
+    """Ближайшее сближение с Землей на интервале: (JD, расстояние в а.е.)"""
+    times, distance = find_close_approaches(elements, jd_start, days, step=step)
+    k = np.argmin(distance)
+    return float(times[k]), float(distance[k])
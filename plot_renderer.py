@@ -0,0 +1,303 @@
+"""
+Отрисовка графика орбиты без pyplot.
+
+Фигура строится через объектный API (Figure + FigureCanvasAgg) один раз на
+поток: Солнце, орбита Земли, сетка, подписи осей и цветовая шкала создаются
+заранее, а при каждой отрисовке обновляются только данные. Глобального
+состояния pyplot нет, поэтому рендереры разных потоков не мешают друг другу.
+
+Неизменная часть фигуры (рамки, заголовки, легенда, подписи осей) один раз
+растеризуется в фон. PNG получается восстановлением фона и отрисовкой поверх
+него только артистов с данными и делений; SVG рисуется целиком.
+
+Matplotlib загружается при создании первой заготовки, а не при импорте
+модуля: импорт приложения и процессы пула заданий не платят за него, пока
+график не понадобился. warm_up загружает его заранее (gunicorn.conf.py).
+"""
+import io
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from metrics import span
+from observation_store import jd_to_iso
+from orbit import EQ_TO_ECL, earth_position, elements_state, perifocal_axes
+from validation import angular_separation
+
+FIGURE_SIZE = (15, 6)
+DPI = 100
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+_ORBIT_POINTS = 100
+_THETA = np.linspace(0, 2 * np.pi, _ORBIT_POINTS)
+_INFO_BOX = dict(boxstyle='round', facecolor='wheat', alpha=0.8)
+# Больше стольких наблюдений на небе рисуется не точками, а ячейками сетки
+# цвета среднего времени попавших в них наблюдений
+DETAIL_LIMIT = 1000
+_DENSITY_BINS = (200, 150)
+# Пунктир пути прореживается до стольких вершин
+_PATH_VERTICES = 1000
+# Подписываются номера не больше стольких наблюдений, равномерно по номеру
+MAX_LABELS = 15
+# Делений на осях не больше стольких: подписи делений рисуются при каждой отрисовке
+_TICKS = 5
+# Быстрое сжатие PNG: файл немного больше, кодирование в несколько раз быстрее
+_PNG_COMPRESS_LEVEL = 1
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _encode_png(rgba):
+    """
+    PNG из буфера холста: фигура непрозрачна, поэтому пишется RGB без
+    фильтрации строк, которую Pillow подбирает для каждой строки заново
+    """
+    height, width = rgba.shape[:2]
+    rows = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 0] = 0  # фильтр строки: None
+    rows[:, 1:] = rgba[:, :, :3].reshape(height, 3 * width)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(rows.tobytes(), _PNG_COMPRESS_LEVEL))
+            + _png_chunk(b'IEND', b''))
+
+
+def _fix_label_positions(ax):
+    """
+    Явные положения подписей осей и заголовка: иначе Matplotlib при каждой
+    отрисовке измеряет все подписи делений, чтобы их не перекрыть
+    """
+    from matplotlib.ticker import MaxNLocator
+
+    ax.xaxis.set_label_coords(0.5, -0.07)
+    ax.yaxis.set_label_coords(-0.11, 0.5)
+    ax.xaxis.set_major_locator(MaxNLocator(_TICKS))
+    ax.yaxis.set_major_locator(MaxNLocator(_TICKS))
+
+
+class OrbitPlotRenderer:
+    """Заготовка фигуры с двумя графиками; не потокобезопасна, используйте render_orbit_plot"""
+
+    def __init__(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=FIGURE_SIZE, dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        # Фиксированные поля вместо bbox_inches='tight', который рисует фигуру дважды
+        self.figure.subplots_adjust(left=0.05, right=0.97, bottom=0.1, top=0.88, wspace=0.2)
+        orbit_ax, sky_ax = self.figure.subplots(1, 2)
+        self._build_orbit_diagram(orbit_ax)
+        self._build_sky_motion(sky_ax)
+        # Меняющиеся артисты (animated) не попадают в фон, их рисует _draw_png
+        self._dynamic = [self.orbit_line, self.comet_marker, self.earth_line, self.earth_marker,
+                         self.orbit_info, orbit_ax.xaxis, orbit_ax.yaxis,
+                         self.sky_density, self.sky_scatter, self.sky_path, *self.sky_labels,
+                         self.sky_info, self.sky_message, sky_ax.xaxis, sky_ax.yaxis,
+                         self.colorbar.ax.yaxis]
+        # Порядок Axes.draw: по zorder внутри каждой пары осей
+        self._dynamic.sort(key=lambda artist: (artist.axes is not orbit_ax, artist.get_zorder()))
+        for artist in self._dynamic:
+            artist.set_animated(True)
+        self._background = None
+
+    def _build_orbit_diagram(self, ax):
+        self.orbit_ax = ax
+        self.orbit_line, = ax.plot([], [], 'b-', linewidth=2, label='Orbit')
+        # Пределы симметричны, поэтому Солнце всегда в центре и входит в фон
+        ax.plot(0, 0, 'yo', markersize=15, label='Sun')
+        self.comet_marker, = ax.plot([], [], 'ro', markersize=8, label='Comet')
+        self.earth_line, = ax.plot([], [], 'g--', alpha=0.7, label='Earth orbit')
+        self.earth_marker, = ax.plot([], [], 'go', markersize=8, label='Earth')
+
+        ax.set_aspect('equal')
+        ax.grid(True, alpha=0.3)
+        ax.set_xlabel('X (AU)')
+        ax.set_ylabel('Y (AU)')
+        ax.set_title('Orbital Diagram\n(Viewed from above ecliptic)', y=1.0)
+        _fix_label_positions(ax)
+        # Легенда неизменна и входит в фон; эксцентриситет есть в подписи слева
+        ax.legend(loc='lower right')
+        self.orbit_info = ax.text(0.02, 0.98, '', transform=ax.transAxes,
+                                  verticalalignment='top', bbox=_INFO_BOX)
+
+    def _build_sky_motion(self, ax):
+        from matplotlib import colormaps
+        from matplotlib.colors import Normalize
+        from matplotlib.ticker import FuncFormatter
+
+        self.sky_ax = ax
+        self.sky_path, = ax.plot([], [], 'k--', alpha=0.5)
+        # Точки и ячейки сетки делят шкалу времени; пустые ячейки прозрачны
+        cmap = colormaps['viridis'].with_extremes(bad=(0, 0, 0, 0))
+        norm = Normalize(0, 1)
+        self.sky_scatter = ax.scatter([], [], c=[], cmap=cmap, s=100, alpha=0.7, norm=norm)
+        self.sky_density = ax.imshow(np.full((1, 1), np.nan), cmap=cmap, norm=norm, origin='lower',
+                                     aspect='auto', interpolation='nearest', visible=False)
+        self.sky_labels = [ax.annotate('', (0, 0), xytext=(5, 5), textcoords='offset points',
+                                       fontweight='bold', visible=False) for _ in range(MAX_LABELS)]
+        # Прямое восхождение может выходить за 0–24 ч, чтобы путь через 0 ч не рвался
+        ax.xaxis.set_major_formatter(FuncFormatter(lambda value, _: f'{value % 24:g}'))
+        self.colorbar = self.figure.colorbar(self.sky_scatter, ax=ax,
+                                             label='Time (days from first observation)')
+        ax.set_xlabel('Right Ascension (hours)')
+        ax.set_ylabel('Declination (degrees)')
+        ax.set_title('Sky Motion of Comet', y=1.0)
+        ax.grid(True, alpha=0.3)
+        _fix_label_positions(ax)
+        self.colorbar.ax.yaxis.set_label_coords(3.2, 0.5)
+        self.sky_info = ax.text(0.02, 0.98, '', transform=ax.transAxes,
+                                verticalalignment='top', bbox=_INFO_BOX)
+        self.sky_message = ax.text(0.5, 0.5, 'Not enough observations\nfor sky motion plot',
+                                   ha='center', va='center', transform=ax.transAxes)
+
+    def _update_orbit_diagram(self, orbit_elements, jd):
+        """Орбита в проекции на эклиптику; комета и Земля — в их положениях на момент jd"""
+        a, e, i = orbit_elements.a, orbit_elements.e, orbit_elements.i
+        p = a * (1 - e ** 2)
+        r = p / (1 + e * np.cos(_THETA))
+        # Для гиперболы рисуется только ветвь, где 1 + e cos(theta) > 0
+        r = np.where(r > 0, r, np.nan)
+        P, Q = perifocal_axes(i, orbit_elements.raan, orbit_elements.arg_peri)
+        orbit = np.outer(r * np.cos(_THETA), P) + np.outer(r * np.sin(_THETA), Q)
+        self.orbit_line.set_data(orbit[:, 0], orbit[:, 1])
+
+        comet = EQ_TO_ECL @ elements_state(orbit_elements, jd)[0]
+        self.comet_marker.set_data([comet[0]], [comet[1]])
+        earth = earth_position(jd + np.linspace(0, 365.25, _ORBIT_POINTS)) @ EQ_TO_ECL.T
+        self.earth_line.set_data(earth[:, 0], earth[:, 1])
+        self.earth_marker.set_data([earth[0, 0]], [earth[0, 1]])
+
+        points = np.concatenate([orbit[:, :2].ravel(), comet[:2], earth[:, :2].ravel()])
+        extent = np.nanmax(np.abs(points)) * 1.1
+        self.orbit_ax.set_xlim(-extent, extent)
+        self.orbit_ax.set_ylim(-extent, extent)
+        self.orbit_info.set_text(
+            f'Semi-major axis: {a:.2f} AU\nEccentricity: {e:.3f}\nInclination: {i:.1f}°\n'
+            f'Positions on {jd_to_iso(jd)[:10]}')
+
+    def _update_sky_motion(self, times, ra_values, dec_values):
+        """
+        До DETAIL_LIMIT наблюдений — точки, дальше — сетка ячеек; пунктир и
+        подписи прореживаются, поэтому время отрисовки почти не растет с дугой
+        """
+        count = len(times)
+        enough = count >= 2
+        for artist in (self.sky_path, self.sky_info):
+            artist.set_visible(enough)
+        self.sky_message.set_visible(not enough)
+        detail = count <= DETAIL_LIMIT
+        self.sky_scatter.set_visible(enough and detail)
+        self.sky_density.set_visible(enough and not detail)
+        for label in self.sky_labels:
+            label.set_visible(False)
+        if not enough:
+            return
+
+        times_norm = times - times[0]
+        ra_values = np.unwrap(ra_values, period=24)
+        # Коллекции не участвуют в relim, поэтому пределы задаются по данным
+        limits = []
+        for values, set_limits in ((ra_values, self.sky_ax.set_xlim), (dec_values, self.sky_ax.set_ylim)):
+            low, high = float(np.min(values)), float(np.max(values))
+            margin = (high - low) * 0.05 or 0.01
+            limits.append((low - margin, high + margin))
+            set_limits(*limits[-1])
+
+        path = np.unique(np.append(np.arange(0, count, -(-count // _PATH_VERTICES)), count - 1))
+        self.sky_path.set_data(ra_values[path], dec_values[path])
+        self.sky_scatter.set_clim(0, max(times_norm[-1], 1e-9))
+        if detail:
+            self.sky_scatter.set_offsets(np.column_stack([ra_values, dec_values]))
+            self.sky_scatter.set_array(times_norm)
+        else:
+            counts, _, _ = np.histogram2d(ra_values, dec_values, bins=_DENSITY_BINS, range=limits)
+            total, _, _ = np.histogram2d(ra_values, dec_values, bins=_DENSITY_BINS, range=limits,
+                                         weights=times_norm)
+            with np.errstate(invalid='ignore'):
+                self.sky_density.set_data((total / counts).T)
+            self.sky_density.set_extent(limits[0] + limits[1])
+
+        labeled = np.unique(np.linspace(0, count - 1, min(count, MAX_LABELS)).round().astype(int))
+        for label, index in zip(self.sky_labels, labeled):
+            label.xy = (ra_values[index], dec_values[index])
+            label.set_text(f'{index + 1}')
+            label.set_visible(True)
+
+        ra_motion = ra_values[-1] - ra_values[0]
+        dec_motion = dec_values[-1] - dec_values[0]
+        total_motion = angular_separation(ra_values[0], dec_values[0], ra_values[-1], dec_values[-1])
+        self.sky_info.set_text(f'Total motion: {total_motion:.3f}°\nRA change: {ra_motion:.3f}h\n'
+                               f'Dec change: {dec_motion:.3f}°')
+
+    def render(self, orbit_elements, times, ra_values, dec_values, file_format='png'):
+        """График в виде байтов PNG или SVG"""
+        times = np.asarray(times)
+        # Положения на диаграмме — на момент последнего наблюдения
+        jd = float(times.max()) if len(times) else (
+            orbit_elements.fit.epoch if orbit_elements.fit is not None else orbit_elements.t_peri)
+        with span('plot.orbit_diagram'):
+            self._update_orbit_diagram(orbit_elements, jd)
+        with span('plot.sky_motion'):
+            self._update_sky_motion(times, np.asarray(ra_values), np.asarray(dec_values))
+        if file_format == 'png':
+            return self._draw_png()
+        # Векторный формат рисуется целиком, вместе с артистами фона
+        with span('plot.encode.svg'), self._all_artists():
+            output = io.BytesIO()
+            self.figure.savefig(output, format=file_format, dpi=DPI)
+        return output.getvalue()
+
+    def _draw_png(self):
+        with span('plot.draw'):
+            if self._background is None:
+                self.canvas.draw()
+                self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+            else:
+                self.canvas.restore_region(self._background)
+            for artist in self._dynamic:
+                if artist.get_visible():
+                    self.figure.draw_artist(artist)
+        with span('plot.encode.png'):
+            return _encode_png(np.asarray(self.canvas.buffer_rgba()))
+
+    @contextmanager
+    def _all_artists(self):
+        """На время savefig меняющиеся артисты рисуются вместе с остальными"""
+        for artist in self._dynamic:
+            artist.set_animated(False)
+        try:
+            yield
+        finally:
+            for artist in self._dynamic:
+                artist.set_animated(True)
+
+
+_local = threading.local()
+
+
+def render_orbit_plot(orbit_elements, times, ra_values, dec_values, file_format='png'):
+    """Отрисовка заготовкой текущего потока: каждый поток получает свою фигуру"""
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported plot format: {file_format}")
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None:
+        renderer = _local.renderer = OrbitPlotRenderer()
+    return renderer.render(orbit_elements, times, ra_values, dec_values, file_format)
+
+
+def warm_up():
+    """
+    Загружает Matplotlib и рисует пробный график заготовкой текущего потока
+    (кеш шрифтов, разметка), чтобы первый запрос графика не платил за это.
+    Заготовки других потоков строятся при их первом графике.
+    """
+    from orbit import OrbitalElements
+
+    render_orbit_plot(OrbitalElements(2.0, 0.5, 10.0, 0.0, 0.0, 2460000.5),
+                      [2460000.5, 2460010.5, 2460020.5], [1.0, 1.1, 1.2], [10.0, 10.5, 11.0])
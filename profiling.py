@@ -0,0 +1,82 @@
+"""
+Выборочный профилировщик одного потока.
+
+Фоновый поток раз в interval секунд читает стек профилируемого потока через
+sys._current_frames и считает одинаковые стеки. Профилируемый код не
+замедляется трассировкой, поэтому профилировщик можно включать для
+отдельного запроса в рабочей системе. Отчет — свернутые стеки
+("модуль:функция;...;модуль:функция число"), которые понимают flamegraph.pl
+и speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005
+# Глубже стек обрезается со стороны корня
+MAX_DEPTH = 128
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{code.co_name}'
+
+
+def collapse(frame, limit=MAX_DEPTH):
+    """Стек от корня к frame одной строкой"""
+    names = []
+    while frame is not None and len(names) < limit:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return self
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time.perf_counter() - self._started
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:  # поток завершился
+                return
+            self.stacks[collapse(frame)] += 1
+            del frame
+
+    def collapsed(self):
+        """Свернутые стеки, самые частые первыми"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
@@ -0,0 +1,130 @@
+"""
+Ход фоновых расчетов для потока Server-Sent Events.
+
+Рабочий процесс сообщает о ходе задания через report: номер итерации и
+невязку подгонки, охват интервала поиска сближения, промежуточную статистику
+Монте-Карло. Сообщения идут в одну очередь multiprocessing, переданную пулу
+при запуске процессов, и не чаще раза в MIN_INTERVAL секунд на этап, поэтому
+вне задания и между сообщениями report почти ничего не стоит.
+
+В процессе сервера один поток очереди заданий разбирает сообщения по
+JobProgress. Для задания хранится только последнее сообщение каждого этапа
+с номером версии; подписчики (генераторы event_stream) ждут новой версии на
+общем условии и отдают то, что изменилось с их прошлого шага. Медленный
+клиент пропускает промежуточные сообщения, а не копит очередь; отдельных
+потоков на подписчика нет.
+"""
+import json
+import math
+import threading
+import time
+
+# Не чаще одного сообщения этапа за столько секунд (последнее — с force)
+MIN_INTERVAL = 0.1
+# Комментарий в поток, если долго нет событий: прокси не закрывают соединение
+HEARTBEAT = 15.0
+
+# В рабочем процессе: очередь сообщений и задание, которое сейчас выполняется
+_queue = None
+_job_id = None
+_last = {}
+
+
+def attach(queue):
+    """Инициализатор процесса пула"""
+    global _queue
+    _queue = queue
+
+
+def start(job_id):
+    global _job_id
+    _job_id = job_id
+    _last.clear()
+
+
+def stop():
+    global _job_id
+    _job_id = None
+
+
+def active():
+    return _job_id is not None and _queue is not None
+
+
+def due(stage):
+    """Пора ли сообщить о ходе этапа; данные для сообщения стоит готовить только тогда"""
+    return active() and time.monotonic() - _last.get(stage, 0.0) >= MIN_INTERVAL
+
+
+def report(stage, force=False, **data):
+    """Сообщение о ходе этапа задания; вне задания и чаще MIN_INTERVAL пропускается"""
+    if not (force and active() or due(stage)):
+        return
+    _last[stage] = time.monotonic()
+    # NaN и бесконечность не допускаются в JSON
+    _queue.put((_job_id, stage, {name: None if isinstance(value, float) and not math.isfinite(value) else value
+                                 for name, value in data.items()}))
+
+
+class JobProgress:
+    """Последние сообщения этапов одного задания в процессе сервера"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.version = 0
+        self._stages = {}  # этап -> (версия, данные)
+        self.status = None  # итоговое состояние задания
+
+    def update(self, stage, data):
+        with self._condition:
+            if self.status is not None:
+                return
+            self.version += 1
+            self._stages[stage] = (self.version, data)
+            self._condition.notify_all()
+
+    def finish(self, status):
+        with self._condition:
+            if self.status is not None:
+                return
+            self.version += 1
+            self.status = status
+            self._condition.notify_all()
+
+    def wait(self, seen, timeout=HEARTBEAT):
+        """
+        Ждет версию новее seen не дольше timeout секунд. Возвращает изменившиеся
+        этапы [(версия, этап, данные)], новую версию и итоговое состояние (или None).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version > seen, timeout)
+            changed = sorted(((version, stage, data) for stage, (version, data) in self._stages.items()
+                              if version > seen), key=lambda item: item[0])
+            return changed, self.version, self.status
+
+
+def _event(name, data, event_id=None):
+    lines = [f'event: {name}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(progress, status, end=None, heartbeat=HEARTBEAT):
+    """
+    Генератор событий text/event-stream для задания: сначала текущее состояние
+    status, затем сообщения этапов по мере поступления и событие end (данные
+    end и итоговое состояние), после которого поток закрывается.
+    """
+    yield 'retry: 2000\n' + _event('status', {'status': status})
+    seen = 0
+    while True:
+        changed, seen, final = progress.wait(seen, heartbeat)
+        if not changed and final is None:
+            yield ': keep-alive\n\n'
+        for version, stage, data in changed:
+            yield _event(stage, data, version)
+        if final is not None:
+            yield _event('end', dict(end or {}, status=final), seen)
+            return
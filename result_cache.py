@@ -0,0 +1,153 @@
+"""
+Кеш результатов расчета орбиты с адресацией по содержимому.
+
+Ключ — хеш упорядоченных по времени массивов (JD, RA, Dec) и параметров
+решателя, поэтому одинаковые наблюдения всегда дают тот же ключ, а результат
+по ключу не меняется. Значения хранятся сериализованными, чтобы знать их
+точный размер. В памяти держится LRU с ограничением по байтам; если задан
+каталог, вытесненные из памяти записи остаются на диске (тоже с пределом).
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from jobs import array_key
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+
+
+def result_key(times, ra_values, dec_values, settings):
+    """Ключ результата: содержимое наблюдений и параметры расчета"""
+    observations_key = array_key(times, ra_values, dec_values)
+    return hashlib.sha1((observations_key + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, directory=None,
+                 max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        # Обращения к кешу для метрик: найдено / не найдено
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    def _scan_disk(self):
+        """Файлы, оставшиеся от прошлых запусков, упорядочиваются по времени последнего доступа"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_atime, name[:-len('.pickle')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def __contains__(self, key):
+        # Проверка не считается обращением: попадания и промахи считает get
+        with self._lock:
+            if key in self._memory or key in self._disk:
+                return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._memory.keys() | self._disk.keys())
+
+    @property
+    def nbytes(self):
+        return self._memory_bytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif self.directory:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if data is None else pickle.loads(data)
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, data)
+            if self.directory and key not in self._disk:
+                self._write_disk(key, data)
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            # Записи нет или ее уже вытеснил другой процесс, работающий с тем же каталогом
+            self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        if key in self._disk:
+            self._disk.move_to_end(key)
+        else:
+            # Запись сделана другим процессом
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+        return data
+
+    def _write_disk(self, key, data):
+        # Запись во временный файл и переименование: другие процессы не увидят половину файла
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, self._path(key))
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for key in self._disk:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._disk.clear()
+            self._disk_bytes = 0
@@ -0,0 +1,219 @@
+"""
+Хранилище наблюдений в SQLite (режим WAL), общее для потоков и процессов.
+
+Развертывание однопроцессное, поэтому в приложении файл делят потоки
+рабочего процесса; наблюдения переживают его перезапуск, а другие процессы
+(несколько экземпляров приложения, скрипты) видят те же данные.
+
+Каждый поток каждого процесса открывает собственное соединение; запись идет
+короткими транзакциями BEGIN IMMEDIATE, чтение не блокируется записью.
+Любое изменение увеличивает счетчик версии в той же транзакции, поэтому
+колоночный снимок (ObservationStore) перечитывается только после чужой записи.
+
+Наблюдения хранятся пакетами: строка таблицы — столбцы одного вызова extend
+в виде массивов float64 (BLOB) и список имен снимков в JSON. Снимок собирается
+из нескольких строк через np.frombuffer, без кортежа Python на наблюдение;
+когда пакетов становится много, запись сводит их в один.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from observation_store import ObservationStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observation_batches (
+    id INTEGER PRIMARY KEY,
+    jd BLOB NOT NULL,
+    ra_hours BLOB NOT NULL,
+    dec_degrees BLOB NOT NULL,
+    image_filenames TEXT
+);
+CREATE TABLE IF NOT EXISTS store_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL);
+INSERT OR IGNORE INTO store_version (id, version) VALUES (0, 0);
+"""
+_SELECT_VERSION = "SELECT version FROM store_version WHERE id = 0"
+_BUMP_VERSION = "UPDATE store_version SET version = version + 1 WHERE id = 0"
+_INSERT = "INSERT INTO observation_batches (jd, ra_hours, dec_degrees, image_filenames) VALUES (?, ?, ?, ?)"
+_SELECT_BATCHES = "SELECT jd, ra_hours, dec_degrees, image_filenames FROM observation_batches ORDER BY id"
+_COUNT_BATCHES = "SELECT count(*) FROM observation_batches"
+# Таблица построчного формата, данные которой переносятся в пакеты при открытии
+_LEGACY_TABLE = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'observations'"
+_SELECT_LEGACY = "SELECT jd, ra_hours, dec_degrees, image_filename FROM observations ORDER BY id"
+# Сколько пакетов допускается до сведения в один
+COMPACT_BATCHES = 64
+_FLOAT = np.dtype('<f8')
+
+
+def _batch_row(jd, ra_hours, dec_degrees, image_filenames):
+    """Параметры INSERT для пакета: столбцы в байтах, имена снимков в JSON или NULL"""
+    images = None
+    if image_filenames is not None and any(image_filenames):
+        images = json.dumps([name or None for name in image_filenames])
+    return tuple(np.ascontiguousarray(column, dtype=_FLOAT).tobytes()
+                 for column in (jd, ra_hours, dec_degrees)) + (images,)
+
+
+def _read_batches(connection):
+    """Столбцы jd, ra_hours, dec_degrees всех пакетов и имена снимков (None, если снимков нет)"""
+    batches = connection.execute(_SELECT_BATCHES).fetchall()
+    columns = [np.concatenate([np.frombuffer(batch[k], dtype=_FLOAT) for batch in batches])
+               if batches else np.zeros(0) for k in range(3)]
+    images = None
+    if any(batch[3] for batch in batches):
+        images = []
+        for batch in batches:
+            images += json.loads(batch[3]) if batch[3] else [None] * (len(batch[0]) // _FLOAT.itemsize)
+    return columns, images
+
+
+class SQLiteObservationStore:
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        # Соединения всех потоков, чтобы close закрыл и их
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot = ObservationStore()
+        self._snapshot_version = None
+        self._connection().executescript(_SCHEMA)
+        self._migrate()
+
+    def _connection(self):
+        """Соединение текущего потока; после fork открывается заново"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         cached_statements=64, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            local.connection = connection
+            local.pid = os.getpid()
+            with self._connections_lock:
+                self._connections.append(connection)
+        return local.connection
+
+    def close(self):
+        """Закрывает соединения всех потоков: после удаления файла хранилище непригодно"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def _transaction(self):
+        return _WriteTransaction(self._connection())
+
+    def _migrate(self):
+        """Наблюдения построчного формата переносятся одним пакетом"""
+        if self._connection().execute(_LEGACY_TABLE).fetchone() is None:
+            return
+        with self._transaction() as connection:
+            if connection.execute(_LEGACY_TABLE).fetchone() is None:
+                return  # уже перенес другой процесс
+            rows = connection.execute(_SELECT_LEGACY).fetchall()
+            if rows:
+                jd, ra_hours, dec_degrees, images = zip(*rows)
+                connection.execute(_INSERT, _batch_row(jd, ra_hours, dec_degrees, images))
+            connection.execute("DROP TABLE observations")
+            connection.execute(_BUMP_VERSION)
+
+    def _load(self):
+        """Актуальный колоночный снимок таблицы"""
+        connection = self._connection()
+        with self._snapshot_lock:
+            # Версия и данные читаются в одной транзакции, чтобы снимок был согласован
+            connection.execute("BEGIN")
+            try:
+                version = connection.execute(_SELECT_VERSION).fetchone()[0]
+                if version == self._snapshot_version:
+                    return self._snapshot
+                (jd, ra_hours, dec_degrees), images = _read_batches(connection)
+            finally:
+                connection.execute("COMMIT")
+
+            snapshot = ObservationStore(capacity=max(len(jd), 1))
+            snapshot.extend(ra_hours, dec_degrees, jd, images)
+            self._snapshot = snapshot
+            self._snapshot_version = version
+            return snapshot
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    @property
+    def ra_hours(self):
+        return self._load().ra_hours
+
+    @property
+    def dec_degrees(self):
+        return self._load().dec_degrees
+
+    @property
+    def jd(self):
+        return self._load().jd
+
+    def image_filename(self, index):
+        return self._load().image_filename(index)
+
+    def image_filenames(self):
+        return self._load().image_filenames()
+
+    def image_column(self):
+        return self._load().image_column()
+
+    def sorted_arrays(self):
+        return self._load().sorted_arrays()
+
+    def append(self, ra_hours, dec_degrees, jd, image_filename=None):
+        self.extend([ra_hours], [dec_degrees], [jd],
+                    None if image_filename is None else [image_filename])
+
+    def append_observation(self, observation):
+        self.append(observation.ra_hours, observation.dec_degrees,
+                    observation.jd, observation.image_filename)
+
+    def extend(self, ra_hours, dec_degrees, jd, image_filenames=None):
+        """Пакет — одна строка таблицы, вставляемая одной транзакцией"""
+        jd = np.asarray(jd, dtype=float)
+        if not len(jd):
+            return
+        if image_filenames is not None:
+            image_filenames = list(image_filenames)
+        with self._transaction() as connection:
+            connection.execute(_INSERT, _batch_row(jd, ra_hours, dec_degrees, image_filenames))
+            if connection.execute(_COUNT_BATCHES).fetchone()[0] > COMPACT_BATCHES:
+                # Одиночные добавления из формы не копят строки: пакеты сводятся в один
+                (jd, ra_hours, dec_degrees), images = _read_batches(connection)
+                connection.execute("DELETE FROM observation_batches")
+                connection.execute(_INSERT, _batch_row(jd, ra_hours, dec_degrees, images))
+            connection.execute(_BUMP_VERSION)
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM observation_batches")
+            connection.execute(_BUMP_VERSION)
+
+
+class _WriteTransaction:
+    """BEGIN IMMEDIATE сразу берет блокировку записи, ожидая не дольше busy_timeout"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+import pytest
+
+import api
+from validation import validate_observations
+from observation_store import jd_to_datetime
+
+
+def test_page_stream_is_json_with_exact_values():
+    jd = np.array([2460000.123456789, 2460001.5, 2460002.25])
+    arrays = (jd, np.array([1.0 / 3, 12.5, 23.999]), np.array([-45.1, 0.0, 89.9]), [None, 'a"b.png', None])
+    header = {'id': 'C-2025-A1', 'total': 10, 'offset': 7, 'limit': 3, 'next': None}
+    body = b''.join(api.json_page_stream(header, arrays, start=7))
+
+    document = json.loads(body)
+    assert {k: document[k] for k in header} == header
+    rows = document['observations']
+    assert [row['index'] for row in rows] == [7, 8, 9]
+    assert [row['ra_hours'] for row in rows] == arrays[1].tolist()
+    assert rows[1]['image'] == 'a"b.png' and rows[0]['image'] is None
+    assert rows[0]['observation_time'] == jd_to_datetime(jd[0]).isoformat(timespec='milliseconds') + 'Z'
+
+    lines = b''.join(api.ndjson_stream(arrays)).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [dict(row, index=row['index'] - 7) for row in rows]
+
+
+def test_batch_columns_and_rows_are_equivalent():
+    columns = {'ra_hours': [1.0, 2.0], 'dec_degrees': [10.0, -20.0],
+               'observation_time': ['2024-01-01T00:00:00Z', '2024-01-02T12:00:00']}
+    rows = {'observations': [{'ra_hours': 1.0, 'dec_degrees': 10.0, 'observation_time': '2024-01-01T00:00:00Z'},
+                             {'ra_hours': 2.0, 'dec_degrees': -20.0, 'observation_time': '2024-01-02T12:00:00'}]}
+    for first, second in zip(api.parse_observation_batch(columns), api.parse_observation_batch(rows)):
+        np.testing.assert_array_equal(first, second)
+    np.testing.assert_allclose(api.parse_observation_batch(columns)[0], [2460310.5, 2460312.0])
+
+
+def test_invalid_batch_reports_rows():
+    jd, ra_values, _ = api.parse_observation_batch({'ra_hours': [1, 25, 'x'], 'dec_degrees': [0, 0, 0],
+                                                    'jd': [2460000.5, 2460001.5, 2460002.5]})
+    assert np.isnan(ra_values[2]) and len(jd) == 3
+    flags = validate_observations(ra_values, np.zeros(3), jd)
+    assert api.rejected_document(flags) == [
+        {'error': 'Right Ascension must be a number', 'count': 1, 'rows': [2]},
+        {'error': 'Right Ascension must be between 0 and 24 hours', 'count': 1, 'rows': [1]}]
+    with pytest.raises(ValueError, match='same length'):
+        api.parse_observation_batch({'ra_hours': [1], 'dec_degrees': [0, 0], 'jd': [2460000.5]})
+    with pytest.raises(ValueError, match='needs'):
+        api.parse_observation_batch({'observations': [{'ra_hours': 1, 'jd': 2460000.5}]})
+
+
+def test_bulk_post_and_paginated_listing():
+    from app import app, workspaces
+
+    client = app.test_client()
+    try:
+        assert client.post('/api/v1/objects', json={'id': 'api-test'}).status_code == 201
+        n = 2500
+        response = client.post('/api/v1/objects/api-test/observations', json={
+            'jd': (2460000.5 + np.arange(n) / 100).tolist(), 'ra_hours': np.full(n, 5.0).tolist(),
+            'dec_degrees': np.linspace(-10, 10, n).tolist()})
+        assert response.status_code == 201 and response.get_json()['observations'] == n
+
+        page = client.get('/api/v1/objects/api-test/observations?offset=2000&limit=300').get_json()
+        assert page['total'] == n and len(page['observations']) == 300
+        assert page['observations'][0]['index'] == 2000
+        assert page['next'].endswith('offset=2300&limit=300')
+
+        stream = client.get('/api/v1/objects/api-test/observations',
+                            headers={'Accept': 'application/x-ndjson'})
+        assert stream.mimetype == 'application/x-ndjson'
+        assert len(stream.get_data().splitlines()) == n
+
+        # Повтор уже записанного момента отбрасывается, остальной пакет записывается
+        partial = client.post('/api/v1/objects/api-test/observations', json={
+            'jd': [2460000.5 + n / 100, 2460000.5], 'ra_hours': [5.0, 5.0], 'dec_degrees': [10.004, -10.0]})
+        assert partial.status_code == 201 and partial.get_json()['added'] == 1
+        assert partial.get_json()['rejected'] == [{'error': 'Duplicate observation time', 'count': 1, 'rows': [1]}]
+
+        invalid = client.post('/api/v1/objects/api-test/observations', json={'ra_hours': [30]})
+        assert invalid.status_code == 400 and 'error' in invalid.get_json()
+        assert client.get('/api/v1/objects/unknown/observations').get_json()['status'] == 404
+    finally:
+        workspaces.remove('api-test')
+
+
+def test_event_streams_are_capped(monkeypatch):
+    import threading
+    import time
+
+    import app as application
+
+    monkeypatch.setattr(application, 'event_streams', threading.BoundedSemaphore(1))
+    job = application.orbit_jobs.submit('stream-test', time.sleep, 0.2)
+    client = application.app.test_client()
+    first = client.get(f'/api/v1/jobs/{job.id}/events', buffered=False)
+    second = client.get(f'/api/v1/jobs/{job.id}/events')
+    assert first.status_code == 200
+    assert second.status_code == 503 and second.get_data(as_text=True).startswith('retry:')
+    assert b'event: end' in first.get_data()
+    first.close()
+    assert client.get(f'/api/v1/jobs/{job.id}/events').status_code == 200
+
+
+def test_results_table_follows_the_fitted_observations():
+    from app import fitted_observations, results_etag
+    from observation_store import ObservationStore
+
+    store = ObservationStore()
+    store.extend([1.0, 2.0], [10.0, 20.0], [2460000.5, 2460001.5], [None, 'a.png'])
+    arrays = (np.array([2460000.5, 2460001.5]), np.array([1.0, 2.0]), np.array([10.0, 20.0]))
+    fitted = fitted_observations(store, arrays)
+    etag = results_etag('key', fitted)
+
+    # Добавленное после расчета наблюдение не попадает в таблицу и не меняет ETag
+    store.append(3.0, 30.0, 2460002.5)
+    assert len(fitted_observations(store, arrays)) == 2
+    assert results_etag('key', fitted_observations(store, arrays)) == etag
+    assert fitted.image_column().tolist() == [None, 'a.png']
+
+    store.clear()
+    assert results_etag('key', fitted_observations(store, arrays)) != etag
+
+
+def test_measured_observation_is_recorded_once():
+    from types import SimpleNamespace
+
+    from app import record_measured_observation, workspaces
+
+    store = workspaces.create('measured-test')
+    try:
+        store.clear()
+        solution = SimpleNamespace(ra_hours=5.0, dec_degrees=10.0)
+
+        def measured_job():
+            return SimpleNamespace(status='done', result=lambda: solution, context={
+                'observation': {'time': '2025-01-01T00:00:00+00:00', 'image': None},
+                'values': {'object_id': 'measured-test'}})
+
+        job = measured_job()
+        assert record_measured_observation(job) == []
+        assert record_measured_observation(job) == []
+        assert len(store) == 1
+
+        # Повтор момента отклоняется той же проверкой, что и в форме
+        assert record_measured_observation(measured_job()) == ['Duplicate observation time']
+        assert len(store) == 1
+    finally:
+        workspaces.remove('measured-test')
+
+
+def test_routes_answer_404_for_cached_values_of_another_kind():
+    from app import app, orbit_results
+    from orbit import OrbitalElements
+
+    orbit_results.put('fit.kind-test', OrbitalElements(1.3, 0.25, 5.0, 40.0, 100.0, 2460500.5))
+    orbit_results.put('refit.kind-test', 'summary')
+    client = app.test_client()
+    for url in ('/results/fit.kind-test', '/results/fit.kind-test/uncertainty', '/plot/fit.kind-test.png',
+                '/results/refit.kind-test', '/objects/default/link/fit.kind-test',
+                '/objects/refit/fit.kind-test', '/objects/default/astrometry/refit.kind-test',
+                '/api/v1/objects/default/results/fit.kind-test'):
+        assert client.get(url).status_code == 404, url
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from astrometry import StarCatalog, detect_sources, estimate_background, from_standard, solve_plate, to_standard
+
+ARCSEC = np.pi / (180 * 3600)
+
+
+def sky(tmp_path, size=1024, scale=4.0, angle=30.0, stars=400, seed=0):
+    """
+    Снимок со звездами каталога, градиентом фона и шумом, повернутый на angle
+    и отраженный по оси y (строки растут вниз); комета — яркий источник вне каталога.
+    """
+    rng = np.random.default_rng(seed)
+    ra0, dec0 = 150.0, 20.0
+    half = np.degrees(size * scale * ARCSEC) * 0.8
+    ra = ra0 + rng.uniform(-half, half, stars) / np.cos(np.radians(dec0))
+    dec = dec0 + rng.uniform(-half, half, stars)
+    mag = rng.uniform(8, 14, stars)
+    path = tmp_path / 'stars.csv'
+    np.savetxt(path, np.column_stack([ra, dec, mag]), delimiter=',', header='ra_deg,dec_deg,mag', comments='')
+
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    matrix = np.array([[c, -s], [-s, -c]]) / (scale * ARCSEC)
+
+    def pixels(ra, dec):
+        return to_standard(ra, dec, ra0, dec0)[0] @ matrix.T + size / 2
+
+    comet = (ra0 + 0.05, dec0 - 0.03)
+    positions = np.vstack([pixels(ra, dec), pixels(*comet)[None]])
+    flux = np.append(10 ** (-0.4 * (mag - 14)) * 2000, 30000)
+
+    y, x = np.mgrid[:size, :size].astype(np.float32)
+    image = 100 + 0.05 * x + rng.normal(0, 5, (size, size)).astype(np.float32)
+    for (px, py), f in zip(positions, flux):
+        if -10 < px < size + 10 and -10 < py < size + 10:
+            y0, x0 = int(py), int(px)
+            window = (slice(max(y0 - 8, 0), y0 + 9), slice(max(x0 - 8, 0), x0 + 9))
+            image[window] += f / (2 * np.pi * 1.5 ** 2) * np.exp(
+                -((x[window] - px) ** 2 + (y[window] - py) ** 2) / (2 * 1.5 ** 2))
+    return image, StarCatalog(str(path)), (ra0 / 15, dec0, scale), comet, positions[-1]
+
+
+def test_background_follows_gradient():
+    y, x = np.mgrid[:512, :512].astype(np.float32)
+    image = 200 + 0.02 * x + np.random.default_rng(0).normal(0, 3, x.shape).astype(np.float32)
+    image[100, 100] += 5000
+    background, noise = estimate_background(image)
+    assert np.abs(background - (200 + 0.02 * x))[32:-32, 32:-32].max() < 1.0
+    assert noise == pytest.approx(3, rel=0.15)
+
+
+def test_centroids_are_subpixel():
+    y, x = np.mgrid[:256, :256].astype(np.float32)
+    image = 100 + np.random.default_rng(0).normal(0, 5, x.shape).astype(np.float32)
+    for px, py in ((40.3, 200.7), (128.55, 31.2)):
+        image += 3000 * np.exp(-((x - px) ** 2 + (y - py) ** 2) / (2 * 1.5 ** 2))
+    sources, flux = detect_sources(image)
+    assert len(sources) == 2
+    np.testing.assert_allclose(sorted(sources.tolist()), [[40.3, 200.7], [128.55, 31.2]], atol=0.05)
+
+
+def test_standard_coordinates_round_trip():
+    ra, dec = np.array([0.5, 359.5, 3.0]), np.array([-30.0, -28.0, -31.5])
+    standard, _ = to_standard(ra, dec, 0.2, -29.5)
+    back_ra, back_dec = from_standard(standard, 0.2, -29.5)
+    np.testing.assert_allclose(back_ra, ra, atol=1e-9)
+    np.testing.assert_allclose(back_dec, dec, atol=1e-9)
+
+
+def test_solves_rotated_mirrored_plate(tmp_path):
+    image, catalog, (ra_hours, dec, scale), comet, pixel = sky(tmp_path)
+    solution = solve_plate(image, ra_hours + 0.002, dec - 0.02, scale, catalog)
+
+    assert solution.matched >= 50
+    assert solution.rms_arcsec < 0.5
+    np.testing.assert_allclose(solution.comet_pixel, pixel, atol=0.1)
+    assert solution.ra_hours * 15 == pytest.approx(comet[0], abs=0.5 / 3600)
+    assert solution.dec_degrees == pytest.approx(comet[1], abs=0.5 / 3600)
+
+    with pytest.raises(ValueError):
+        solve_plate(image, ra_hours + 1, dec, scale, catalog)
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import benchmarks
+from observation_store import ObservationStore
+from orbit import fit_orbit
+
+
+def test_synthetic_arc_recovers_known_orbit():
+    jd, ra, dec = benchmarks.synthetic_arc(200)
+    elements = fit_orbit(jd, ra, dec)
+    known = benchmarks.ARC_ELEMENTS
+    assert elements.a == pytest.approx(known.a, rel=1e-3)
+    assert elements.e == pytest.approx(known.e, abs=1e-3)
+    assert elements.i == pytest.approx(known.i, abs=1e-2)
+    assert elements.fit.rms_arcsec < 1.0
+
+
+def test_measure_reports_statistics():
+    calls = []
+    stats = benchmarks.measure(lambda: calls.append(1), min_time=0, min_rounds=5)
+    assert stats['rounds'] == 5 and len(calls) == 6  # с прогревом
+    assert 0 <= stats['min'] <= stats['median'] and stats['stddev'] >= 0
+    assert set(stats) == {'min', 'median', 'mean', 'stddev', 'rounds'}
+
+
+def test_compare_flags_slowdowns_beyond_tolerance():
+    baseline = {'benchmarks': {'a[10]': {'median': 1.0}, 'b[10]': {'median': 1.0}, 'gone[10]': {'median': 1.0}}}
+    current = {'benchmarks': {'a[10]': {'median': 1.1}, 'b[10]': {'median': 1.5}, 'new[10]': {'median': 1.0}}}
+    rows = benchmarks.compare(current, baseline, tolerance=0.2)
+    assert [(key, regressed) for key, _, _, _, regressed in rows] == [('a[10]', False), ('b[10]', True)]
+
+
+def test_saved_baseline_and_exit_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmarks, 'BENCHMARKS', {
+        'fit_orbit': (lambda n, cleanup: (lambda: ObservationStore(capacity=n)), 100)})
+    path = tmp_path / 'baseline.json'
+    assert benchmarks.main(['--sizes', '10,1000', '--min-time', '0', '--save', str(path)]) == 0
+    document = json.loads(path.read_text())
+    assert list(document['benchmarks']) == ['fit_orbit[10]']
+    assert 'python' in document['machine']
+
+    document['benchmarks']['fit_orbit[10]']['median'] = 1e-12
+    path.write_text(json.dumps(document))
+    assert benchmarks.main(['--sizes', '10', '--min-time', '0', '--compare', str(path)]) == 1
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from astropy.coordinates import get_body_barycentric_posvel, solar_system_ephemeris
+from astropy.time import Time
+
+import earth
+from orbit import almanac_earth_state, earth_state
+
+KM = 1 / 149597870.7  # а.е.
+
+
+def test_table_matches_astropy():
+    jd = np.random.default_rng(0).uniform(earth.DEFAULT_START, earth.DEFAULT_END - 1, 500)
+    r, v = earth.table().state(jd)
+
+    times = Time(jd, format='jd', scale='tdb')
+    with solar_system_ephemeris.set('builtin'):
+        (earth_r, earth_v), (sun_r, sun_v) = (get_body_barycentric_posvel(body, times) for body in ('earth', 'sun'))
+    assert np.abs(r - (earth_r.xyz - sun_r.xyz).to_value('AU').T).max() < 10 * KM
+    assert np.abs(v - (earth_v.xyz - sun_v.xyz).to_value('AU/d').T).max() < 0.01 * KM * 86400
+
+
+def test_state_keeps_shape_and_order():
+    table = earth.table()
+    jd = 2460000.5 + np.array([[300.0, 0.0, 40.0], [1.5, 1.5, 900.0]])
+    r, v = table.state(jd)
+    assert r.shape == v.shape == (2, 3, 3)
+    for index in np.ndindex(jd.shape):
+        np.testing.assert_allclose(table.state(jd[index])[0], r[index], atol=1e-15)
+
+
+def test_table_is_built_once_and_reopened(tmp_path, monkeypatch):
+    path = str(tmp_path / 'earth.npy')
+    monkeypatch.setattr(earth, '_settings', {'path': path, 'jd_start': 2460000.5, 'jd_end': 2461000.5})
+    monkeypatch.setattr(earth, '_table', None)
+    built = earth.table()
+    assert built.jd_end >= 2461000.5 and not built.table.flags.writeable
+
+    def unavailable(*args):
+        raise AssertionError('table rebuilt')
+
+    monkeypatch.setattr(earth, 'build_coefficients', unavailable)
+    monkeypatch.setattr(earth, '_table', None)
+    reopened = earth.table()
+    assert isinstance(reopened.table, np.memmap)
+    np.testing.assert_array_equal(reopened.table, built.table)
+
+
+def test_table_and_its_span_are_one_file(tmp_path):
+    path = str(tmp_path / 'earth.npy')
+    table = earth.EarthTable(earth.build_coefficients(2460000.5, 2460100.5), 2460000.5, earth.SEGMENT_DAYS)
+    table.save(path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['earth.npy']
+
+    loaded = earth.EarthTable.load(path)
+    assert (loaded.jd_start, loaded.segment_days, loaded.jd_end) == (table.jd_start, table.segment_days, table.jd_end)
+    np.testing.assert_array_equal(loaded.table, table.table)
+
+    # Таблица без заголовка (прежний формат) не открывается, а перестраивается
+    np.save(path, table.table)
+    with pytest.raises(ValueError):
+        earth.EarthTable.load(path)
+
+
+def test_dates_outside_table_use_analytic_formulas():
+    jd = np.array([2400000.5, 2460000.5])
+    r, v = earth_state(jd)
+    np.testing.assert_allclose(r[0], almanac_earth_state(jd[0])[0])
+    np.testing.assert_allclose(r[1], earth.table().state(jd[1])[0])
+    assert np.linalg.norm(r[1] - almanac_earth_state(jd[1])[0]) == pytest.approx(0, abs=0.01)
@@ -0,0 +1,113 @@
+import io
+import os
+import time
+
+from PIL import Image
+
+from image_store import UNATTACHED_MAX_AGE, ImageStore
+
+
+def png_bytes(size=(1200, 800), color=(200, 120, 40)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='PNG')
+    return output.getvalue()
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path), chunk_size=1000)
+    data = png_bytes()
+
+    first = store.save(io.BytesIO(data), '.PNG')
+    second = store.save(io.BytesIO(data), '.png')
+    other = store.save(io.BytesIO(png_bytes(color=(0, 0, 0))), '.png')
+    store.shutdown()
+
+    assert first == second != other
+    assert first.endswith('.png')
+    with open(store.path(first), 'rb') as file:
+        assert file.read() == data
+    assert sorted(name for name in os.listdir(store.directory) if name.endswith('.png')) == sorted([first, other])
+
+
+def test_thumbnail_is_built_in_background(tmp_path):
+    store = ImageStore(str(tmp_path))
+    name = store.save(io.BytesIO(png_bytes()), '.png')
+    store.shutdown()
+
+    with Image.open(store.thumbnail_path(name)) as thumbnail:
+        assert thumbnail.format == 'JPEG'
+        assert thumbnail.size == (320, 213)
+
+
+def test_unreadable_image_has_no_thumbnail(tmp_path):
+    store = ImageStore(str(tmp_path))
+    name = store.save(io.BytesIO(b'not an image'), '.png')
+    assert store.thumbnail(name) is None
+    assert store.thumbnail('missing.png') is None
+
+
+def test_unreferenced_images_are_removed(tmp_path):
+    store = ImageStore(str(tmp_path))
+    kept = store.save(io.BytesIO(png_bytes()), '.png')
+    dropped = store.save(io.BytesIO(png_bytes(color=(1, 2, 3))), '.png')
+    store.shutdown()
+    old = time.time() - 2 * UNATTACHED_MAX_AGE
+    os.utime(store.path(dropped), (old, old))
+
+    previous = os.path.realpath(store.directory)
+    removal = store.remove_unreferenced({kept})
+    # Каталог уже заменен, старый удаляется в фоне
+    assert os.path.exists(store.path(kept)) and os.path.exists(store.thumbnail_path(kept))
+    assert not os.path.exists(store.path(dropped))
+    assert not os.path.exists(store.thumbnail_path(dropped))
+    assert removal.result() == 1
+    assert not os.path.exists(previous)
+
+
+def test_fresh_upload_survives_removal_before_it_is_referenced(tmp_path):
+    store = ImageStore(str(tmp_path))
+    fresh = store.save(io.BytesIO(png_bytes()), '.png')
+    store.shutdown()
+
+    store.remove_unreferenced(set).result()
+    assert os.path.exists(store.path(fresh))
+    store.remove_unreferenced(lambda: set(), keep_recent=0).result()
+    assert not os.path.exists(store.path(fresh))
+
+
+def test_forked_process_does_not_inherit_threads(tmp_path):
+    store = ImageStore(str(tmp_path))
+    store.start_sweeper(3600, max_age=86400)
+    parent, parent_stop = store._sweeper, store._stop
+    store._reset_threads()  # как после fork
+    assert store._sweeper is None and not store._stop.is_set()
+    store.shutdown()
+    assert not parent_stop.is_set()
+    parent_stop.set()
+    parent.join()
+
+
+def test_flat_upload_directory_is_adopted(tmp_path):
+    (tmp_path / 'old.png').write_bytes(png_bytes())
+    (tmp_path / '.gitkeep').write_bytes(b'')
+    store = ImageStore(str(tmp_path))
+    assert os.path.islink(store.directory)
+    assert os.path.exists(store.path('old.png'))
+    assert (tmp_path / '.gitkeep').exists()
+    assert store.thumbnail('old.png') is not None
+    store.shutdown()
+
+
+def test_sweep_removes_old_images_then_oldest_over_budget(tmp_path):
+    store = ImageStore(str(tmp_path))
+    names = [store.save(io.BytesIO(png_bytes(color=(k, 0, 0))), '.png') for k in range(4)]
+    store.shutdown()
+    now = time.time()
+    for age, name in zip((10 * 86400, 3000, 2000, 1000), names):
+        os.utime(store.path(name), (now - age, now - age))
+
+    assert store.sweep(max_age=86400) == 1
+    assert not os.path.exists(store.thumbnail_path(names[0]))
+    size = os.path.getsize(store.path(names[3])) + os.path.getsize(store.thumbnail_path(names[3]))
+    assert store.sweep(max_bytes=size) == 2
+    assert [os.path.exists(store.path(name)) for name in names] == [False, False, False, True]
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+# Бюджет холодного импорта app, секунды; с запасом для медленных машин
+IMPORT_BUDGET_SECONDS = float(os.environ.get('APP_IMPORT_BUDGET', 1.0))
+# Загружаются только при первом использовании
+LAZY_MODULES = ('matplotlib', 'astropy', 'PIL')
+
+
+def cold_import(module):
+    """Время импорта в новом интерпретаторе и список загруженных модулей"""
+    code = (f'import sys, time; started = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - started); print(" ".join(sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+    return float(output[0]), set(output[1].split())
+
+
+def test_plotting_and_astropy_load_lazily():
+    _, modules = cold_import('app')
+    assert not {name.split('.')[0] for name in modules} & set(LAZY_MODULES)
+
+
+def test_app_import_fits_budget():
+    elapsed = min(cold_import('app')[0] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_SECONDS, f'import app took {elapsed:.2f} s'
+
+
+def test_warm_up_loads_plotting_in_process():
+    _, modules = cold_import('plot_renderer; plot_renderer.warm_up()')
+    assert 'matplotlib' in modules
@@ -0,0 +1,64 @@
+import io
+
+import numpy as np
+import pytest
+
+from ingest import import_observations, parse_mpc_lines, parse_sexagesimal
+from observation_store import ObservationStore
+
+MPC_LINES = [
+    b"     K24A00A  C2024 01 05.12345 12 43 27.81 -04 19 29.7          18.5 V      F51\n",
+    b"     K24A00A  C2024 01 06.50000 12 45 27.81 +04 29 29.7          18.5 V      F51\n",
+    b"     K24A00A  S2024 01 06.22345 12 45 27.81 -04 29 29.7          18.5 V      C51\n",
+    b"     K24A00A  s2024 01 06.22345 1 - 3862.4612 + 5221.3541 + 3129.5125        C51\n",
+]
+
+
+def test_parse_sexagesimal_formats():
+    values = parse_sexagesimal(['12h43m27.81s', '-04d19m29.7s', '12 43 27.81', '12:43:27.81',
+                                '12.5', '-00 30 00', 'junk'])
+
+    np.testing.assert_allclose(values[:6], [12.724391667, -4.324916667, 12.724391667,
+                                            12.724391667, 12.5, -0.5])
+    assert np.isnan(values[6])
+
+
+def test_parse_mpc_lines_skips_second_lines():
+    ra_hours, dec_degrees, jd = parse_mpc_lines(MPC_LINES)
+
+    assert len(jd) == 3
+    np.testing.assert_allclose(jd[:2], [2460314.62345, 2460316.0])
+    np.testing.assert_allclose(ra_hours[0], 12.724391667)
+    np.testing.assert_allclose(dec_degrees[:2], [-4.324916667, 4.491583333])
+
+
+def test_import_streams_chunks_and_rejects_bad_rows():
+    bad = b"     K24A00A  C2024 01 07.00000 25 45 27.81 -04 29 29.7          18.5 V      F51\n"
+    stream = io.BytesIO(b''.join(MPC_LINES * 5) + bad)
+    store = ObservationStore()
+
+    imported, rejected, errors = import_observations(stream, store, 'mpc', chunk_lines=3)
+
+    # Повторы уже записанных в предыдущих блоках наблюдений отбрасываются
+    assert (imported, rejected) == (3, 13)
+    assert errors == {'Right Ascension must be between 0 and 24 hours': 1, 'Duplicate observation time': 12}
+    assert len(store) == 3
+
+
+def test_import_csv():
+    data = (b"observation_time,ra,dec\n"
+            b"2025-08-26T00:00,12h43m27.81s,-04d19m29.7s\n"
+            b"2025-09-05 00:00:00Z,13.1,-6.9\n"
+            b"yesterday,1,1\n")
+    store = ObservationStore()
+
+    imported, rejected, errors = import_observations(io.BytesIO(data), store, 'csv')
+
+    assert (imported, rejected) == (2, 1)
+    assert errors == {'Invalid observation time format': 1}
+    np.testing.assert_allclose(store.jd, [2460913.5, 2460923.5])
+
+
+def test_import_csv_requires_known_columns():
+    with pytest.raises(ValueError):
+        import_observations(io.BytesIO(b"foo,bar\n1,2\n"), ObservationStore(), 'csv')
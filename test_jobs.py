@@ -0,0 +1,95 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from jobs import JobQueue, QueueFull, array_key
+
+
+def square(x):
+    return x * x
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def die():
+    os._exit(1)
+
+
+def wait(job, limit=10.0):
+    deadline = time.monotonic() + limit
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return job.status
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1, max_pending=3, timeout=0.5)
+    yield queue
+    queue.shutdown(wait=False)
+
+
+def test_job_result_and_status(queue):
+    job = queue.submit('square', square, 7)
+    assert wait(job) == 'done'
+    assert job.result() == 49
+    assert queue.get(job.id) is job
+
+
+def test_identical_in_flight_jobs_are_shared(queue):
+    first = queue.submit('sleep', sleep, 0.2)
+    assert queue.submit('sleep', sleep, 0.2) is first
+    wait(first)
+    assert queue.submit('sleep', sleep, 0.2) is not first
+
+
+def test_queue_is_bounded(queue):
+    for k in range(3):
+        queue.submit(k, sleep, 0.2)
+    with pytest.raises(QueueFull):
+        queue.submit('one more', sleep, 0.2)
+
+
+def test_job_timeout_stops_worker(queue):
+    job = queue.submit('slow', sleep, 5)
+    assert wait(job) == 'timeout'
+    assert wait(queue.submit('after', square, 3)) == 'done'
+
+
+def test_cancel_queued_job(queue):
+    running = queue.submit('running', sleep, 0.3)
+    queued = [queue.submit(k, square, k) for k in range(2)]
+    assert queue.cancel(queued[-1].id)
+    assert queued[-1].status == 'cancelled'
+    assert wait(running) == 'done'
+    assert not queue.cancel(running.id)
+
+
+def test_cancelled_running_job_keeps_its_slot(queue):
+    running = queue.submit('running', sleep, 0.3)
+    while running.status != 'running':
+        time.sleep(0.01)
+    assert queue.cancel(running.id)
+    assert running.status == 'cancelled'
+    assert queue.in_flight == 1
+    with pytest.raises(QueueFull):
+        queue.submit('running', sleep, 0.3)
+    running.future.result(timeout=5)
+    time.sleep(0.05)
+    assert queue.in_flight == 0
+
+
+def test_broken_pool_is_replaced(queue):
+    assert wait(queue.submit('die', die)) == 'failed'
+    assert wait(queue.submit('after', square, 4)) == 'done'
+
+
+def test_array_key_depends_on_content():
+    a = np.arange(5.0)
+    assert array_key(a, a) == array_key(a.copy(), a.copy())
+    assert array_key(a, a) != array_key(a, a[::-1])
@@ -0,0 +1,77 @@
+import numpy as np
+
+from linking import SkyIndex, components, link_observations, observing_nights
+from orbit import ARCSEC, OrbitalElements, earth_position, elements_state, line_of_sight
+
+
+def survey(objects, nights=(0, 1, 3), noise_arcsec=0.3, false_detections=100, seed=0, start=2460600.6):
+    """Три снимка за ночь для каждого объекта плюс случайные ложные обнаружения"""
+    rng = np.random.default_rng(seed)
+    jd, label, position = [], [], []
+    for k in range(objects):
+        q, e = rng.uniform(1.2, 4.0), rng.uniform(0.0, 0.9)
+        elements = OrbitalElements(q / (1 - e), e, rng.uniform(0, 40), rng.uniform(0, 360),
+                                   rng.uniform(0, 360), 2460600.5 + rng.uniform(-500, 500))
+        times = (start + np.array(nights)[:, None] + rng.uniform(0, 0.3, (len(nights), 1))
+                 + np.array([0, 15, 30]) / 1440).ravel()
+        jd.append(times)
+        label.append(np.full(len(times), k))
+        position.append(elements_state(elements, times)[0])
+    jd, label, position = np.concatenate(jd), np.concatenate(label), np.concatenate(position)
+
+    direction = position - earth_position(jd)
+    direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+    direction += rng.normal(0, noise_arcsec * ARCSEC, direction.shape)
+    ra = np.degrees(np.arctan2(direction[:, 1], direction[:, 0])) % 360 / 15
+    dec = np.degrees(np.arcsin(direction[:, 2] / np.linalg.norm(direction, axis=1)))
+
+    jd = np.concatenate([jd, start + rng.choice(nights, false_detections)
+                         + rng.uniform(0, 0.35, false_detections)])
+    ra = np.concatenate([ra, rng.uniform(0, 24, false_detections)])
+    dec = np.concatenate([dec, np.degrees(np.arcsin(rng.uniform(-1, 1, false_detections)))])
+    label = np.concatenate([label, np.full(false_detections, -1)])
+    order = rng.permutation(len(jd))
+    return jd[order], ra[order], dec[order], label[order]
+
+
+def test_index_query_matches_brute_force():
+    rng = np.random.default_rng(1)
+    points = line_of_sight(rng.uniform(0, 24, 2000), np.degrees(np.arcsin(rng.uniform(-1, 1, 2000))))
+    radius = np.radians(3.0)
+
+    q, f = SkyIndex(points, radius).query(points[:300], radius)
+    distance = np.linalg.norm(points[:300, None] - points[None], axis=2)
+    expected = set(zip(*np.nonzero(distance <= radius)))
+    assert set(zip(q.tolist(), f.tolist())) == expected
+
+
+def test_components_of_chains():
+    labels = components(7, np.array([0, 1, 5, 4]), np.array([1, 2, 6, 3]))
+    np.testing.assert_array_equal(labels, [0, 0, 0, 3, 3, 5, 5])
+
+
+def test_links_mixed_detections_into_objects():
+    jd, ra, dec, truth = survey(200)
+    linkage = link_observations(jd, ra, dec)
+
+    assert linkage.objects >= 195
+    for k in range(linkage.objects):
+        members = truth[linkage.labels == k]
+        # Каждый найденный объект — наблюдения одного настоящего объекта
+        assert members[0] >= 0 and np.all(members == members[0])
+    assert np.all(linkage.labels[truth < 0] == -1)
+
+
+def test_objects_seen_on_too_few_nights_stay_unlinked():
+    jd, ra, dec, _ = survey(20, nights=(0, 1), false_detections=0)
+    linkage = link_observations(jd, ra, dec)
+    assert linkage.objects == 0
+    assert np.all(linkage.labels == -1)
+
+
+def test_nights_crossing_noon_utc_are_not_split():
+    # Ночь обсерватории в Азии приходится на полдень UTC — границу суток JD
+    jd, ra, dec, truth = survey(50, start=2460600.85, false_detections=0)
+    assert len(np.unique(np.floor(jd))) > 3
+    assert len(np.unique(observing_nights(jd))) == 3
+    assert link_observations(jd, ra, dec).objects >= 48
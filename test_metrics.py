@@ -0,0 +1,68 @@
+import time
+
+import metrics
+from jobs import JobQueue
+
+
+def timed_square(x):
+    with metrics.span('test.square'):
+        return x * x
+
+
+def test_text_format():
+    registry = metrics.Registry()
+    counter = registry.counter('test_requests_total', 'Requests.', labels=('method',))
+    histogram = registry.histogram('test_seconds', 'Durations.', buckets=(0.1, 1))
+    registry.gauge('test_depth', 'Depth.', lambda: 3)
+    counter.inc('GET')
+    counter.inc('GET', amount=2)
+    counter.inc('a"b')
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE test_requests_total counter' in lines
+    assert 'test_requests_total{method="GET"} 3' in lines
+    assert r'test_requests_total{method="a\"b"} 1' in lines
+    assert lines[lines.index('# TYPE test_seconds histogram') + 1:][:5] == [
+        'test_seconds_bucket{le="0.1"} 2', 'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4', 'test_seconds_sum 5.65', 'test_seconds_count 4']
+    assert 'test_depth 3' in lines
+
+
+def test_captured_samples_are_replayed():
+    registry = metrics.Registry()
+    counter = registry.counter('test_total', 'Total.')
+    histogram = registry.histogram('test_seconds', 'Durations.', labels=('stage',))
+    with metrics.capture() as samples:
+        counter.inc()
+        histogram.observe(0.2, 'fit')
+    assert counter.value() == 0 and histogram.count('fit') == 0
+    registry.replay(samples)
+    assert counter.value() == 1 and histogram.count('fit') == 1
+
+
+def test_job_stage_timings_reach_the_parent_process():
+    before = metrics.STAGE_SECONDS.count('test.square')
+    queue = JobQueue(max_workers=1)
+    try:
+        job = queue.submit('square', timed_square, 6)
+        deadline = time.monotonic() + 10
+        while metrics.STAGE_SECONDS.count('test.square') == before and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert job.result() == 36
+        assert metrics.STAGE_SECONDS.count('test.square') == before + 1
+    finally:
+        queue.shutdown()
+
+
+def test_metrics_endpoint():
+    from app import app
+
+    with metrics.span('test.endpoint'):
+        pass
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'comet_stage_seconds_count{stage="test.endpoint"} 1' in text
+    assert '# TYPE comet_jobs_in_flight gauge' in text
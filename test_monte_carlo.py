@@ -0,0 +1,81 @@
+import numpy as np
+
+from ephemeris import PlanetEphemeris, build_ephemeris_table
+from monte_carlo import clone_approaches, monte_carlo_close_approach, sample_clones
+from nbody import PerturbedOrbit
+from orbit import OrbitalElements, OrbitFit, elements_state, find_close_approach
+
+
+def fitted_elements(sigma):
+    elements = OrbitalElements(1.3, 0.25, 5.0, 40.0, 100.0, 2460500.5)
+    epoch = 2460600.5
+    r, v = elements_state(elements, epoch)
+    covariance = np.diag([sigma ** 2] * 3 + [(sigma / 100) ** 2] * 3)
+    elements.fit = OrbitFit(epoch, np.concatenate([r, v]), covariance, np.zeros((10, 2)), 1)
+    return elements
+
+
+def test_clones_follow_covariance():
+    fit = fitted_elements(1e-4).fit
+    clones = sample_clones(fit, 20000, seed=1)
+
+    np.testing.assert_allclose(clones.mean(axis=0), fit.state, atol=5e-6)
+    sample = np.cov(clones.T)
+    sigma = np.sqrt(np.diag(sample))
+    np.testing.assert_allclose(sigma, np.sqrt(np.diag(fit.covariance)), rtol=0.03)
+    np.testing.assert_allclose(sample / np.outer(sigma, sigma), np.eye(6), atol=0.05)
+
+
+def test_clone_minimum_matches_nominal_search():
+    elements = fitted_elements(0.0)
+    jd, distance = find_close_approach(elements, 2460600.5, 3 * 365.25)
+    state = np.concatenate(elements_state(elements, jd))
+
+    times, distances, unresolved = clone_approaches(np.tile(state, (3, 1)), jd)
+
+    np.testing.assert_allclose(times, jd, atol=1e-4)
+    np.testing.assert_allclose(distances, distance, rtol=1e-9)
+    assert not unresolved.any()
+
+
+def test_distribution_widens_with_uncertainty():
+    narrow = fitted_elements(1e-6)
+    wide = fitted_elements(1e-3)
+    jd, distance = find_close_approach(narrow, 2460600.5, 3 * 365.25)
+
+    small = monte_carlo_close_approach(narrow, jd, clones=2000)
+    large = monte_carlo_close_approach(wide, jd, clones=2000)
+
+    assert abs(small.nominal_distance - distance) < 1e-9
+    spread = lambda d: d.distance_percentiles()[95] - d.distance_percentiles()[5]
+    assert spread(small) < 1e-3 < spread(large)
+    assert small.impact_probability == 0.0
+
+
+def test_parallel_split_matches_serial():
+    elements = fitted_elements(1e-4)
+    jd, _ = find_close_approach(elements, 2460600.5, 3 * 365.25)
+
+    serial = monte_carlo_close_approach(elements, jd, clones=4000, workers=1)
+    parallel = monte_carlo_close_approach(elements, jd, clones=4000, workers=2)
+
+    np.testing.assert_allclose(parallel.distances, serial.distances)
+    np.testing.assert_allclose(parallel.times, serial.times)
+
+
+def test_perturbed_nominal_carries_the_clones(tmp_path):
+    path = str(tmp_path / 'planets.npy')
+    build_ephemeris_table(path, 2460500.5, 2461800.5)
+    ephemeris = PlanetEphemeris(path)
+    elements = fitted_elements(1e-6)
+    fit = elements.fit
+    orbit = PerturbedOrbit(fit.state, fit.epoch, fit.epoch, fit.epoch + 3 * 365.25, ephemeris)
+    jd, distance = find_close_approach(orbit, fit.epoch, 3 * 365.25)
+
+    perturbed = monte_carlo_close_approach(elements, jd, clones=500, ephemeris=ephemeris)
+    two_body = monte_carlo_close_approach(elements, jd, clones=500)
+
+    assert (perturbed.propagation, two_body.propagation) == ('n-body', 'two-body')
+    assert abs(perturbed.nominal_distance - distance) < 1e-6
+    assert abs(two_body.nominal_distance - distance) > 1e-5
+    assert np.median(np.abs(perturbed.distances - perturbed.nominal_distance)) < 1e-5
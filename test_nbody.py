@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from ephemeris import PlanetEphemeris, build_ephemeris_table
+from nbody import PerturbedOrbit, integrate
+from orbit import OrbitalElements, elements_state, find_close_approach, propagate
+
+EPOCH = 2460600.5
+
+
+@pytest.fixture(scope='module')
+def ephemeris(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('ephemeris') / 'planets.npy')
+    build_ephemeris_table(path, EPOCH - 200, EPOCH + 800)
+    return PlanetEphemeris(path)
+
+
+class Massless:
+    """Те же положения планет без их притяжения"""
+
+    def __init__(self, ephemeris):
+        self.positions = ephemeris.positions
+        self.gm = np.zeros_like(ephemeris.gm)
+
+
+def comet_state():
+    elements = OrbitalElements(1.3, 0.25, 5.0, 40.0, 100.0, 2460500.5)
+    return np.concatenate(elements_state(elements, EPOCH))
+
+
+def test_table_matches_astropy(ephemeris):
+    from astropy.coordinates import get_body_barycentric, solar_system_ephemeris
+    from astropy.time import Time
+
+    jd = np.linspace(EPOCH - 150, EPOCH + 750, 37)
+    with solar_system_ephemeris.set('builtin'):
+        times = Time(jd, format='jd', scale='tdb')
+        sun = get_body_barycentric('sun', times).xyz.to_value('AU').T
+        jupiter = get_body_barycentric('jupiter', times).xyz.to_value('AU').T - sun
+
+    np.testing.assert_allclose(ephemeris.position('jupiter', jd), jupiter, atol=1e-9)
+    with pytest.raises(ValueError):
+        ephemeris.positions(EPOCH + 900)
+
+
+def test_without_planet_masses_matches_two_body(ephemeris):
+    state = comet_state()
+    orbit = PerturbedOrbit(state, EPOCH, EPOCH - 100, EPOCH + 700, Massless(ephemeris))
+
+    jd = np.linspace(EPOCH - 100, EPOCH + 700, 203)
+    r, v = orbit.state_at(jd)
+    expected_r, expected_v = propagate(state[:3], state[3:], jd - EPOCH)
+    np.testing.assert_allclose(r, expected_r, atol=1e-7)
+    np.testing.assert_allclose(v, expected_v, atol=1e-8)
+
+
+def test_batch_integration_matches_single_states(ephemeris):
+    states = comet_state() + np.outer(np.arange(3), [1e-3, 0, 0, 0, 1e-5, 0])
+    times, r, v, _ = integrate(states, EPOCH, EPOCH + 300, ephemeris)
+
+    for k, state in enumerate(states):
+        single = PerturbedOrbit(state, EPOCH, EPOCH, EPOCH + 300, ephemeris)
+        np.testing.assert_allclose(single.state_at(times[-1])[0], r[-1, k], atol=1e-9)
+
+
+def test_planets_shift_close_approach(ephemeris):
+    state = comet_state()
+    two_body = find_close_approach(PerturbedOrbit(state, EPOCH, EPOCH, EPOCH + 700,
+                                                  Massless(ephemeris)), EPOCH, 700)
+    perturbed = find_close_approach(PerturbedOrbit(state, EPOCH, EPOCH, EPOCH + 700, ephemeris),
+                                     EPOCH, 700)
+
+    assert perturbed[1] != pytest.approx(two_body[1], abs=1e-6)
+    assert perturbed[0] == pytest.approx(two_body[0], abs=5)
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from astropy.time import Time
+
+from observation_store import ObservationStore, datetimes_to_jd, jd_to_datetime
+
+
+def test_append_grows_and_keeps_values():
+    store = ObservationStore(capacity=2)
+    for k in range(100):
+        store.append(k * 0.1, -k * 0.5, 2460000.5 + k, 'img.png' if k % 10 == 0 else None)
+
+    assert len(store) == 100
+    np.testing.assert_allclose(store.ra_hours, np.arange(100) * 0.1)
+    np.testing.assert_allclose(store.jd, 2460000.5 + np.arange(100))
+    assert store[10].image_filename == 'img.png'
+    assert store[-1].image_filename is None
+    assert store.nbytes == 100 * 28
+
+
+def test_sorted_arrays_are_views_when_appended_in_order():
+    store = ObservationStore()
+    store.extend([1.0, 2.0, 3.0], [10.0, 20.0, 30.0], [2460000.5, 2460001.5, 2460002.5])
+
+    jd, ra, dec = store.sorted_arrays()
+
+    assert np.shares_memory(jd, store.jd)
+    np.testing.assert_array_equal(ra, [1.0, 2.0, 3.0])
+
+
+def test_sorted_arrays_reorders_and_caches():
+    store = ObservationStore()
+    store.extend([3.0, 1.0, 2.0], [30.0, 10.0, 20.0], [2460002.5, 2460000.5, 2460001.5])
+
+    jd, ra, dec = store.sorted_arrays()
+
+    np.testing.assert_array_equal(jd, [2460000.5, 2460001.5, 2460002.5])
+    np.testing.assert_array_equal(dec, [10.0, 20.0, 30.0])
+    assert store.sorted_arrays()[0] is jd
+    store.append(4.0, 40.0, 2460003.5)
+    assert len(store.sorted_arrays()[0]) == 4
+
+
+def test_slice_is_zero_copy():
+    store = ObservationStore()
+    store.extend(np.arange(10.0), np.arange(10.0), 2460000.5 + np.arange(10.0))
+
+    view = store[2:5]
+
+    assert len(view) == 3
+    assert np.shares_memory(view.jd, store.jd)
+    assert view[0].ra_hours == 2.0
+    with pytest.raises(IndexError):
+        view[3]
+
+
+def test_images_added_through_slice_stay_in_slice():
+    store = ObservationStore()
+    store.extend([1.0, 2.0], [10.0, 20.0], [2460000.5, 2460001.5], ['a.png', None])
+
+    view = store[0:2]
+    view.append(3.0, 30.0, 2460002.5, 'b.png')
+
+    assert view[2].image_filename == 'b.png' and view[0].image_filename == 'a.png'
+    assert store.image_filenames() == {'a.png'}
+    assert store.image_column().tolist() == ['a.png', None]
+
+
+def test_row_observation_time():
+    store = ObservationStore()
+    store.append(12.5, -4.25, 2460913.5)
+
+    row = store[0]
+
+    assert row.observation_time == datetime(2025, 8, 26)
+    assert jd_to_datetime(2451545.0) == datetime(2000, 1, 1, 12)
+
+
+def test_datetimes_to_jd_matches_astropy():
+    rng = np.random.default_rng(1)
+    seconds = rng.uniform(0, 54 * 365.25 * 86400, 2000)
+    times = [datetime(1972, 1, 1) + timedelta(seconds=float(s)) for s in seconds]
+    # Сутки с секундой координации
+    times += [datetime(2016, 12, 31, 23, 59, 59), datetime(2015, 6, 30, 12), datetime(2017, 1, 1)]
+
+    np.testing.assert_allclose(datetimes_to_jd(times), Time(times).jd, rtol=0, atol=1e-9)
+
+
+def test_datetimes_to_jd_accepts_strings_and_aware_datetimes():
+    expected = 2460913.5
+
+    assert datetimes_to_jd(datetime(2025, 8, 26)) == expected
+    assert datetimes_to_jd(datetime(2025, 8, 26, 3, tzinfo=timezone(timedelta(hours=3)))) == expected
+    np.testing.assert_array_equal(
+        datetimes_to_jd(['2025-08-26T00:00:00Z', '2025-08-26T12:00', '2025-08-26T03:00:00+03:00']),
+        [expected, expected + 0.5, expected])
+
+
+def test_datetimes_to_jd_bulk_speed():
+    times = [datetime(2025, 1, 1) + timedelta(minutes=k) for k in range(100000)]
+
+    start = time.perf_counter()
+    jd = datetimes_to_jd(times)
+    elapsed = time.perf_counter() - start
+
+    assert jd[-1] - jd[0] == pytest.approx(99999 / 1440)
+    assert elapsed < 1.0
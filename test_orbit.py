@@ -0,0 +1,182 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from astropy.time import Time
+
+import test_runner
+from orbit import (MU_SUN, earth_position, earth_state, elements_state, find_close_approach,
+                   find_close_approaches, fit_orbit, predict_radec, propagate, refine_orbit,
+                   state_to_elements)
+
+
+def synthetic_arc(state, epoch, jd):
+    """Точные RA/Dec (часы, градусы) для заданного состояния"""
+    ra, dec = predict_radec(state[None], epoch, jd, earth_position(jd))
+    return np.degrees(ra[0]) % 360 / 15, np.degrees(dec[0])
+
+
+def runner_arc():
+    """Наблюдения из TestRunner в виде массивов JD, RA, Dec"""
+    runner = test_runner.TestRunner()
+    rows = runner.observations_data
+    jd = Time([datetime.fromisoformat(runner.parse_time(t)) for t, _, _ in rows]).jd
+    ra = [runner.parse_ra_to_hours(r) for _, r, _ in rows]
+    dec = [runner.parse_dec_to_degrees(d) for _, _, d in rows]
+    return jd, ra, dec
+
+
+def test_fit_recovers_synthetic_orbit():
+    state = np.array([1.5, 0.8, 0.3, -0.005, 0.012, 0.004])
+    epoch = 2460000.5
+    jd = epoch + np.linspace(-40, 40, 300)
+    ra, dec = synthetic_arc(state, epoch, jd)
+
+    elements = fit_orbit(jd, ra, dec)
+    expected = state_to_elements(state, epoch)
+
+    assert elements.fit.rms_arcsec < 1e-3
+    assert elements.a == pytest.approx(expected.a, rel=1e-6)
+    assert elements.e == pytest.approx(expected.e, abs=1e-6)
+    assert elements.i == pytest.approx(expected.i, abs=1e-5)
+    assert elements.t_peri == pytest.approx(expected.t_peri, abs=1e-3)
+
+
+def test_fit_hyperbolic_orbit():
+    state = np.array([1.2, -0.6, 0.4, 0.004, 0.022, -0.011])
+    epoch = 2460100.5
+    jd = epoch + np.linspace(-20, 20, 50)
+    ra, dec = synthetic_arc(state, epoch, jd)
+
+    elements = fit_orbit(jd, ra, dec)
+
+    assert elements.e > 1
+    assert elements.a < 0
+    assert elements.e == pytest.approx(state_to_elements(state, epoch).e, rel=1e-6)
+
+
+def test_fit_test_runner_data():
+    """Тестовые данные TestRunner — эфемерида Марса (a=1.524 а.е., e=0.093, i=1.85°)"""
+    elements = fit_orbit(*runner_arc())
+
+    assert elements.a == pytest.approx(1.524, abs=0.01)
+    assert elements.e == pytest.approx(0.093, abs=0.005)
+    assert elements.i == pytest.approx(1.85, abs=0.05)
+    assert elements.fit.rms_arcsec < 5
+
+
+def test_fit_rejects_outliers():
+    state = np.array([1.5, 0.8, 0.3, -0.005, 0.012, 0.004])
+    epoch = 2460000.5
+    jd = epoch + np.linspace(-40, 40, 300)
+    ra, dec = synthetic_arc(state, epoch, jd)
+    rng = np.random.default_rng(1)
+    ra += rng.normal(0, 0.5 / 3600 / 15, len(jd))
+    dec += rng.normal(0, 0.5 / 3600, len(jd))
+    outliers = [7, 150, 151, 290]
+    dec[outliers] += 0.1
+
+    elements = fit_orbit(jd, ra, dec)
+    unclipped = fit_orbit(jd, ra, dec, clip_sigma=None)
+
+    assert np.flatnonzero(elements.fit.rejected).tolist() == outliers
+    assert elements.fit.rms_arcsec < 1
+    assert unclipped.fit.rejected_count == 0 and unclipped.fit.rms_arcsec > 10
+    assert elements.a == pytest.approx(state_to_elements(state, epoch).a, rel=1e-4)
+
+
+def test_refine_after_appending_matches_full_fit():
+    jd, ra, dec = (np.asarray(a, dtype=float) for a in runner_arc())
+    full = fit_orbit(jd, ra, dec)
+    new = np.zeros(len(jd), dtype=bool)
+    new[[4, 9]] = True
+
+    previous = fit_orbit(jd[~new], ra[~new], dec[~new])
+    refined = refine_orbit(previous, jd, ra, dec, new)
+
+    assert refined.fit.nobs == len(jd)
+    assert refined.a == pytest.approx(full.a, rel=1e-5)
+    assert refined.e == pytest.approx(full.e, abs=1e-5)
+    assert refined.fit.rms_arcsec == pytest.approx(full.fit.rms_arcsec, rel=1e-3)
+
+
+def test_refine_falls_back_to_full_correction_for_large_update():
+    state = np.array([1.5, 0.8, 0.3, -0.005, 0.012, 0.004])
+    epoch = 2460000.5
+    jd = epoch + np.linspace(-10, 60, 40)
+    ra, dec = synthetic_arc(state, epoch, jd)
+    new = jd > epoch + 10
+
+    previous = fit_orbit(jd[~new], ra[~new], dec[~new])
+    refined = refine_orbit(previous, jd, ra, dec, new)
+
+    assert refined.fit.rms_arcsec < 1e-3
+    assert refined.a == pytest.approx(state_to_elements(state, epoch).a, rel=1e-6)
+    with pytest.raises(ValueError):
+        refine_orbit(previous, jd[1:], ra[1:], dec[1:], new[1:])
+
+
+def test_fit_requires_three_observations():
+    with pytest.raises(ValueError):
+        fit_orbit([2460000.5, 2460001.5], [1.0, 1.1], [5.0, 5.1])
+
+
+def test_fit_reports_diverged_correction(monkeypatch):
+    import orbit
+
+    state = np.array([1.5, 0.8, 0.3, -0.005, 0.012, 0.004])
+    epoch = 2460000.5
+    jd = epoch + np.linspace(-40, 40, 30)
+    ra, dec = synthetic_arc(state, epoch, jd)
+
+    def diverged(x, epoch, jd, *args, **kwargs):
+        return x, np.full(2 * len(jd), np.nan), np.zeros((2 * len(jd), 6)), kwargs.get('max_iter', 50)
+
+    monkeypatch.setattr(orbit, 'differential_correction', diverged)
+    with pytest.raises(ValueError, match='did not converge'):
+        fit_orbit(jd, ra, dec)
+
+
+@pytest.mark.parametrize('velocity_scale', [0.8, 1.0, 1.3])
+def test_kepler_state_matches_universal_propagator(velocity_scale):
+    """Эллипс, парабола и гипербола: элементы и универсальные переменные дают одно и то же"""
+    r = np.array([1.0, 0.2, 0.1])
+    direction = np.array([0.1, 1.0, 0.3]) / np.linalg.norm([0.1, 1.0, 0.3])
+    v = direction * velocity_scale * np.sqrt(2 * MU_SUN / np.linalg.norm(r))
+    epoch = 2460000.5
+    elements = state_to_elements(np.concatenate([r, v]), epoch)
+    if velocity_scale == 1.0:
+        elements.e = 1.0
+
+    jd = epoch + np.linspace(-3000, 3000, 25)
+    expected_r, expected_v = propagate(r, v, jd - epoch)
+    actual_r, actual_v = elements_state(elements, jd)
+
+    np.testing.assert_allclose(actual_r, expected_r, atol=1e-9)
+    np.testing.assert_allclose(actual_v, expected_v, atol=1e-11)
+
+
+def test_close_approach_flyby_matches_dense_scan():
+    epoch = 2460500.5
+    earth_r, earth_v = earth_state(epoch)
+    state = np.concatenate([earth_r + [0.02, -0.01, 0.005], earth_v + [0.004, 0.006, -0.002]])
+    elements = state_to_elements(state, epoch)
+
+    jd, distance = find_close_approach(elements, epoch - 30, 60)
+
+    grid = epoch - 30 + np.linspace(0, 60, 600001)
+    r, _ = elements_state(elements, grid)
+    scan = np.linalg.norm(r - earth_position(grid), axis=-1)
+    assert distance == pytest.approx(scan.min(), abs=1e-9)
+    assert jd == pytest.approx(grid[np.argmin(scan)], abs=1e-3)
+
+
+def test_close_approaches_of_test_runner_orbit():
+    """Сближение Марса с Землей в феврале 2027 г. (~0.68 а.е.)"""
+    elements = fit_orbit(*runner_arc())
+
+    times, distance = find_close_approaches(elements, Time('2026-06-01').jd, 365.25 * 50)
+
+    assert len(times) > 20
+    assert Time(times[0], format='jd').datetime.strftime('%Y-%m') == '2027-02'
+    assert distance[0] == pytest.approx(0.68, abs=0.01)
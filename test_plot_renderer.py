@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import plot_renderer
+from orbit import OrbitalElements
+from plot_renderer import render_orbit_plot
+
+ELEMENTS = OrbitalElements(1.52, 0.09, 1.85, 49.3, 286.5, 2460000.5)
+TIMES = 2460900.5 + np.arange(10) * 10.0
+RA = np.linspace(5.0, 6.0, 10)
+DEC = np.linspace(20.0, 22.0, 10)
+
+
+def test_renders_png_and_svg():
+    png = render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png')
+    svg = render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'svg')
+
+    assert png.startswith(b'\x89PNG')
+    assert b'<svg' in svg[:1000]
+    with pytest.raises(ValueError):
+        render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'gif')
+
+
+def test_template_is_reused_without_leaking_artists():
+    first = render_orbit_plot(ELEMENTS, TIMES[:1], RA[:1], DEC[:1], 'png')
+    render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png')
+    hyperbolic = OrbitalElements(-2.0, 1.5, 10.0, 0.0, 0.0, 2460000.5)
+    render_orbit_plot(hyperbolic, TIMES, RA, DEC, 'png')
+
+    assert render_orbit_plot(ELEMENTS, TIMES[:1], RA[:1], DEC[:1], 'png') == first
+
+
+def test_concurrent_renders_match_serial():
+    expected = render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png')
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png'), range(8)))
+    assert all(result == expected for result in results)
+
+
+def test_large_arc_is_binned_with_sampled_labels():
+    n = 20000
+    times = 2460900.5 + np.linspace(0, 100, n)
+    ra = (23.5 + np.linspace(0, 1, n)) % 24  # через 0 ч
+    render_orbit_plot(ELEMENTS, times, ra, np.linspace(20, 22, n), 'png')
+    renderer = plot_renderer._local.renderer
+
+    assert renderer.sky_density.get_visible() and not renderer.sky_scatter.get_visible()
+    assert sum(label.get_visible() for label in renderer.sky_labels) == plot_renderer.MAX_LABELS
+    assert len(renderer.sky_path.get_xdata()) <= plot_renderer._PATH_VERTICES + 1
+    low, high = renderer.sky_ax.get_xlim()
+    assert 23.4 < low < 23.5 and 24.5 < high < 24.6
+
+    render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png')
+    assert renderer.sky_scatter.get_visible() and not renderer.sky_density.get_visible()
+    assert sum(label.get_visible() for label in renderer.sky_labels) == len(TIMES)
+
+
+def test_png_is_drawn_over_cached_background():
+    first = render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png')
+    renderer = plot_renderer._local.renderer
+    background = renderer._background
+    svg = render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'svg')
+
+    # SVG рисуется целиком, включая подписи делений, и не портит фон для PNG
+    assert b'Sky Motion of Comet' in svg and svg.count(b'<g id="xtick_') >= 4
+    assert render_orbit_plot(ELEMENTS, TIMES, RA, DEC, 'png') == first
+    assert renderer._background is background
+    assert all(artist.get_animated() for artist in renderer._dynamic)
@@ -0,0 +1,41 @@
+import time
+
+from profiling import SamplingProfiler, collapse
+
+
+def busy_leaf(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def busy(seconds):
+    busy_leaf(seconds)
+
+
+def test_samples_the_profiled_thread():
+    with SamplingProfiler(interval=0.002) as profiler:
+        busy(0.2)
+    assert profiler.samples > 10 and profiler.elapsed >= 0.2
+    stack, _ = profiler.stacks.most_common(1)[0]
+    assert stack.endswith('test_profiling:busy;test_profiling:busy_leaf')
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in profiler.collapsed().splitlines())
+
+
+def test_collapse_orders_from_root():
+    import sys
+
+    assert collapse(sys._getframe(), limit=1) == 'test_profiling:test_collapse_orders_from_root'
+
+
+def test_profiled_request_returns_stacks():
+    from app import app
+
+    client = app.test_client()
+    app.config['PROFILING_TOKEN'] = 'secret'
+    try:
+        response = client.get('/objects', headers={'X-Profile': 'secret'})
+        assert response.mimetype == 'text/plain' and response.headers['X-Profile-Status'] == '200'
+        assert client.get('/objects', headers={'X-Profile': 'other'}).mimetype == 'text/html'
+    finally:
+        app.config['PROFILING_TOKEN'] = None
@@ -0,0 +1,75 @@
+import queue
+import threading
+import time
+
+import progress
+from jobs import JobQueue
+
+
+def reporting_job(steps):
+    for step in range(steps):
+        progress.report('work', force=True, step=step)
+        time.sleep(0.01)
+    return steps
+
+
+def test_subscribers_get_latest_stage_messages_and_end():
+    job_progress = progress.JobProgress()
+    job_progress.update('fit', {'iteration': 1})
+    job_progress.update('fit', {'iteration': 2})
+    streams = [progress.event_stream(job_progress, 'running', end={'url': '/jobs/1'}) for _ in range(3)]
+    for stream in streams:
+        assert 'event: status' in next(stream)
+        # Промежуточное сообщение этапа заменено последним
+        assert next(stream) == 'event: fit\nid: 2\ndata: {"iteration": 2}\n\n'
+
+    job_progress.update('close_approach', {'searched_days': 10.0})
+    job_progress.finish('done')
+    job_progress.update('fit', {'iteration': 3})  # после завершения не принимается
+    for stream in streams:
+        rest = list(stream)
+        assert [event.split('\n')[0] for event in rest] == ['event: close_approach', 'event: end']
+        assert rest[-1].endswith('data: {"url": "/jobs/1", "status": "done"}\n\n')
+
+
+def test_heartbeat_while_idle():
+    stream = progress.event_stream(progress.JobProgress(), 'queued', heartbeat=0.01)
+    next(stream)
+    assert next(stream) == ': keep-alive\n\n'
+
+
+def test_report_is_throttled_and_json_safe(monkeypatch):
+    messages = queue.Queue()
+    monkeypatch.setattr(progress, '_queue', messages)
+    progress.report('fit', iteration=0)  # вне задания
+    progress.start('job')
+    try:
+        progress.report('fit', iteration=1, rms_arcsec=float('nan'))
+        progress.report('fit', iteration=2)
+        progress.report('fit', force=True, iteration=3)
+    finally:
+        progress.stop()
+    received = [messages.get_nowait() for _ in range(messages.qsize())]
+    assert received == [('job', 'fit', {'iteration': 1, 'rms_arcsec': None}), ('job', 'fit', {'iteration': 3})]
+
+
+def test_messages_from_worker_process_reach_all_subscribers():
+    jobs = JobQueue(max_workers=1)
+    try:
+        job = jobs.submit('report', reporting_job, 5)
+        outputs = [None] * 4
+
+        def subscribe(i):
+            outputs[i] = list(progress.event_stream(job.progress, job.status, heartbeat=1))
+
+        threads = [threading.Thread(target=subscribe, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        for output in outputs:
+            assert output[-1].startswith('event: end') and '"status": "done"' in output[-1]
+            assert any(event.startswith('event: work') for event in output)
+        assert job.result() == 5
+    finally:
+        jobs.shutdown()
@@ -0,0 +1,55 @@
+import numpy as np
+
+from result_cache import ResultCache, result_key
+
+
+def test_key_depends_on_observations_and_settings():
+    jd, ra, dec = np.arange(3.0), np.ones(3), np.zeros(3)
+    key = result_key(jd, ra, dec, {'fit_max_iter': 50})
+
+    assert key == result_key(jd.copy(), ra.copy(), dec.copy(), {'fit_max_iter': 50})
+    assert key != result_key(jd, ra, dec + 1e-12, {'fit_max_iter': 50})
+    assert key != result_key(jd, ra, dec, {'fit_max_iter': 10})
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=3000)
+    for key in 'abc':
+        cache.put(key, b'x' * 900)
+    cache.get('a')
+    cache.put('d', b'x' * 900)
+
+    assert cache.get('a') == b'x' * 900
+    assert cache.get('b') is None
+    assert cache.nbytes <= 3000
+
+
+def test_disk_tier_keeps_evicted_entries(tmp_path):
+    cache = ResultCache(max_bytes=1500, directory=str(tmp_path))
+    cache.put('a', {'plot': b'1' * 1000})
+    cache.put('b', {'plot': b'2' * 1000})
+
+    assert 'a' in cache
+    assert cache.get('a') == {'plot': b'1' * 1000}
+    # Другой рабочий процесс с тем же каталогом видит записи
+    assert ResultCache(directory=str(tmp_path)).get('b') == {'plot': b'2' * 1000}
+
+
+def test_disk_tier_is_size_bounded(tmp_path):
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path), max_disk_bytes=2500)
+    for key in 'abcd':
+        cache.put(key, b'x' * 1000)
+
+    assert cache.get('a') is None
+    assert cache.get('d') == b'x' * 1000
+    assert len(list(tmp_path.glob('*.pickle'))) == 2
+
+
+def test_membership_check_is_not_counted():
+    cache = ResultCache()
+    cache.put('a', 1)
+    assert 'a' in cache and 'b' not in cache
+    assert (cache.hits, cache.misses) == (0, 0)
+    cache.get('a')
+    cache.get('b')
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -7,7 +7,7 @@ import re
 # Добавляем путь к приложению
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, Observation, validate_observation_data, calculate_orbital_elements
+from app import app, create_observations, validate_observation_data, calculate_orbital_elements
 
 
 class TestRunner:
@@ -102,8 +102,8 @@ class TestRunner:
         print("🔭 СОЗДАНИЕ ТЕСТОВЫХ НАБЛЮДЕНИЙ")
         print("=" * 30)
 
-        observations = []
         data_to_use = self.observations_data[:count] if count else self.observations_data
+        parsed = []
 
         for i, (time_str, ra_str, dec_str) in enumerate(data_to_use, 1):
             print(f"\nНаблюдение {i}:")
@@ -117,20 +117,21 @@ class TestRunner:
             dec_degrees = self.parse_dec_to_degrees(dec_str)
 
             if iso_time and ra_hours is not None and dec_degrees is not None:
-                try:
-                    # Создаем объект наблюдения
-                    obs = Observation(
-                        ra_hours=ra_hours,
-                        dec_degrees=dec_degrees,
-                        observation_time=datetime.fromisoformat(iso_time)
-                    )
-                    observations.append(obs)
-                    print(f"  ✅ УСПЕХ: RA={ra_hours:.6f}h, Dec={dec_degrees:.6f}°")
-                except Exception as e:
-                    print(f"  ❌ ОШИБКА: {e}")
+                parsed.append((ra_hours, dec_degrees, datetime.fromisoformat(iso_time)))
             else:
                 print("  ❌ ОШИБКА ПАРСИНГА ДАННЫХ")
 
+        observations = []
+        if parsed:
+            try:
+                # Создаем объекты наблюдений, JD считаются одним пакетом
+                ra_values, dec_values, times = zip(*parsed)
+                observations = create_observations(ra_values, dec_values, times)
+                for obs in observations:
+                    print(f"  ✅ УСПЕХ: RA={obs.ra_hours:.6f}h, Dec={obs.dec_degrees:.6f}°")
+            except Exception as e:
+                print(f"  ❌ ОШИБКА: {e}")
+
         print(f"\n📊 СОЗДАНО НАБЛЮДЕНИЙ: {len(observations)} из {len(data_to_use)}")
         return observations
 
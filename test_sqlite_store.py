@@ -0,0 +1,109 @@
+import multiprocessing
+import sqlite3
+import threading
+
+import numpy as np
+
+from sqlite_store import COMPACT_BATCHES, SQLiteObservationStore
+
+
+def test_workers_share_observations(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    first = SQLiteObservationStore(path)
+    second = SQLiteObservationStore(path)
+
+    first.extend([1.0, 2.0], [10.0, 20.0], [2460001.5, 2460000.5], ['a.png', None])
+    assert len(second) == 2
+    jd, ra, dec = second.sorted_arrays()
+    np.testing.assert_allclose(jd, [2460000.5, 2460001.5])
+    np.testing.assert_allclose(ra, [2.0, 1.0])
+    assert second[0].image_filename == 'a.png'
+    assert second[1].image_filename is None
+
+    second.append(3.0, 30.0, 2460002.5, 'b.png')
+    assert len(first) == 3
+    assert first.image_filename(2) == 'b.png'
+
+
+def _append_in_child(path):
+    SQLiteObservationStore(path).append(4.0, 40.0, 2460003.5, 'c.png')
+
+
+def test_write_from_another_process_is_seen(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    store = SQLiteObservationStore(path)
+    store.extend([1.0], [10.0], [2460000.5])
+    assert len(store) == 1
+
+    child = multiprocessing.get_context('spawn').Process(target=_append_in_child, args=(path,))
+    child.start()
+    child.join()
+
+    assert child.exitcode == 0
+    assert len(store) == 2 and store.image_filename(1) == 'c.png'
+
+
+def test_snapshot_is_reused_until_another_write(tmp_path):
+    store = SQLiteObservationStore(str(tmp_path / 'observations.db'))
+    store.extend([1.0], [10.0], [2460000.5])
+
+    assert store._load() is store._load()
+    snapshot = store._load()
+    store.clear()
+    assert len(store) == 0
+    assert store._load() is not snapshot
+
+
+def test_database_uses_wal(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    SQLiteObservationStore(path)
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+
+def test_single_appends_are_compacted(tmp_path):
+    store = SQLiteObservationStore(str(tmp_path / 'observations.db'))
+    for k in range(COMPACT_BATCHES + 5):
+        store.append(1.0, 10.0, 2460000.5 + k, 'a.png' if k == 3 else None)
+
+    connection = sqlite3.connect(store.path)
+    assert connection.execute("SELECT count(*) FROM observation_batches").fetchone()[0] <= COMPACT_BATCHES
+    assert len(store) == COMPACT_BATCHES + 5
+    np.testing.assert_array_equal(store.jd, 2460000.5 + np.arange(COMPACT_BATCHES + 5))
+    assert store.image_filename(3) == 'a.png' and store.image_filename(4) is None
+
+
+def test_row_per_observation_table_is_migrated(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE observations (id INTEGER PRIMARY KEY, jd REAL NOT NULL, "
+                       "ra_hours REAL NOT NULL, dec_degrees REAL NOT NULL, image_filename TEXT)")
+    connection.executemany("INSERT INTO observations (jd, ra_hours, dec_degrees, image_filename) VALUES (?, ?, ?, ?)",
+                           [(2460001.5, 1.0, 10.0, None), (2460000.5, 2.0, 20.0, 'a.png')])
+    connection.commit()
+    connection.close()
+
+    store = SQLiteObservationStore(path)
+    np.testing.assert_array_equal(store.jd, [2460001.5, 2460000.5])
+    assert store.image_filename(1) == 'a.png'
+    assert SQLiteObservationStore(path).ra_hours.tolist() == [1.0, 2.0]
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    SQLiteObservationStore(path)
+
+    def write(worker):
+        store = SQLiteObservationStore(path)
+        for k in range(20):
+            store.extend(np.full(5, worker), np.zeros(5), 2460000.5 + k + np.arange(5))
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    store = SQLiteObservationStore(path)
+    assert len(store) == 4 * 20 * 5
+    np.testing.assert_array_equal(np.bincount(store.ra_hours.astype(int)), [100] * 4)
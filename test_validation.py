@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+
+import benchmarks
+from validation import (DEC_NOT_NUMBER, DUPLICATE_TIME, IMPLAUSIBLE_MOTION, RA_OUT_OF_RANGE, TIME_INVALID,
+                        summarize, validate_observations)
+
+
+def test_flags_each_bad_row_once():
+    jd, ra, dec = (a.copy() for a in benchmarks.synthetic_arc(1000))
+    ra[10] = 24.5
+    dec[20] = np.nan
+    jd[30] = np.inf
+    jd[41] = jd[40] + 0.1 / 86400
+    dec[500] -= 20.0  # скачок на 20° за 3 часа
+
+    flags = validate_observations(ra, dec, jd)
+
+    assert {int(row): int(flags[row]) for row in np.flatnonzero(flags)} == {
+        10: RA_OUT_OF_RANGE, 20: DEC_NOT_NUMBER, 30: TIME_INVALID, 41: DUPLICATE_TIME, 500: IMPLAUSIBLE_MOTION}
+    valid, errors = summarize(flags)
+    assert np.count_nonzero(~valid) == 5 and errors['Duplicate observation time'] == 1
+
+
+def test_unsorted_batch_checked_against_reference():
+    jd, ra, dec = benchmarks.synthetic_arc(2000)
+    reference = (jd[:100], ra[:100], dec[:100])
+    order = np.random.default_rng(0).permutation(np.arange(95, 200))
+    ra_batch = ra[order].copy()
+    ra_batch[order == 150] += 1.0  # 15° от соседей, до которых 1.4 часа
+
+    flags = validate_observations(ra_batch, dec[order], jd[order], reference)
+
+    assert set(order[flags == DUPLICATE_TIME]) == set(range(95, 100))
+    assert order[flags == IMPLAUSIBLE_MOTION].tolist() == [150]
+    assert np.count_nonzero(flags) == 6
+
+
+def test_fast_motion_of_close_comet_is_plausible():
+    # Соседние точки на 30° в сутки и одна пара наблюдений двух обсерваторий почти одновременно
+    jd = 2460000.5 + np.array([0.0, 0.5, 0.5 + 2 / 86400, 1.0, 1.5])
+    ra = np.array([1.0, 2.0, 2.0 + 20 / 3600 / 15, 3.0, 4.0])
+    assert not validate_observations(ra, np.zeros(5), jd).any()
+
+
+def test_large_batch_is_fast():
+    jd, ra, dec = benchmarks.synthetic_arc(100000)
+    started = time.perf_counter()
+    flags = validate_observations(ra, dec, jd)
+    assert time.perf_counter() - started < 0.5
+    assert not flags.any()
@@ -0,0 +1,47 @@
+import pytest
+
+from observation_store import ObservationStore
+from sqlite_store import SQLiteObservationStore
+from workspaces import DEFAULT_OBJECT, Workspaces, valid_object_id
+
+
+def test_objects_have_separate_observations():
+    workspaces = Workspaces()
+    first = workspaces.create('C-2025-A1')
+    second = workspaces.create('P.12_b')
+    first.append(1.0, 10.0, 2460000.5)
+
+    assert isinstance(first, ObservationStore)
+    assert len(workspaces.get('C-2025-A1')) == 1
+    assert len(second) == 0
+    assert list(workspaces) == [DEFAULT_OBJECT, 'C-2025-A1', 'P.12_b']
+    assert workspaces.get('unknown') is None
+
+
+def test_object_ids_are_validated():
+    workspaces = Workspaces()
+    for object_id in ('../etc', 'a/b', '', '.hidden', 'x' * 65):
+        assert not valid_object_id(object_id)
+        with pytest.raises(ValueError):
+            workspaces.create(object_id)
+    with pytest.raises(ValueError):
+        workspaces.remove(DEFAULT_OBJECT)
+
+
+def test_sqlite_objects_are_shared_between_processes(tmp_path):
+    directory = str(tmp_path / 'objects')
+    first = Workspaces(directory)
+    second = Workspaces(directory)
+
+    store = first.create('C-2025-A1')
+    store.extend([1.0, 2.0], [10.0, 20.0], [2460000.5, 2460001.5])
+    assert isinstance(store, SQLiteObservationStore)
+    assert 'C-2025-A1' in second
+    assert len(second.get('C-2025-A1')) == 2
+
+    first.remove('C-2025-A1')
+    assert list(first) == list(second) == [DEFAULT_OBJECT]
+    assert 'C-2025-A1' not in second
+    assert second.get('C-2025-A1') is None
+    # Заново созданный объект — новая пустая база, а не закрытое хранилище
+    assert len(second.create('C-2025-A1')) == 0
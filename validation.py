@@ -0,0 +1,133 @@
+"""
+Проверка массивов наблюдений перед записью.
+
+Каждая строка получает битовую маску нарушений: координаты вне диапазона или
+не числа, неразборчивый момент, повтор момента уже принятого наблюдения и
+невозможное движение относительно соседей по времени. Все проверки — один
+векторный проход (сортировка и разности соседей), поэтому 10^5 строк
+проверяются за миллисекунды. Ошибочные строки отмечаются, а не валят пакет:
+вызывающий код записывает остальные и сообщает, сколько и почему отброшено.
+"""
+import numpy as np
+
+RA_NOT_NUMBER = 1
+RA_OUT_OF_RANGE = 2
+DEC_NOT_NUMBER = 4
+DEC_OUT_OF_RANGE = 8
+TIME_INVALID = 16
+DUPLICATE_TIME = 32
+IMPLAUSIBLE_MOTION = 64
+
+MESSAGES = {
+    RA_NOT_NUMBER: "Right Ascension must be a number",
+    RA_OUT_OF_RANGE: "Right Ascension must be between 0 and 24 hours",
+    DEC_NOT_NUMBER: "Declination must be a number",
+    DEC_OUT_OF_RANGE: "Declination must be between -90 and 90 degrees",
+    TIME_INVALID: "Invalid observation time format",
+    DUPLICATE_TIME: "Duplicate observation time",
+    IMPLAUSIBLE_MOTION: "Implausible motion between adjacent observations",
+}
+
+# Наблюдения ближе по времени считаются повтором одного и того же
+DUPLICATE_SECONDS = 0.5
+# Наибольшая видимая скорость, град/сутки: с запасом для комет у самой Земли
+MAX_RATE = 60.0
+# Допуск на ошибки измерения и параллакс между обсерваториями, угловые секунды
+MOTION_TOLERANCE = 60.0
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Угловое расстояние в градусах (формула гаверсинусов), RA в часах"""
+    ra1, ra2 = np.radians(ra1 * 15), np.radians(ra2 * 15)
+    dec1, dec2 = np.radians(dec1), np.radians(dec2)
+    h = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.minimum(h, 1.0))))
+
+
+def _implausible(jd, ra_hours, dec_degrees, max_rate, tolerance):
+    """
+    Маска точек упорядоченного ряда, до которых нельзя дойти ни от одного соседа.
+    Точка отмечается, только если невозможны обе ее связи: одиночный выброс
+    не тянет за собой соседей. У крайних точек вторая связь — со следующим
+    за соседом наблюдением; из двух точек отмечаются обе.
+    """
+    count = len(jd)
+    if count < 2:
+        return np.zeros(count, dtype=bool)
+
+    def too_fast(first, second):
+        limit = max_rate * (jd[second] - jd[first]) + tolerance / 3600
+        separation = angular_separation(ra_hours[first], dec_degrees[first], ra_hours[second], dec_degrees[second])
+        return separation > limit
+
+    links = too_fast(slice(0, -1), slice(1, None))
+    before = np.concatenate([[True], links])
+    after = np.concatenate([links, [True]])
+    if count >= 3:
+        before[0] = too_fast(0, 2)
+        after[-1] = too_fast(-3, -1)
+    return before & after
+
+
+def validate_observations(ra_hours, dec_degrees, jd, reference=None, max_rate=MAX_RATE,
+                          tolerance=MOTION_TOLERANCE, duplicate_seconds=DUPLICATE_SECONDS):
+    """
+    Маска нарушений (uint8, 0 — строка корректна) для массивов наблюдений.
+    reference — уже принятые наблюдения (jd, ra_hours, dec_degrees),
+    упорядоченные по времени: повторы и движение проверяются и относительно
+    ближайших из них.
+    """
+    ra_hours = np.asarray(ra_hours, dtype=float)
+    dec_degrees = np.asarray(dec_degrees, dtype=float)
+    jd = np.asarray(jd, dtype=float)
+    flags = np.zeros(len(jd), dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        flags[~np.isfinite(ra_hours)] |= RA_NOT_NUMBER
+        flags[(ra_hours < 0) | (ra_hours >= 24)] |= RA_OUT_OF_RANGE
+        flags[~np.isfinite(dec_degrees)] |= DEC_NOT_NUMBER
+        flags[(dec_degrees < -90) | (dec_degrees > 90)] |= DEC_OUT_OF_RANGE
+    flags[~np.isfinite(jd)] |= TIME_INVALID
+
+    # Корректные строки пакета вместе с соседними по времени наблюдениями reference
+    owner = np.flatnonzero(flags == 0)
+    times, ra_values, dec_values = jd[owner], ra_hours[owner], dec_degrees[owner]
+    if reference is not None and len(reference[0]) and len(owner):
+        ref_jd, ref_ra, ref_dec = (np.asarray(column, dtype=float) for column in reference)
+        position = np.searchsorted(ref_jd, times)
+        near = np.unique(np.concatenate([position - 1, position]))
+        near = near[(near >= 0) & (near < len(ref_jd))]
+        owner = np.concatenate([owner, np.full(len(near), -1)])
+        times = np.concatenate([times, ref_jd[near]])
+        ra_values = np.concatenate([ra_values, ref_ra[near]])
+        dec_values = np.concatenate([dec_values, ref_dec[near]])
+    if len(times) > 1 and np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        owner, times, ra_values, dec_values = owner[order], times[order], ra_values[order], dec_values[order]
+    new = owner >= 0
+
+    # Из пары совпадающих моментов отбрасывается строка пакета, из двух таких — вторая
+    close = np.diff(times) * 86400 < duplicate_seconds
+    repeated = np.zeros(len(times), dtype=bool)
+    repeated[1:] |= close & new[1:]
+    repeated[:-1] |= close & new[:-1] & ~new[1:]
+    flags[owner[repeated]] |= DUPLICATE_TIME
+
+    kept = ~repeated
+    implausible = _implausible(times[kept], ra_values[kept], dec_values[kept], max_rate, tolerance)
+    flags[owner[kept][implausible & new[kept]]] |= IMPLAUSIBLE_MOTION
+    return flags
+
+
+def summarize(flags):
+    """Маска корректных строк и {сообщение: число строк с этим нарушением}"""
+    errors = {}
+    for flag, message in MESSAGES.items():
+        count = int(np.count_nonzero(flags & flag))
+        if count:
+            errors[message] = count
+    return flags == 0, errors
+
+
+def flagged_rows(flags, flag):
+    """Номера строк с нарушением flag"""
+    return np.flatnonzero(flags & flag)
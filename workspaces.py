@@ -0,0 +1,111 @@
+"""
+Рабочие области объектов: у каждого отслеживаемого объекта свой набор наблюдений.
+
+Без каталога хранилища живут в памяти процесса (ObservationStore); если каталог
+задан, у каждого объекта своя база SQLite <каталог>/<объект>.sqlite, так что
+объекты, созданные другими процессами, видны всем. Идентификатор объекта входит
+в адреса страниц и в имена файлов, поэтому допускаются только буквы, цифры,
+точка, дефис и подчеркивание.
+"""
+import os
+import re
+import threading
+
+from observation_store import ObservationStore
+from sqlite_store import SQLiteObservationStore
+
+DEFAULT_OBJECT = 'default'
+_OBJECT_ID = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}')
+_SUFFIX = '.sqlite'
+
+
+def valid_object_id(object_id):
+    return bool(_OBJECT_ID.fullmatch(object_id or ''))
+
+
+class Workspaces:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._stores = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.create(DEFAULT_OBJECT)
+
+    def _path(self, object_id):
+        return os.path.join(self.directory, object_id + _SUFFIX)
+
+    def _open(self, object_id):
+        if self.directory:
+            return SQLiteObservationStore(self._path(object_id))
+        return ObservationStore()
+
+    def _cached(self, object_id):
+        """
+        Открытое процессом хранилище объекта. Если его файл удалил другой процесс
+        или другой экземпляр, хранилище забывается и закрывается, чтобы записи не
+        уходили в удаленную базу.
+        """
+        with self._lock:
+            store = self._stores.get(object_id)
+            if store is None or not self.directory or os.path.exists(self._path(object_id)):
+                return store
+            del self._stores[object_id]
+        store.close()
+        return None
+
+    def __contains__(self, object_id):
+        if self._cached(object_id) is not None:
+            return True
+        return bool(self.directory) and valid_object_id(object_id) \
+            and os.path.exists(self._path(object_id))
+
+    def __iter__(self):
+        """Идентификаторы объектов по алфавиту, объект по умолчанию первым"""
+        if self.directory:
+            # Только файлы: открытые здесь хранилища могли быть удалены другим процессом
+            names = {name[:-len(_SUFFIX)] for name in os.listdir(self.directory) if name.endswith(_SUFFIX)}
+        else:
+            with self._lock:
+                names = set(self._stores)
+        return iter(sorted(names, key=lambda name: (name != DEFAULT_OBJECT, name)))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, object_id):
+        """Хранилище объекта или None, если такого объекта нет"""
+        if object_id not in self:
+            return None
+        return self.create(object_id)
+
+    def create(self, object_id):
+        """Хранилище объекта; создается, если его еще нет"""
+        if not valid_object_id(object_id):
+            raise ValueError(f"Invalid object id: {object_id!r}")
+        self._cached(object_id)
+        with self._lock:
+            store = self._stores.get(object_id)
+            if store is None:
+                store = self._stores[object_id] = self._open(object_id)
+            return store
+
+    def remove(self, object_id):
+        if object_id == DEFAULT_OBJECT:
+            raise ValueError("The default object cannot be removed")
+        with self._lock:
+            store = self._stores.pop(object_id, None)
+        if self.directory:
+            if store is not None:
+                store.close()
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self._path(object_id) + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def items(self):
+        for object_id in self:
+            store = self.get(object_id)
+            if store is not None:
+                yield object_id, store